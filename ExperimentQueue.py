@@ -0,0 +1,232 @@
+#===============================================================================================
+#   Name:           ExperimentQueue.py
+#   Description:    Runs a queue of declared experiments unattended
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#   The queue file lists experiments as settings instead of edited copies of ExperimentTemplate.py
+#   (see scans/Experiment.py for the format). The devices are created and connected once and
+#   shared by all the entries, the entries are reordered so the cryostat passes through its
+#   temperatures once, and a timing report is rewritten after every entry.
+#
+#       python ExperimentQueue.py overnight.json
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import os, sys
+import json
+import time
+import argparse
+
+import logging
+FORMAT = '%(asctime)s @ %(levelname)s --- %(filename)s: %(message)s'
+logging.basicConfig(format=FORMAT, stream=sys.stdout, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import PumpProbe_Galium_300K as PumpProbe
+import devices.DeviceServer as DeviceServer
+import devices.Telemetry as Telemetry
+import scans.Experiment as Experiment
+import scans.PhaseTimer as PhaseTimer
+import storage.Catalog as Catalog
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+REPORT_SUFFIX = '.report.json'
+
+STATUS_FINISHED = 'finished'
+STATUS_FAILED = 'failed'
+STATUS_INTERRUPTED = 'interrupted'
+
+#===============================================================================================
+#   DevicePool
+#===============================================================================================
+class DevicePool(object):
+    """
+    The devices of a queue by registry name - created and connected on first use and kept
+    connected for the next experiments
+    """
+
+    def __init__(self, server_address=None):
+        super(DevicePool, self).__init__()
+        self._create_device = PumpProbe.device_factory(server_address)
+        self.devices = {}
+
+    def create_device(self, name, *args, **kwargs):
+        if name not in self.devices:
+            self.devices[name] = self._create_device(name, *args, **kwargs)
+        return self.devices[name]
+
+    def connected_device(self, name):
+        """
+        The pool's device name if it is already connected (None otherwise)
+        """
+        dev = self.devices.get(name)
+        return dev if dev is not None and dev.is_connected else None
+
+    def connect(self, *devices):
+        """
+        Connects the devices that are not connected yet. Returns True if all of them are connected.
+        """
+        return PumpProbe.connect_devices(*[dev for dev in devices if not dev.is_connected])
+
+    def close(self):
+        PumpProbe.close_devices(*[dev for dev in self.devices.values() if dev.is_connected])
+        self.devices = {}
+
+#===============================================================================================
+#   Functions
+#===============================================================================================
+def write_report(report, report_path):
+    temp_path = report_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(report, f, indent=4, default=str)
+    os.replace(temp_path, report_path)
+
+def current_temperature(experiments, pool):
+    """
+    The cryostat temperature before the queue starts (None if no experiment uses the cryostat)
+    """
+    cooled = [experiment for experiment in experiments if experiment.uses_cryostat]
+    if not cooled:
+        return None
+
+    cryostat_dev = pool.create_device(cooled[0].devices['cryostat'])
+    if not pool.connect(cryostat_dev):
+        return None
+    return cryostat_dev.get_temperature()
+
+def run_entry(experiment, pool, catalog, entry=None):
+    """
+    Runs one queued experiment and fills its report entry (also when interrupted). Returns the entry.
+    """
+    entry = entry if entry is not None else {}
+    entry.update({
+        'name'              :   experiment.name,
+        'status'            :   STATUS_FAILED,
+        'started'           :   time.strftime('%Y-%m-%d %H:%M:%S'),
+        'data_path'         :   None,
+        'error'             :   None,
+    })
+
+    timer = PhaseTimer.PhaseTimer()
+    timer.start()
+    try:
+        connect_start = time.perf_counter()
+        lockin_dev, standa_dev, cryostat_dev = PumpProbe.create_experiment_devices(experiment, create_device=pool.create_device)
+        if not pool.connect(*[dev for dev in (lockin_dev, standa_dev, cryostat_dev) if dev is not None]):
+            entry['error'] = "Failed connecting the devices"
+            return entry
+        entry['connect_time'] = time.perf_counter() - connect_start
+
+        # a cryostat connected for other entries is only read, for the catalog temperature
+        if cryostat_dev is None:
+            cryostat_dev = pool.connected_device(experiment.devices.get('cryostat'))
+
+        data_path, _, measurements_x, _ = PumpProbe.run_experiment(lockin_dev, standa_dev, cryostat_dev, experiment, catalog, timer=timer)
+        entry['data_path'] = data_path
+        entry['status'] = STATUS_FINISHED if measurements_x is not None else STATUS_FAILED
+    except KeyboardInterrupt:
+        entry['status'] = STATUS_INTERRUPTED
+        raise
+    except Exception as err:
+        # one broken entry must not cost the rest of the night
+        logger.exception("Experiment %s failed." % (experiment.name, ))
+        entry['error'] = repr(err)
+    finally:
+        timer.stop()
+        entry['finished'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        entry.update(timer.summary())
+
+    return entry
+
+def run_queue(experiments, pool, catalog, report_path=None, keep_order=False):
+    """
+    Runs the experiments one after the other on the pool's devices. Returns the report - the
+    queue order plus one timing entry per experiment (with the duration expected before it ran) -
+    which is also rewritten to report_path after every experiment.
+    """
+    expected = [PumpProbe.estimate_planned_duration(experiment) for experiment in experiments]
+    order = list(range(len(experiments)))
+    if not keep_order:
+        order, descending = Experiment.queue_order(experiments, current_temperature(experiments, pool), expected)
+        experiments = [Experiment.in_temperature_direction(experiment, descending) for experiment in experiments]
+
+    report = {
+        'started'           :   time.strftime('%Y-%m-%d %H:%M:%S'),
+        'order'             :   [experiments[index].name for index in order],
+        'expected_duration' :   sum(expected),
+        'entries'           :   [],
+    }
+    logger.info("Queue order: %s (at least %.1f minutes)" % (", ".join(report['order']), report['expected_duration'] / 60))
+
+    try:
+        for number, index in enumerate(order):
+            experiment = experiments[index]
+            logger.info("Experiment %d/%d: %s" % (number + 1, len(order), experiment.name))
+            entry = {'queue_index': index, 'expected_duration': expected[index]}
+            report['entries'].append(entry)
+            run_entry(experiment, pool, catalog, entry)
+            logger.info("Experiment %s %s in %.1f minutes" % (experiment.name, entry['status'], entry.get('total_time', 0) / 60))
+            if report_path is not None:
+                write_report(report, report_path)
+    finally:
+        report['finished'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        if report_path is not None:
+            write_report(report, report_path)
+
+    return report
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("queue", help="json queue file")
+    parser.add_argument("--simulate", action="store_true", help="default the devices to the simulated ones")
+    parser.add_argument("--device-server", type=DeviceServer.parse_address, default=None, metavar="[HOST:]PORT",
+                        help="use the instruments held open by a running device server")
+    parser.add_argument("--catalog", default=Catalog.DEFAULT_CATALOG_PATH, help="run catalog the runs are registered in")
+    parser.add_argument("--report", default=None, help="timing report path. Defaults to the queue file + " + REPORT_SUFFIX)
+    parser.add_argument("--keep-order", action="store_true", help="run the experiments in the queue file order")
+    parser.add_argument("--metrics-file", default=None, help="rewrite the device command metrics to this json file while running")
+    parser.add_argument("--metrics-port", type=int, default=None, help="serve the device command metrics on http://%s:PORT/" %
+                        (Telemetry.METRICS_HOST, ))
+    parser.add_argument("--dry-run", action="store_true", help="only print the run order")
+    return parser.parse_args()
+
+#===============================================================================================
+#   Main
+#===============================================================================================
+def main():
+    args = parse_args()
+
+    defaults = PumpProbe.default_experiment()
+    if args.simulate:
+        defaults['devices'] = Experiment.SIMULATED_DEVICES
+    experiments = Experiment.load_queue(args.queue, defaults)
+
+    if args.dry_run:
+        durations = [PumpProbe.estimate_planned_duration(experiment) for experiment in experiments]
+        experiments = experiments if args.keep_order else Experiment.order_queue(experiments, durations=durations)
+        for experiment in experiments:
+            print("%-30s %-9s %4d points  %7.1f min  T=%s" % (experiment.name, experiment.scan_mode, len(experiment.locations_in_mm),
+                                                             PumpProbe.estimate_planned_duration(experiment) / 60, experiment.temperatures or "-"))
+        return
+
+    pool = DevicePool(args.device_server)
+    exporters = Telemetry.start_exporters(args.metrics_file, args.metrics_port)
+    try:
+        with Catalog.RunCatalog(args.catalog) as catalog:
+            report = run_queue(experiments, pool, catalog, args.report or os.path.splitext(args.queue)[0] + REPORT_SUFFIX, args.keep_order)
+    finally:
+        pool.close()
+        Telemetry.stop_exporters(exporters)
+
+    for entry in report['entries']:
+        print("%-30s %-12s %8.1f min  %s" % (entry['name'], entry['status'], entry.get('total_time', 0) / 60, entry.get('data_path') or entry.get('error')))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,11 @@
 import os, sys
 import argparse
 
+import logging
+FORMAT = '%(asctime)s @ %(levelname)s --- %(filename)s: %(message)s'
+logging.basicConfig(format=FORMAT, stream=sys.stdout, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
 #===============================================================================================
 #	Solution Imports
 #===============================================================================================
@@ -33,10 +38,17 @@ def init():
 def main():
 	# initiates all parameters, devices and connections
 	init()
+	cryostat_dev = devices.Attodry.CryostatDevice()
+	cryostat_dev.connect()
+	if not cryostat_dev.is_connected:
+		return
 
 	# get/set Attodry temperature
-	devices.Attodry.get_temperature()
-	devices.Attodry.set_temperature(301)
+	logger.info("Cryostat temperature: %s K" % (cryostat_dev.get_temperature(), ))
+	cryostat_dev.set_temperature(301)
+
+	# close all devices and connections
+	cryostat_dev.close()
 
 
 if __name__ == '__main__':
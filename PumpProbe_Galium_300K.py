@@ -7,8 +7,10 @@
 #   Python Imports
 #===============================================================================================
 import os, sys
+import time
+import atexit
+import asyncio
 import argparse
-import pandas as pd
 import numpy as np
 import scipy.constants
 import matplotlib.pyplot as plt
@@ -21,8 +23,24 @@ logger = logging.getLogger(__name__)
 #===============================================================================================
 #   Solution Imports
 #===============================================================================================
-import devices.SR860 as sr860
-import devices.standa as standa
+import devices.AutoLabDevice as AutoLabDevice
+import devices.Registry as Registry
+import devices.Telemetry as Telemetry
+import devices.DeviceServer as DeviceServer
+import devices.Trace as Trace
+import devices.SR860 as SR860
+import scans.FlyScan as FlyScan
+import scans.LiveViewer as LiveViewer
+import scans.AdaptiveScan as AdaptiveScan
+import scans.Checkpoint as Checkpoint
+import scans.Experiment as Experiment
+import scans.PhaseTimer as PhaseTimer
+import scans.Pipeline as Pipeline
+import scans.Scheduler as Scheduler
+import scans.Statistics as Statistics
+import scans.SweepAverager as SweepAverager
+import storage.Catalog as Catalog
+import storage.MeasurementWriter as MeasurementWriter
 
 #===============================================================================================
 #   Constants
@@ -31,78 +49,664 @@ STANDA_LOCATIONS_IN_MM = np.linspace(start=10, stop=-10, num=100)
 LOCKIN_SAMPLE_COUNT_PER_STANDA_LOC = 300
 LOCKIN_ALL_SAMPLES_DURATION_IN_SEC = 4
 CSV_PATH = r'measurements.csv'
+AVERAGE_CSV_PATH = r'measurements_average.csv'     # sweep average, rewritten after every sweep
+CSV_SUFFIX = '.csv'                 # queued runs export next to their data files
+AVERAGE_SUFFIX = '_average.csv'
+DATA_DIR = r'data'      # every run writes its binary data files to a new base path here, exported to CSV_PATH at the end
+EXPERIMENT_NAME = 'PumpProbe_Galium_300K'
+SAMPLE_TEMPERATURE_IN_K = 300   # the sample temperature this script measures at (catalogued when it sets no temperatures)
+CAPTURE_ATTEMPTS = 3            # a stream window can be overwritten or stall - capture the point again before giving up
+
+SCAN_MODE_STEP = 'step'     # move, settle and capture at every location
+SCAN_MODE_FLY = 'fly'       # constant speed motion while the lock-in streams, binned afterwards
+SCAN_MODE_ADAPTIVE = 'adaptive'     # coarse grid, then refine where the signal changes
+SCAN_MODES = [SCAN_MODE_STEP, SCAN_MODE_FLY, SCAN_MODE_ADAPTIVE]
 
 #===============================================================================================
 #   Functions
 #===============================================================================================
-def connect_devices(*devices):
-    for dev in devices:
-        dev.connect()
-        if not dev.is_connected:
-            return False
+def connect_outcome(devices, results):
+    """
+    Checks the connect results (None or the raised exception) of the devices - AutoLabDeviceErrors
+    are logged as failed connects. Returns whether all connected and the first other exception (or None).
+    """
+    connected, failure = True, None
+    for dev, result in zip(devices, results):
+        if isinstance(result, AutoLabDevice.AutoLabDeviceError):
+            logger.error("Failed connecting %s: %s" % (type(dev).__name__, result))
+            connected = False
+        elif isinstance(result, BaseException):
+            failure = failure or result
+        elif not dev.is_connected:
+            connected = False
+
+    return connected, failure
+
+def opened_devices(devices, results):
+    return [dev for dev, result in zip(devices, results) if not isinstance(result, BaseException) and dev.is_connected]
 
+async def connect_devices_async(*devices):
+    """
+    Connects all the devices in parallel. Returns True if all of them connected.
+    An unexpected connect error is raised after the devices that did connect are closed again.
+    """
+    results = await asyncio.gather(*[dev.connect_async() for dev in devices], return_exceptions=True)
+    connected, failure = connect_outcome(devices, results)
+    if failure is not None:
+        await close_devices_async(*opened_devices(devices, results))
+        raise failure
+    return connected
+
+async def close_devices_async(*devices):
+    await asyncio.gather(*[dev.close_async() for dev in devices])
+
+def in_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
     return True
 
+def connect_devices(*devices):
+    if not in_event_loop():
+        return asyncio.run(connect_devices_async(*devices))
+
+    # asyncio.run can't start inside a running loop (e.g. Jupyter) - connect one after the other
+    results = []
+    for dev in devices:
+        try:
+            results.append(dev.connect())
+        except Exception as err:
+            results.append(err)
+    connected, failure = connect_outcome(devices, results)
+    if failure is not None:
+        close_devices(*opened_devices(devices, results))
+        raise failure
+    return connected
+
 def close_devices(*devices):
+    if not in_event_loop():
+        asyncio.run(close_devices_async(*devices))
+        return
+
     for dev in devices:
         dev.close()
 
-def write_measurement_to_csv(x, y, xerr='', yerr='', header=False):
-    csv_row = {
-        't'         :   [x, ],
-        't_err'     :   [xerr, ],
-        'DR'        :   [y, ],
-        'DR err'    :   [yerr, ]
+def device_factory(server_address=None):
+    """
+    Registry.create_device, or proxies to the devices a running device server keeps open
+    """
+    if server_address is None:
+        return Registry.create_device
+    return lambda name, *args, **kwargs: DeviceServer.RemoteDevice(name, *args, address=server_address, **kwargs)
+
+def create_devices(simulate=False, server_address=None):
+    """
+    Returns the lock-in and stage devices. Simulated devices run without the instruments.
+    """
+    create_device = device_factory(server_address)
+    if simulate:
+        standa_dev = create_device('simulated_standa')
+        lockin_dev = create_device('simulated_sr860', stage=standa_dev)
+        return lockin_dev, standa_dev
+
+    return create_device('sr860'), create_device('standa')
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--simulate", action="store_true", help="run against simulated devices")
+    parser.add_argument("--scan-mode", choices=SCAN_MODES, default=SCAN_MODE_STEP, help="delay scan mode")
+    parser.add_argument("--device-server", type=DeviceServer.parse_address, default=None, metavar="[HOST:]PORT",
+                        help="use the instruments held open by a running device server (python -m devices.DeviceServer)")
+    parser.add_argument("--capture-mode", choices=SR860.CAPTURE_MODES, default=None, help="lock-in capture mode. "
+                        "stream keeps the lock-in streaming for the whole run")
+    parser.add_argument("--stage-speed", type=float, default=None, help="fly scan stage speed (mm/sec). "
+                        "Defaults to one grid step per LOCKIN_ALL_SAMPLES_DURATION_IN_SEC")
+    parser.add_argument("--max-points", type=int, default=None, help="adaptive scan point budget. Defaults to the grid size")
+    parser.add_argument("--resolution", type=float, default=AdaptiveScan.RESOLUTION_IN_MM, help="adaptive scan finest spacing (mm)")
+    parser.add_argument("--target-error", type=float, default=None, help="step scan: sample each point until the standard error "
+                        "of X reaches this value (V) instead of a fixed sample count")
+    parser.add_argument("--independent-samples", type=int, default=None, help="pick the lock-in capture rate, samples per "
+                        "point and settle time from its time constant and filter slope to collect this many uncorrelated samples per point")
+    parser.add_argument("--sweeps", type=int, default=1, help="step scan: repeat the delay sweep up to this many times, "
+                        "alternating direction, and average the sweeps")
+    parser.add_argument("--noise-target", type=float, default=None, help="multi-sweep: stop sweeping once the standard error "
+                        "of every averaged point is below this value (V)")
+    parser.add_argument("--outlier-factor", type=float, default=SweepAverager.OUTLIER_FACTOR, help="multi-sweep: drop sweeps "
+                        "deviating more than this factor times the typical sweep. 0 keeps all")
+    parser.add_argument("--resume", action="store_true", help="continue an interrupted step or adaptive scan - the one in "
+                        "--data-path, or the latest unfinished run in the catalog. The configuration has to match the checkpoint")
+    parser.add_argument("--data-path", default=None, help="base path of the data files. Defaults to a new path in DATA_DIR")
+    parser.add_argument("--catalog", default=Catalog.DEFAULT_CATALOG_PATH, help="run catalog the run is registered in")
+    parser.add_argument("--temperatures", type=float, nargs='+', default=None, help="step scan: repeat the delay scan at "
+                        "each cryostat temperature (K)")
+    parser.add_argument("--record", default=None, metavar="TRACE", help="record the device commands of the session to a trace file")
+    parser.add_argument("--replay", default=None, metavar="TRACE", help="run against a recorded trace instead of the instruments")
+    parser.add_argument("--replay-time-scale", type=float, default=1.0, help="multiplies the recorded command latencies on "
+                        "replay. 0 replays as fast as possible")
+    parser.add_argument("--metrics-file", default=None, help="rewrite the device command metrics to this json file every "
+                        "%g sec while running" % (Telemetry.FLUSH_INTERVAL_IN_SEC, ))
+    parser.add_argument("--metrics-port", type=int, default=None, help="serve the device command metrics on http://%s:PORT/" %
+                        (Telemetry.METRICS_HOST, ))
+    parser.add_argument("--live", action="store_true", help="plot the points while scanning, in a separate viewer process")
+    parser.add_argument("--live-raw", action="store_true", help="with --live, also show the raw samples of the latest point")
+    return parser.parse_args()
+
+def move_to_location(standa_dev, loc, timer):
+    # move stage and wait for it to stop moving
+    with timer.phase(PhaseTimer.PHASE_MOVE):
+        standa_dev.move_stage(loc)
+    settle_time = getattr(standa_dev, 'last_settle_time', None)
+    if settle_time is not None:
+        timer.add(PhaseTimer.PHASE_MOVE, -settle_time)
+        timer.add(PhaseTimer.PHASE_SETTLE, settle_time)
+
+def capture_location(lockin_dev, loc, timer, samples_count=LOCKIN_SAMPLE_COUNT_PER_STANDA_LOC, target_error=None):
+    """
+    Captures the lock-in samples of one delay point - the part that has to hold the stage still.
+    With target_error (V) the lock-in keeps sampling until the X mean is known that well.
+    Raises AutoLabDevice.AutoLabDeviceError if no capture succeeded in CAPTURE_ATTEMPTS tries.
+    """
+    # let the lock-in filter settle on the new delay
+    if lockin_dev.settle_time:
+        with timer.phase(PhaseTimer.PHASE_SETTLE):
+            time.sleep(lockin_dev.settle_time)
+
+    # take measurements from lockin
+    logging.info("measuring location %.2f" % (loc, ))
+    for attempt in range(CAPTURE_ATTEMPTS):
+        with timer.phase(PhaseTimer.PHASE_CAPTURE):
+            if target_error:
+                samples = lockin_dev.capture_until_converged(target_error)
+            else:
+                samples = lockin_dev.capture_samples(samples_count)
+        if samples[0] is not None:
+            break
+        logger.warning("Capture at location %.4f mm failed (attempt %d of %d)." % (loc, attempt + 1, CAPTURE_ATTEMPTS))
+    else:
+        raise AutoLabDevice.AutoLabDeviceError("No lock-in capture at location %.4f mm after %d attempts." % (loc, CAPTURE_ATTEMPTS))
+
+    timer.set_value('achieved_sample_frequency', lockin_dev.achieved_sample_frequency)
+    return samples
+
+def owned_samples(samples):
+    """
+    Copies the captured channels that are views (stream captures point into the lock-in ring buffer,
+    which the stream keeps overwriting), so they can be processed after the next capture
+    """
+    return tuple(channel.copy() if isinstance(channel, np.ndarray) and channel.base is not None else channel for channel in samples)
+
+def process_location(index, loc, samples, correlation, writer, timer, temperature=np.nan, background=False, checkpoint=None, sweep=0):
+    """
+    Computes and stores the statistics of one captured point. Returns the X mean, std and effective sample count.
+    With a checkpoint the point is flushed to disk and marked done.
+    """
+    with timer.phase(PhaseTimer.PHASE_STATISTICS, index, background):
+        x_mean, x_std, n_eff, _ = Statistics.correlated_statistics(samples[0], correlation)
+
+    # store summary and raw samples
+    with timer.phase(PhaseTimer.PHASE_WRITE, index, background):
+        t = loc * 2 / scipy.constants.c       # delta time
+        writer.append(index, loc, t, x_mean, x_std, samples=samples, n_eff=n_eff, temperature=temperature, sweep=sweep)
+        Telemetry.METRICS.increment('scan.points')
+        if checkpoint is not None:
+            writer.flush()
+            checkpoint.mark_done(index, [loc, x_mean, x_std, n_eff])
+
+    return x_mean, x_std, n_eff
+
+def measure_location(lockin_dev, standa_dev, index, loc, writer, timer, samples_count=LOCKIN_SAMPLE_COUNT_PER_STANDA_LOC, target_error=None,
+                     checkpoint=None):
+    """
+    Moves to loc, captures and stores one delay point. Returns the X mean, std and effective sample count.
+    """
+    timer.start_point(index, location=loc)
+    move_to_location(standa_dev, loc, timer)
+    samples = capture_location(lockin_dev, loc, timer, samples_count, target_error)
+    return process_location(index, loc, samples, lockin_dev.sample_correlation, writer, timer, checkpoint=checkpoint)
+
+def build_step_scheduler(standa_dev, locations, timer, cryostat_dev=None, temperatures=None):
+    """
+    Delay axis (and optionally a temperature axis) for the step scan. The scheduler nests the
+    temperature outside the delay and sweeps the delay back and forth.
+    """
+    speed = standa_dev.get_speed() or Scheduler.STAGE_SPEED_IN_MM_PER_SEC
+    position_axis = Scheduler.stage_axis(standa_dev, locations, speed=speed)
+    position_axis.set_value = lambda loc: move_to_location(standa_dev, loc, timer)
+    axes = [position_axis]
+    if temperatures:
+        temperature_axis = Scheduler.temperature_axis(cryostat_dev, temperatures)
+        set_temperature = temperature_axis.set_value
+        def timed_set_temperature(temperature):
+            with timer.phase(PhaseTimer.PHASE_TEMPERATURE):
+                set_temperature(temperature)
+        temperature_axis.set_value = timed_set_temperature
+        axes.append(temperature_axis)
+
+    return Scheduler.ScanScheduler(axes)
+
+def run_step_scan(lockin_dev, standa_dev, locations, writer, timer=None, samples_count=LOCKIN_SAMPLE_COUNT_PER_STANDA_LOC, target_error=None,
+                  cryostat_dev=None, temperatures=None, checkpoint=None, index_offset=0, sweep=0):
+    """
+    Only the move and capture run in the scan loop. Statistics and writing are handed to a
+    background pipeline, so the next move starts as soon as a capture ends.
+    Points the checkpoint already holds are not measured again. Point indices start at index_offset.
+    """
+    timer = timer or PhaseTimer.NullPhaseTimer()
+    scheduler = build_step_scheduler(standa_dev, locations, timer, cryostat_dev, temperatures)
+    completed = set()
+    if checkpoint is not None:
+        completed = {index - index_offset for index in checkpoint.completed if 0 <= index - index_offset < len(scheduler)}
+    if completed:
+        logger.info("Resuming step scan, %d of %d points already measured." % (len(completed), len(scheduler)))
+
+    def process(index, loc, samples, correlation, temperature):
+        return process_location(index, loc, samples, correlation, writer, timer, temperature, background=True, checkpoint=checkpoint,
+                                sweep=sweep)
+
+    with Pipeline.AcquisitionPipeline(process) as pipeline:
+        def measure(index, point):
+            samples = owned_samples(capture_location(lockin_dev, point['position'], timer, samples_count, target_error))
+            pipeline.submit(index_offset + index, point['position'], samples, lockin_dev.sample_correlation, point.get('temperature', np.nan))
+
+        scheduler.run(measure, start_point=lambda index, point: timer.start_point(index_offset + index, **point), skip=completed)
+
+    def point_result(index):
+        # measured now, or on resume in an earlier session
+        if index in pipeline.results:
+            return pipeline.results[index]
+        if checkpoint is not None and checkpoint.is_done(index):
+            return checkpoint.point(index)[1:]
+        raise RuntimeError("Step scan has no result for point %d." % (index, ))
+
+    positions = np.array([point['position'] for point in scheduler.plan()])
+    results = [point_result(index_offset + i) for i in range(len(positions))]
+    measurements_x = np.array([result[0] for result in results])
+    x_std = np.array([result[1] for result in results])
+    return positions, measurements_x, x_std
+
+def run_multi_sweep_scan(lockin_dev, standa_dev, locations, writer, sweeps, timer=None, samples_count=LOCKIN_SAMPLE_COUNT_PER_STANDA_LOC,
+                         target_error=None, noise_target=None, outlier_factor=SweepAverager.OUTLIER_FACTOR, cryostat_dev=None,
+                         temperatures=None, checkpoint=None, average_path=None):
+    """
+    Repeats the step scan up to sweeps times per temperature, alternating the sweep direction,
+    and averages the sweeps point by point. The average (and its standard error over the sweeps)
+    is written to average_path after every sweep, and the sweeps stop once noise_target (V) is reached.
+    The file holds the averages of all the temperatures measured so far.
+    Returns the locations and the averaged X and standard error, one row per temperature.
+    """
+    averages = []
+    errors = []
+    finished = []       # (temperature, mean, error, sweeps) of the temperatures already averaged
+    for temperature_index, temperature in enumerate(temperatures or [None]):
+        averager = SweepAverager.SweepAverager(len(locations), outlier_factor)
+        for sweep in range(sweeps):
+            direction = 1 if sweep % 2 == 0 else -1
+            index_offset = (temperature_index * sweeps + sweep) * len(locations)
+            _, measurements_x, _ = run_step_scan(lockin_dev, standa_dev, locations[::direction], writer, timer, samples_count, target_error,
+                                                 cryostat_dev=cryostat_dev, temperatures=[temperature] if temperature is not None else None,
+                                                 checkpoint=checkpoint, index_offset=index_offset, sweep=sweep)
+            averager.add_sweep(measurements_x[::direction], direction, sweep)
+            logger.info("Sweep %d/%d: %d accepted, %d dropped, noise %.2e V" % (sweep + 1, sweeps, averager.accepted, len(averager.rejected),
+                                                                              averager.noise))
+
+            if average_path is not None:
+                current = (temperature, averager.mean, averager.standard_error, averager.stats.count)
+                MeasurementWriter.export_average_csv(average_path, locations, finished + [current])
+            if noise_target and averager.converged(noise_target):
+                logger.info("Noise target %.2e V reached after %d sweeps." % (noise_target, sweep + 1))
+                break
+
+        averages.append(averager.mean)
+        errors.append(averager.standard_error)
+        finished.append((temperature, averager.mean, averager.standard_error, averager.stats.count))
+
+    return locations, np.squeeze(averages), np.squeeze(errors)
+
+def run_adaptive_scan(lockin_dev, standa_dev, locations, writer, timer=None, samples_count=LOCKIN_SAMPLE_COUNT_PER_STANDA_LOC,
+                      max_points=None, resolution=AdaptiveScan.RESOLUTION_IN_MM, checkpoint=None):
+    """
+    Refines a coarse grid over the range of locations, up to max_points (default len(locations)) points.
+    On resume the checkpointed points are replayed - the refinement is deterministic, so it
+    picks the same positions again and continues after the last measured one.
+    """
+    timer = timer or PhaseTimer.NullPhaseTimer()
+    x_std = []
+
+    def measure(index, loc):
+        if checkpoint is not None and checkpoint.is_done(index):
+            stored_loc, x_mean, std, n_eff = checkpoint.point(index)
+            if not np.isclose(stored_loc, loc):
+                raise RuntimeError("Adaptive scan resume diverged at point %d (%.4f mm, checkpoint has %.4f mm)." % (index, loc, stored_loc))
+        else:
+            x_mean, std, n_eff = measure_location(lockin_dev, standa_dev, index, loc, writer, timer, samples_count, checkpoint=checkpoint)
+        x_std.append(std)
+        return x_mean, std / np.sqrt(n_eff)
+
+    stage_speed = standa_dev.get_speed() or AdaptiveScan.STAGE_SPEED_IN_MM_PER_SEC
+    positions, measurements_x, _ = AdaptiveScan.adaptive_scan(measure, locations[0], locations[-1],
+                                                              coarse_points=min(AdaptiveScan.COARSE_POINTS, len(locations)),
+                                                              max_points=max_points or len(locations), resolution=resolution,
+                                                              capture_time=samples_count / lockin_dev.sample_frequency,
+                                                              stage_speed=stage_speed)
+
+    return positions, measurements_x, np.array(x_std)
+
+def run_fly_scan(lockin_dev, standa_dev, locations, writer, speed=None, timer=None, duration_per_loc=LOCKIN_ALL_SAMPLES_DURATION_IN_SEC):
+    timer = timer or PhaseTimer.NullPhaseTimer()
+    if speed is None:
+        speed = abs(locations[1] - locations[0]) / duration_per_loc
+
+    # the whole sweep is a single point - motion and capture overlap
+    timer.start_point(0, speed=speed)
+    with timer.phase(PhaseTimer.PHASE_CAPTURE):
+        measurements_x, x_std, _ = FlyScan.fly_scan(lockin_dev, standa_dev, locations, speed)
+    if measurements_x is None:
+        return None, None, None
+
+    with timer.phase(PhaseTimer.PHASE_WRITE):
+        for i, loc in enumerate(locations):
+            t = loc * 2 / scipy.constants.c       # delta time
+            writer.append(i, loc, t, measurements_x[i], x_std[i])
+
+    return locations, measurements_x, x_std
+
+def open_checkpoint(base_path, config, resume=False):
+    """
+    Starts a new checkpoint, or with resume loads the one of the data set and checks it was
+    started with the same configuration. Returns None if the scan can't be resumed.
+    """
+    if not resume:
+        checkpoint = Checkpoint.ScanCheckpoint(base_path, config)
+        checkpoint.save()
+        return checkpoint
+
+    checkpoint = Checkpoint.load_checkpoint(base_path)
+    if checkpoint is None:
+        logger.error("No checkpoint found for %s. Nothing to resume." % (base_path, ))
+        return None
+
+    mismatches = checkpoint.mismatches(config)
+    if mismatches:
+        logger.error("Can't resume %s - configuration changed: %s" % (base_path, ", ".join(mismatches)))
+        return None
+
+    # rows flushed after the last checkpoint are measured again
+    MeasurementWriter.truncate(base_path, len(checkpoint.completed))
+    logger.info("Resuming %s after %d completed points." % (base_path, len(checkpoint.completed)))
+    return checkpoint
+
+def select_data_path(catalog, experiment_name=EXPERIMENT_NAME, data_path=None, resume=False):
+    """
+    The base path of the run's data files: data_path if given, on resume the latest unfinished
+    run of the experiment in the catalog, otherwise a new time stamped path in DATA_DIR.
+    Returns None if there is nothing to resume.
+    """
+    if data_path is not None:
+        return data_path
+
+    if resume:
+        run = catalog.latest(experiment_name, unfinished=True)
+        if run is None:
+            logger.error("The catalog has no unfinished %s run to resume." % (experiment_name, ))
+            return None
+        return run['data_path']
+
+    # queued runs can start within the same second
+    os.makedirs(DATA_DIR, exist_ok=True)
+    base_path = os.path.join(DATA_DIR, "%s_%s" % (experiment_name, time.strftime('%Y%m%d_%H%M%S')))
+    data_path, count = base_path, 1
+    while os.path.exists(data_path + MeasurementWriter.META_SUFFIX):
+        count += 1
+        data_path = "%s_%d" % (base_path, count)
+    return data_path
+
+def estimate_duration(lockin_dev, locations, samples_count=LOCKIN_SAMPLE_COUNT_PER_STANDA_LOC):
+    """
+    Expected experiment duration (sec) - lock-in capture time only
+    """
+    return len(locations) * samples_count / lockin_dev.sample_frequency
+
+def default_experiment():
+    """
+    The settings this script measures with - queue entries take the settings they leave out from here
+    """
+    return {
+        'experiment'                :   EXPERIMENT_NAME,
+        'scan_mode'                 :   SCAN_MODE_STEP,
+        'locations_in_mm'           :   STANDA_LOCATIONS_IN_MM,
+        'samples_per_loc'           :   LOCKIN_SAMPLE_COUNT_PER_STANDA_LOC,
+        'capture_duration_in_sec'   :   LOCKIN_ALL_SAMPLES_DURATION_IN_SEC,
+        'capture_mode'              :   SR860.CAPTURE_MODE_BUFFER,
+        'sweeps'                    :   1,
+        'outlier_factor'            :   SweepAverager.OUTLIER_FACTOR,
+        'resolution'                :   AdaptiveScan.RESOLUTION_IN_MM,
+        'devices'                   :   Experiment.DEFAULT_DEVICES,
+    }
+
+def experiment_from_args(args):
+    entry = {name: getattr(args, name) for name in ('scan_mode', 'capture_mode', 'target_error', 'sweeps', 'noise_target', 'outlier_factor',
+                                                    'temperatures', 'max_points', 'resolution', 'stage_speed', 'independent_samples')}
+    entry['devices'] = Experiment.SIMULATED_DEVICES if args.simulate else Experiment.DEFAULT_DEVICES
+    entry['sample_temperature'] = SAMPLE_TEMPERATURE_IN_K if not args.temperatures else None
+    return Experiment.ExperimentDefinition.from_dict(entry, default_experiment())
+
+def create_experiment_devices(experiment, server_address=None, create_device=None):
+    """
+    Returns the lock-in, stage and cryostat (None if the experiment sets no temperatures) of the
+    experiment's device roles. create_device(name, *args, **kwargs) defaults to device_factory(server_address).
+    """
+    create_device = create_device or device_factory(server_address)
+    standa_dev = create_device(experiment.devices['stage'])
+    if experiment.devices['lockin'] in Experiment.STAGE_COUPLED_DEVICES:
+        lockin_dev = create_device(experiment.devices['lockin'], stage=standa_dev)
+    else:
+        lockin_dev = create_device(experiment.devices['lockin'])
+    cryostat_dev = create_device(experiment.devices['cryostat']) if experiment.uses_cryostat else None
+    return lockin_dev, standa_dev, cryostat_dev
+
+def configure_lockin(lockin_dev, experiment):
+    """
+    Sets the lock-in capture mode and the sample rate the experiment's capture duration needs.
+    With independent_samples the lock-in chooses the rate, and the experiment's samples per point
+    and capture duration are replaced by its choice.
+    """
+    lockin_dev.capture_mode = experiment.capture_mode or lockin_dev.capture_mode
+    if lockin_dev.capture_mode != SR860.CAPTURE_MODE_STREAM and lockin_dev.is_streaming:
+        lockin_dev.stop_stream()
+    plan = lockin_dev.auto_configure(experiment.independent_samples) if experiment.independent_samples else None
+    if plan is not None:
+        experiment.samples_per_loc = plan['samples_count']
+        experiment.capture_duration_in_sec = plan['capture_duration']
+        logger.info("Lock-in time constant %g sec at %d dB/oct (noise bandwidth %.3g Hz): %d samples at %g Hz (%.3g sec) and %.3g sec settle "
+                    "per point for %d independent samples" % (plan['time_constant'], plan['filter_slope'], plan['noise_bandwidth'],
+                                                              plan['samples_count'], plan['sample_frequency'], plan['capture_duration'],
+                                                              plan['settle_time'], plan['independent_samples']))
+    else:
+        lockin_dev.settle_time = 0
+        lockin_dev.calc_capture_freq(experiment.samples_per_loc / experiment.capture_duration_in_sec)
+    if lockin_dev.capture_mode == SR860.CAPTURE_MODE_STREAM:
+        lockin_dev.start_stream()
+
+def estimate_experiment_duration(lockin_dev, standa_dev, cryostat_dev, experiment):
+    """
+    Expected duration (sec) of an experiment on configured devices
+    """
+    capture_time = experiment.samples_per_loc / lockin_dev.sample_frequency
+    if experiment.scan_mode != SCAN_MODE_FLY:
+        capture_time += lockin_dev.settle_time
+    if experiment.scan_mode == SCAN_MODE_STEP:
+        scheduler = build_step_scheduler(standa_dev, experiment.locations_in_mm, PhaseTimer.NullPhaseTimer(), cryostat_dev, experiment.temperatures)
+        return scheduler.estimate_duration(capture_time) * max(experiment.sweeps, 1)
+    return len(experiment.locations_in_mm) * capture_time
+
+def estimate_planned_duration(experiment):
+    """
+    Expected duration (sec) of an experiment from its settings alone, before any device is
+    configured - capture time only (the lock-in settle time and the stage moves are not known yet)
+    """
+    points = len(experiment.locations_in_mm)
+    if experiment.scan_mode == SCAN_MODE_FLY:
+        return points * experiment.capture_duration_in_sec
+    if experiment.scan_mode == SCAN_MODE_ADAPTIVE:
+        return (experiment.max_points or points) * experiment.capture_duration_in_sec
+    return points * experiment.capture_duration_in_sec * max(experiment.sweeps, 1) * len(experiment.temperatures or [None])
+
+def catalog_temperatures(experiment, cryostat_dev=None):
+    """
+    The temperatures a run is catalogued at: its temperature axis, else the experiment's
+    sample_temperature, else the reading of a connected cryostat (empty if unknown)
+    """
+    if experiment.temperatures:
+        return experiment.temperatures
+    if experiment.sample_temperature is not None:
+        return [experiment.sample_temperature]
+    if cryostat_dev is not None and cryostat_dev.is_connected:
+        temperature = cryostat_dev.get_temperature()
+        if temperature is not None:
+            return [temperature]
+    return []
+
+def experiment_metadata(lockin_dev, experiment):
+    return {
+        'experiment'        :   experiment.experiment,
+        'name'              :   experiment.name,
+        'scan_mode'         :   experiment.scan_mode,
+        'sample_frequency'  :   lockin_dev.sample_frequency,
+        'capture_mode'      :   lockin_dev.capture_mode,
+        'samples_per_loc'   :   experiment.samples_per_loc,
+        'integration_time'  :   experiment.capture_duration_in_sec,
+        'target_error'      :   experiment.target_error,
+        'locations_in_mm'   :   experiment.locations_in_mm.tolist(),
+        'temperatures'      :   experiment.temperatures,
+        'time_constant'     :   lockin_dev.time_constant,
+        'filter_slope'      :   lockin_dev.filter_slope,
+        'settle_time'       :   lockin_dev.settle_time,
+        'independent_samples':  experiment.independent_samples,
+        'max_points'        :   experiment.max_points,
+        'resolution'        :   experiment.resolution,
+        'sweeps'            :   experiment.sweeps,
+        'noise_target'      :   experiment.noise_target,
+        'outlier_factor'    :   experiment.outlier_factor,
     }
 
-    df = pd.DataFrame(csv_row)
-    df.to_csv(CSV_PATH, mode='a', index=False, header=header)
+def run_experiment(lockin_dev, standa_dev, cryostat_dev, experiment, catalog, data_path=None, resume=False, timer=None, csv_path=None,
+                   average_path=None, viewer=None):
+    """
+    Runs one experiment on connected devices: configures the lock-in, opens the data set (a new
+    one, or with resume the interrupted one), registers it in the catalog, scans and exports the
+    summary to csv_path (default - next to the data files). A started LiveViewer gets every point as it is written.
+    cryostat_dev is only driven when the experiment sets temperatures - otherwise it is just read for the catalog.
+    Returns the data path and the scan's locations, X and error (data path None if the run could not start).
+    """
+    configure_lockin(lockin_dev, experiment)
+    logger.info("Expected experiment duration: %.2f minutes" % (estimate_experiment_duration(lockin_dev, standa_dev, cryostat_dev, experiment) / 60, ))
+
+    # every run gets its own data files, registered in the run catalog
+    metadata = experiment_metadata(lockin_dev, experiment)
+    data_path = select_data_path(catalog, experiment.experiment, data_path, resume)
+
+    # the fly scan is a single sweep, there is nothing to continue
+    checkpoint = None
+    if data_path is not None and experiment.scan_mode != SCAN_MODE_FLY:
+        checkpoint = open_checkpoint(data_path, metadata, resume)
+    elif resume:
+        logger.error("Fly scans can't be resumed.")
+    if resume and checkpoint is None:
+        return None, None, None, None
+
+    # a run that crashes stays registered as running, --resume picks it up
+    run_id = catalog.register(data_path, metadata, temperatures=catalog_temperatures(experiment, cryostat_dev))
+    logger.info("Run %d (%s), data in %s" % (run_id, experiment.name, data_path))
+
+    locations = experiment.locations_in_mm
+    samples_count = experiment.samples_per_loc
+    with MeasurementWriter.MeasurementWriter(data_path, metadata=metadata, append=resume) as writer:
+        if viewer is not None:
+            writer.add_listener(viewer.publish)
+        if experiment.scan_mode == SCAN_MODE_FLY:
+            locations, measurements_x, x_std = run_fly_scan(lockin_dev, standa_dev, locations, writer, experiment.stage_speed, timer,
+                                                            experiment.capture_duration_in_sec)
+        elif experiment.scan_mode == SCAN_MODE_ADAPTIVE:
+            locations, measurements_x, x_std = run_adaptive_scan(lockin_dev, standa_dev, locations, writer, timer, samples_count,
+                                                                 max_points=experiment.max_points, resolution=experiment.resolution,
+                                                                 checkpoint=checkpoint)
+        elif experiment.sweeps > 1:
+            locations, measurements_x, x_std = run_multi_sweep_scan(lockin_dev, standa_dev, locations, writer, experiment.sweeps, timer,
+                                                                    samples_count, target_error=experiment.target_error,
+                                                                    noise_target=experiment.noise_target, outlier_factor=experiment.outlier_factor,
+                                                                    cryostat_dev=cryostat_dev, temperatures=experiment.temperatures,
+                                                                    checkpoint=checkpoint, average_path=average_path or data_path + AVERAGE_SUFFIX)
+        else:
+            locations, measurements_x, x_std = run_step_scan(lockin_dev, standa_dev, locations, writer, timer, samples_count,
+                                                             target_error=experiment.target_error, cryostat_dev=cryostat_dev,
+                                                             temperatures=experiment.temperatures, checkpoint=checkpoint)
+
+    if checkpoint is not None:
+        checkpoint.finish()
+    catalog.finish(run_id, Catalog.STATUS_FINISHED if measurements_x is not None else Catalog.STATUS_FAILED)
+
+    if measurements_x is not None:
+        MeasurementWriter.export_csv(data_path, csv_path or data_path + CSV_SUFFIX)
+    return data_path, locations, measurements_x, x_std
 
 #===============================================================================================
 #   Main
 #===============================================================================================
 def main():
+    args = parse_args()
+    experiment = experiment_from_args(args)
+    if args.record:
+        Trace.start_recording(args.record)
+    elif args.replay:
+        Trace.start_replay(args.replay, args.replay_time_scale)
+    atexit.register(Telemetry.stop_exporters, Telemetry.start_exporters(args.metrics_file, args.metrics_port))
+
     # initiates all parameters, devices and connections
-    lockin_dev = sr860.SR860Device()
-    standa_dev = standa.StandaDevice()
-    if not connect_devices(lockin_dev, standa_dev):
+    lockin_dev, standa_dev, cryostat_dev = create_experiment_devices(experiment, args.device_server)
+    devices = [dev for dev in (lockin_dev, standa_dev, cryostat_dev) if dev is not None]
+    if not connect_devices(*devices):
+        close_devices(*[dev for dev in devices if dev.is_connected])
         return
 
-    lockin_dev.calc_capture_freq(LOCKIN_SAMPLE_COUNT_PER_STANDA_LOC / LOCKIN_ALL_SAMPLES_DURATION_IN_SEC)
-
-    # calculate experiment duration
-    exp_duration_in_sec = len(STANDA_LOCATIONS_IN_MM) * LOCKIN_SAMPLE_COUNT_PER_STANDA_LOC / lockin_dev.sample_frequency
-    logging.info("Expected experiment duration: %.2f minutes" % (exp_duration_in_sec / 60, ))
-
     # run experiment
-    measurements_x = np.zeros(len(STANDA_LOCATIONS_IN_MM))
-    x_std = np.zeros(len(STANDA_LOCATIONS_IN_MM))
-    for i, loc in enumerate(STANDA_LOCATIONS_IN_MM):
-        # move stage and wait for it to stop moving
-        standa_dev.move_stage(loc)
-
-        # take measurements from lockin
-        logging.info("measuring location %.2f" % (loc, ))
-        samples_x, _, _ = lockin_dev.capture_samples(LOCKIN_SAMPLE_COUNT_PER_STANDA_LOC)
-        measurements_x[i] = samples_x.mean()
-        x_std[i] = samples_x.std()
+    viewer = LiveViewer.LiveViewer(raw=args.live_raw, title=experiment.name) if args.live else None
+    if viewer is not None:
+        viewer.start()
+    try:
+        with Catalog.RunCatalog(args.catalog) as catalog:
+            data_path, locations, measurements_x, x_std = run_experiment(lockin_dev, standa_dev, cryostat_dev, experiment, catalog, args.data_path,
+                                                                         args.resume, csv_path=CSV_PATH, average_path=AVERAGE_CSV_PATH, viewer=viewer)
+    finally:
+        if viewer is not None:
+            viewer.close()
 
-        # add csv row
-        headers = False if i else True
-        t = loc * 2 / scipy.constants.c       # delta time
-        write_measurement_to_csv(t, measurements_x[i], yerr=x_std[i], header=headers)
+    if measurements_x is None:
+        close_devices(*devices)
+        return
 
-    # plot measurements
+    # plot measurements (the sweep averages when sweeping repeatedly), one series per temperature
     fig, ax = plt.subplots()
-    ax.errorbar(x=STANDA_LOCATIONS_IN_MM, y=measurements_x, yerr=x_std, ls='None', marker='o')
+    if args.scan_mode == SCAN_MODE_STEP and args.sweeps > 1:
+        for temperature, mean, error in zip(args.temperatures or [None], np.atleast_2d(measurements_x), np.atleast_2d(x_std)):
+            label = "%.1f K" % (temperature, ) if temperature is not None else None
+            ax.errorbar(x=locations, y=mean, yerr=error, ls='None', marker='o', label=label)
+    else:
+        summary = MeasurementWriter.load_summary(data_path, mmap=False)
+        for temperature in (args.temperatures or [np.nan]):
+            rows = summary[summary['temperature'] == temperature] if args.temperatures else summary
+            rows = np.sort(rows, order='position')
+            label = "%.1f K" % (temperature, ) if args.temperatures else None
+            ax.errorbar(x=rows['position'], y=rows['x'], yerr=rows['x_err'], ls='None', marker='o', label=label)
     ax.set(xlabel="position [mm]", ylabel="X [V]")
     plt.legend()
     plt.tight_layout()
     plt.show()
 
     # close all devices and connections
-    close_devices(standa_dev, lockin_dev)
+    close_devices(*devices)
+    Trace.stop()
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
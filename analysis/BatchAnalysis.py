@@ -0,0 +1,397 @@
+#===============================================================================================
+#   Name:           BatchAnalysis.py
+#   Description:    Batch pump-probe analysis - delay axis, baseline, time zero and exponential fits
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#   Every data set is split into delay scans (one per temperature, sweeps averaged). Scans on the
+#   same stage grid are processed as one (scans, points) array: time zero, baseline and the
+#   starting values of the fit are found for all of them at once. The final least squares
+#   refinement runs per scan, with the data sets spread over a process pool.
+#
+#       python -m analysis.BatchAnalysis data/*.summary.bin --components 2
+#       python -m analysis.BatchAnalysis --experiment PumpProbe_Galium_300K --since 2026-01-01
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import os, sys
+import argparse
+import itertools
+import concurrent.futures
+import numpy as np
+import pandas as pd
+import scipy.constants
+import scipy.optimize
+import scipy.special
+
+import logging
+logger = logging.getLogger(__name__)
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import storage.Catalog as Catalog
+import storage.MeasurementWriter as MeasurementWriter
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+PS_PER_MM = 2e-3 / scipy.constants.c * 1e12     # round trip delay of 1 mm stage travel (~6.67 ps)
+DELAY_SIGN = 1                      # -1 if moving the stage to larger positions shortens the probe path
+
+SMOOTHING_POINTS = 3                # moving average before the time zero search
+BASELINE_MARGIN_IN_PS = 0.5         # points this close before time zero are not baseline
+IRF_SIGMA_IN_PS = 0.1               # starting pump-probe cross correlation width (gaussian sigma)
+MIN_IRF_SIGMA_IN_PS = 1e-3
+
+DEFAULT_COMPONENTS = 2
+TAU_GRID_IN_PS = np.geomspace(0.05, 2000, 40)   # starting value search grid of the time constants
+MAX_GRID_COMBINATIONS = 20000       # the grid is thinned for many components
+
+SUMMARY_CSV_PATH = r'analysis_summary.csv'
+
+#===============================================================================================
+#   DelayScan
+#===============================================================================================
+class DelayScan(object):
+    """
+    One delay scan: signal (X, V) and its standard error per stage position (mm)
+    """
+
+    def __init__(self, position, signal, error, source=None, run_id=None, temperature=np.nan):
+        super(DelayScan, self).__init__()
+        self.position = np.asarray(position, dtype=float)
+        self.signal = np.asarray(signal, dtype=float)
+        self.error = np.asarray(error, dtype=float)
+        self.source = source
+        self.run_id = run_id
+        self.temperature = temperature
+
+    @property
+    def delay(self):
+        return position_to_delay(self.position)
+
+#===============================================================================================
+#   Functions
+#===============================================================================================
+def position_to_delay(position, zero_position=0.0):
+    """
+    Stage position (mm) to pump-probe delay (ps). The summary 't' column is the same round
+    trip, position * 2 / c, but with the position left in mm.
+    """
+    return DELAY_SIGN * (np.asarray(position) - zero_position) * PS_PER_MM
+
+def load_scans(base_path, run_id=None):
+    """
+    The delay scans of a data set - one per temperature, with repeated sweeps averaged per position
+    """
+    summary = MeasurementWriter.load_summary(base_path)
+    if not len(summary):
+        return []
+
+    names = summary.dtype.names
+    temperature = np.asarray(summary['temperature']) if 'temperature' in names else np.full(len(summary), np.nan)
+    n = np.asarray(summary['n_eff']) if 'n_eff' in names else np.full(len(summary), np.nan)
+    if 'n_samples' in names:
+        n = np.where(np.isfinite(n) & (n > 0), n, summary['n_samples'])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        standard_error = np.asarray(summary['x_err']) / np.sqrt(n)
+
+    scans = []
+    for t in np.unique(temperature[np.isfinite(temperature)]) if np.isfinite(temperature).any() else [np.nan]:
+        rows = temperature == t if np.isfinite(t) else np.ones(len(summary), dtype=bool)
+        position, inverse = np.unique(np.round(summary['position'][rows], 6), return_inverse=True)
+        counts = np.bincount(inverse)
+        signal = np.bincount(inverse, weights=summary['x'][rows]) / counts
+        error = np.sqrt(np.bincount(inverse, weights=np.nan_to_num(standard_error[rows]) ** 2)) / counts
+        scans.append(DelayScan(position, signal, error, base_path, run_id, t))
+
+    return scans
+
+def group_by_grid(scans):
+    """
+    Groups scans measured on the same positions. Returns (positions, [scans]) pairs.
+    """
+    groups = {}
+    for scan in scans:
+        groups.setdefault(tuple(np.round(scan.position, 6)), []).append(scan)
+    return [(np.array(key), group) for key, group in groups.items()]
+
+def smooth(signals, points=SMOOTHING_POINTS):
+    """
+    Centered moving average of points (odd) along the last axis - the ends average fewer points
+    """
+    if points <= 1:
+        return signals
+    half = points // 2
+    padded = np.pad(np.asarray(signals, dtype=float), [(0, 0)] * (np.ndim(signals) - 1) + [(half, half)], constant_values=np.nan)
+    return np.nanmean(np.lib.stride_tricks.sliding_window_view(padded, points, axis=-1), axis=-1)
+
+def find_time_zero(delay, signals, points=SMOOTHING_POINTS):
+    """
+    Time zero (ps) of every row of signals: the steepest change of the smoothed signal,
+    refined between grid points by a parabola through the slope maximum
+    """
+    signals = np.atleast_2d(signals)
+    slope = np.abs(np.gradient(smooth(signals, points), delay, axis=-1))
+    peak = np.clip(np.argmax(slope, axis=-1), 1, len(delay) - 2)
+    rows = np.arange(len(signals))
+
+    left, center, right = slope[rows, peak - 1], slope[rows, peak], slope[rows, peak + 1]
+    curvature = left - 2 * center + right
+    with np.errstate(invalid='ignore', divide='ignore'):
+        shift = np.where(curvature < 0, 0.5 * (left - right) / curvature, 0)
+    shift = np.clip(np.nan_to_num(shift), -0.5, 0.5)
+
+    # interpolate the delay at the fractional index (the grid may be uneven)
+    step = np.where(shift >= 0, delay[peak + 1] - delay[peak], delay[peak] - delay[peak - 1])
+    return delay[peak] + shift * step
+
+def subtract_baseline(delay, signals, time_zero, margin=BASELINE_MARGIN_IN_PS):
+    """
+    Subtracts from every row the mean of its points before time_zero - margin.
+    Returns the corrected signals and the baselines (0 for rows without points before time zero).
+    """
+    signals = np.atleast_2d(signals)
+    before = (delay[None, :] < np.asarray(time_zero)[:, None] - margin) & np.isfinite(signals)
+    counts = before.sum(axis=-1)
+    if not counts.all():
+        logger.warning("%d scans have no points before time zero - baseline not subtracted." % (np.sum(counts == 0), ))
+
+    baseline = np.where(counts > 0, np.where(before, signals, 0).sum(axis=-1) / np.maximum(counts, 1), 0)
+    return signals - baseline[:, None], baseline
+
+def exponential_response(delay, time_zero, sigma, tau):
+    """
+    Unit step exponential decay exp(-(t - t0) / tau) starting at time_zero, convolved with a
+    gaussian of width sigma (the pump-probe cross correlation). tau=inf gives the smoothed step.
+    Broadcasts over all arguments.
+    """
+    x = np.asarray(delay) - time_zero
+    sigma = np.maximum(sigma, MIN_IRF_SIGMA_IN_PS)
+    tau = np.asarray(tau, dtype=float)
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        u = (sigma / tau - x / sigma) / np.sqrt(2)
+        # exp(sigma^2 / 2tau^2 - x / tau) * erfc(u), written without overflow on both sides of time zero
+        stable = 0.5 * np.exp(-x ** 2 / (2 * sigma ** 2)) * scipy.special.erfcx(u)
+        direct = 0.5 * np.exp(sigma ** 2 / (2 * tau ** 2) - x / tau) * scipy.special.erfc(u)
+        response = np.where(u > 0, stable, direct)
+    return np.where(np.isinf(tau), 0.5 * scipy.special.erfc(-x / (sigma * np.sqrt(2))), response)
+
+def design_matrix(delay, time_zero, sigma, taus, plateau=True):
+    """
+    (points, components) response of each time constant, plus a long lived step with plateau
+    """
+    taus = list(taus) + ([np.inf] if plateau else [])
+    return np.stack([exponential_response(delay, time_zero, sigma, tau) for tau in taus], axis=-1)
+
+def solve_amplitudes(matrix, signal, weights):
+    """
+    Weighted linear least squares amplitudes of the design matrix columns
+    """
+    amplitudes, _, _, _ = np.linalg.lstsq(matrix * weights[:, None], signal * weights, rcond=None)
+    return amplitudes
+
+def initial_time_constants(delay, signals, weights, time_zero, components=DEFAULT_COMPONENTS, plateau=True, tau_grid=TAU_GRID_IN_PS,
+                           sigma=IRF_SIGMA_IN_PS):
+    """
+    Best time constant combination on tau_grid for every row of signals (the fit's starting values).
+    The amplitudes are linear, so for every scan and grid combination the chi-square follows from
+    the normal equations - gathered from one (scans, grid, grid) table of response inner products.
+    Returns (scans, components) time constants, ascending.
+    """
+    tau_grid = np.asarray(tau_grid)
+    while len(tau_grid) > components and scipy.special.comb(len(tau_grid), components) > MAX_GRID_COMBINATIONS:
+        tau_grid = tau_grid[::2]
+
+    columns = list(tau_grid) + ([np.inf] if plateau else [])
+    responses = exponential_response(delay[None, None, :], time_zero[:, None, None], sigma, np.asarray(columns)[None, :, None])
+    weighted = responses * weights[:, None, :] ** 2                 # (scans, columns, points)
+    gram = np.einsum('sip,sjp->sij', weighted, responses)           # (scans, columns, columns)
+    projection = np.einsum('sip,sp->si', weighted, signals)         # (scans, columns)
+    norm = np.einsum('sp,sp->s', signals * weights ** 2, signals)
+
+    combinations = np.array(list(itertools.combinations(range(len(tau_grid)), components)))
+    if plateau:
+        combinations = np.hstack([combinations, np.full((len(combinations), 1), len(tau_grid))])
+
+    sub_gram = gram[:, combinations[:, :, None], combinations[:, None, :]]     # (scans, combinations, k, k)
+    sub_projection = projection[:, combinations]                                # (scans, combinations, k)
+    sub_gram = sub_gram + 1e-12 * np.trace(sub_gram, axis1=-2, axis2=-1)[..., None, None] * np.eye(combinations.shape[1])
+    amplitudes = np.linalg.solve(sub_gram, sub_projection[..., None])[..., 0]
+    chi2 = norm[:, None] - np.einsum('sck,sck->sc', sub_projection, amplitudes)
+
+    best = np.argmin(np.where(np.isfinite(chi2), chi2, np.inf), axis=-1)
+    return tau_grid[combinations[best, :components]]
+
+def fit_scan(delay, signal, weights, time_zero, taus, plateau=True, sigma=IRF_SIGMA_IN_PS):
+    """
+    Least squares refinement of time zero, the cross correlation width and the time constants,
+    with the amplitudes solved linearly at every step. Returns a dict of the fit results.
+    """
+    components = len(taus)
+
+    def unpack(params):
+        return params[0], np.exp(params[1]), np.exp(params[2:])
+
+    def residuals(params):
+        t0, s, t = unpack(params)
+        matrix = design_matrix(delay, t0, s, t, plateau)
+        return (matrix @ solve_amplitudes(matrix, signal, weights) - signal) * weights
+
+    start = np.concatenate([[time_zero, np.log(sigma)], np.log(taus)])
+    result = scipy.optimize.least_squares(residuals, start, x_scale='jac')
+    t0, s, t = unpack(result.x)
+    matrix = design_matrix(delay, t0, s, t, plateau)
+    amplitudes = solve_amplitudes(matrix, signal, weights)
+
+    dof = max(len(signal) - len(result.x) - matrix.shape[1], 1)
+    chi2_reduced = 2 * result.cost / dof
+    try:
+        covariance = np.linalg.inv(result.jac.T @ result.jac) * chi2_reduced
+        errors = np.sqrt(np.abs(np.diag(covariance)))
+    except np.linalg.LinAlgError:
+        errors = np.full(len(result.x), np.nan)
+
+    # report the components by increasing time constant (the errors are of log tau - relative)
+    order = np.argsort(t)
+    fit = {
+        'time_zero_ps'      :   t0,
+        'time_zero_err_ps'  :   errors[0],
+        'zero_position_mm'  :   t0 / (DELAY_SIGN * PS_PER_MM),
+        'sigma_ps'          :   s,
+        'chi2_reduced'      :   chi2_reduced,
+        'converged'         :   result.success,
+    }
+    for i, index in enumerate(order):
+        fit['tau_%d_ps' % (i + 1, )] = t[index]
+        fit['tau_%d_err_ps' % (i + 1, )] = t[index] * errors[2 + index]
+        fit['amplitude_%d' % (i + 1, )] = amplitudes[index]
+    if plateau:
+        fit['plateau'] = amplitudes[components]
+    return fit
+
+def analyze_scans(scans, components=DEFAULT_COMPONENTS, plateau=True):
+    """
+    Baseline, time zero and fit of a list of scans. The preprocessing and the starting values
+    run on all the scans of a grid at once. Returns one summary dict per scan.
+    """
+    rows = []
+    for positions, group in group_by_grid(scans):
+        delay = position_to_delay(positions)
+        signals = np.array([scan.signal for scan in group])
+        errors = np.array([scan.error for scan in group])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weights = np.where(errors > 0, 1 / errors, 0)
+        # scans without usable errors are fitted unweighted
+        weights[~(weights > 0).any(axis=-1)] = 1
+
+        time_zero = find_time_zero(delay, signals)
+        signals, baseline = subtract_baseline(delay, signals, time_zero)
+        taus = initial_time_constants(delay, signals, weights, time_zero, components, plateau)
+
+        for i, scan in enumerate(group):
+            row = {
+                'source'        :   scan.source,
+                'run_id'        :   scan.run_id,
+                'temperature'   :   scan.temperature,
+                'points'        :   len(delay),
+                'baseline'      :   baseline[i],
+                'error'         :   None,
+            }
+            try:
+                row.update(fit_scan(delay, signals[i], weights[i], time_zero[i], taus[i], plateau))
+            except (ValueError, np.linalg.LinAlgError) as err:
+                logger.error("Fit of %s at %s K failed: %s" % (scan.source, scan.temperature, err))
+                row['error'] = str(err)
+            rows.append(row)
+
+    return rows
+
+def analyze_data_set(base_path, run_id=None, components=DEFAULT_COMPONENTS, plateau=True):
+    """
+    Process pool task - loads and analyzes one data set
+    """
+    try:
+        return analyze_scans(load_scans(base_path, run_id), components, plateau)
+    except (OSError, ValueError, KeyError) as err:
+        logger.error("Can't analyze %s: %s" % (base_path, err))
+        return [{'source': base_path, 'run_id': run_id, 'error': str(err)}]
+
+def analyze_batch(base_paths, run_ids=None, components=DEFAULT_COMPONENTS, plateau=True, workers=None):
+    """
+    Analyzes the data sets at base_paths, workers at a time (None - one per CPU, 1 - in this
+    process). Returns the summary table, one row per delay scan.
+    """
+    run_ids = run_ids or [None] * len(base_paths)
+    if workers == 1 or len(base_paths) <= 1:
+        results = [analyze_data_set(path, run_id, components, plateau) for path, run_id in zip(base_paths, run_ids)]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(analyze_data_set, base_paths, run_ids, itertools.repeat(components), itertools.repeat(plateau)))
+
+    rows = [row for result in results for row in result]
+    columns = ['source', 'run_id', 'temperature', 'points', 'baseline', 'time_zero_ps', 'time_zero_err_ps', 'zero_position_mm', 'sigma_ps']
+    for i in range(components):
+        columns += ['tau_%d_ps' % (i + 1, ), 'tau_%d_err_ps' % (i + 1, ), 'amplitude_%d' % (i + 1, )]
+    columns += (['plateau'] if plateau else []) + ['chi2_reduced', 'converged', 'error']
+    return pd.DataFrame(rows, columns=columns)
+
+def write_summary(summary, csv_path=SUMMARY_CSV_PATH):
+    temp_path = csv_path + '.tmp'
+    summary.to_csv(temp_path, index=False)
+    os.replace(temp_path, csv_path)
+
+def base_path_of(path):
+    """
+    Data set base path of any of its files
+    """
+    for suffix in (MeasurementWriter.SUMMARY_SUFFIX, MeasurementWriter.RAW_SUFFIX, MeasurementWriter.META_SUFFIX):
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("data_sets", nargs='*', help="data set base paths (or any of their files)")
+    parser.add_argument("--catalog", default=Catalog.DEFAULT_CATALOG_PATH, help="run catalog, used when no data sets are given")
+    parser.add_argument("--experiment", default=None)
+    parser.add_argument("--temperature", type=float, default=None, help="K")
+    parser.add_argument("--since", default=None, help="YYYY-MM-DD")
+    parser.add_argument("--until", default=None, help="YYYY-MM-DD")
+    parser.add_argument("--components", type=int, default=DEFAULT_COMPONENTS, help="exponential components")
+    parser.add_argument("--no-plateau", action="store_true", help="fit without a long lived step")
+    parser.add_argument("--workers", type=int, default=None, help="processes. Defaults to one per CPU")
+    parser.add_argument("--output", default=SUMMARY_CSV_PATH, help="summary table csv path")
+    return parser.parse_args()
+
+#===============================================================================================
+#   Main
+#===============================================================================================
+def main():
+    FORMAT = '%(asctime)s @ %(levelname)s --- %(filename)s: %(message)s'
+    logging.basicConfig(format=FORMAT, stream=sys.stdout, level=logging.INFO)
+    args = parse_args()
+
+    if args.data_sets:
+        base_paths = sorted(set(base_path_of(path) for path in args.data_sets))
+        run_ids = None
+    else:
+        with Catalog.RunCatalog(args.catalog) as catalog:
+            runs = catalog.query(experiment=args.experiment, status=Catalog.STATUS_FINISHED, temperature=args.temperature,
+                                 since=args.since, until=args.until)
+        base_paths = [run['data_path'] for run in runs]
+        run_ids = [run['id'] for run in runs]
+
+    if not base_paths:
+        logger.error("No data sets to analyze.")
+        return
+
+    logger.info("Analyzing %d data sets" % (len(base_paths), ))
+    summary = analyze_batch(base_paths, run_ids, args.components, not args.no_plateau, args.workers)
+    write_summary(summary, args.output)
+    logger.info("Wrote %d scans to %s (%d failed)" % (len(summary), args.output, summary['error'].notna().sum()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+#===============================================================================================
+#   Name:           AcquisitionBenchmark.py
+#   Description:    Runs the pump-probe scan end to end and reports where the wall time goes
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import os, sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+import logging
+FORMAT = '%(asctime)s @ %(levelname)s --- %(filename)s: %(message)s'
+logging.basicConfig(format=FORMAT, stream=sys.stdout, level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import PumpProbe_Galium_300K as PumpProbe
+import scans.PhaseTimer as PhaseTimer
+import storage.MeasurementWriter as MeasurementWriter
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+BACKENDS = {
+    'simulated' :   lambda: PumpProbe.create_devices(simulate=True),
+    'real'      :   lambda: PumpProbe.create_devices(simulate=False),
+}
+
+DEFAULT_POINTS = 20
+DEFAULT_SAMPLES = 30
+DEFAULT_DURATION_IN_SEC = 0.4
+REGRESSION_THRESHOLD = 0.1     # relative slowdown reported as a regression
+
+#===============================================================================================
+#   Functions
+#===============================================================================================
+def git_version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(backend, locations, samples_count, duration_per_loc, scan_mode=PumpProbe.SCAN_MODE_STEP, speed=None):
+    """
+    Runs one scan on the given backend and returns the timing report as a dict
+    """
+    lockin_dev, standa_dev = BACKENDS[backend]()
+    timer = PhaseTimer.PhaseTimer()
+
+    connect_start = time.perf_counter()
+    if not PumpProbe.connect_devices(lockin_dev, standa_dev):
+        raise RuntimeError("Failed connecting %s devices" % (backend, ))
+    connect_time = time.perf_counter() - connect_start
+
+    lockin_dev.calc_capture_freq(samples_count / duration_per_loc)
+    expected_duration = PumpProbe.estimate_duration(lockin_dev, locations, samples_count)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        with MeasurementWriter.MeasurementWriter(os.path.join(data_dir, 'benchmark')) as writer:
+            timer.start()
+            if scan_mode == PumpProbe.SCAN_MODE_FLY:
+                PumpProbe.run_fly_scan(lockin_dev, standa_dev, locations, writer, speed=speed, timer=timer, duration_per_loc=duration_per_loc)
+            elif scan_mode == PumpProbe.SCAN_MODE_ADAPTIVE:
+                PumpProbe.run_adaptive_scan(lockin_dev, standa_dev, locations, writer, timer=timer, samples_count=samples_count)
+            else:
+                PumpProbe.run_step_scan(lockin_dev, standa_dev, locations, writer, timer=timer, samples_count=samples_count)
+            timer.stop()
+
+    PumpProbe.close_devices(standa_dev, lockin_dev)
+
+    achieved = [point['values']['achieved_sample_frequency'] for point in timer.points if 'achieved_sample_frequency' in point['values']]
+    summary = timer.summary()
+    return {
+        'timestamp'                     :   time.strftime('%Y-%m-%d %H:%M:%S'),
+        'version'                       :   git_version(),
+        'backend'                       :   backend,
+        'scan_mode'                     :   scan_mode,
+        'points'                        :   len(locations),
+        'samples_per_point'             :   samples_count,
+        'requested_sample_frequency'    :   lockin_dev.sample_frequency,
+        'achieved_sample_frequency'     :   {
+            'mean'  :   float(np.mean(achieved)) if achieved else None,
+            'min'   :   float(np.min(achieved)) if achieved else None,
+            'max'   :   float(np.max(achieved)) if achieved else None,
+        },
+        'connect_time'                  :   connect_time,
+        'expected_duration'             :   expected_duration,
+        'total_time'                    :   summary['total_time'],
+        'overhead_ratio'                :   summary['total_time'] / expected_duration if expected_duration else None,
+        'phase_totals'                  :   summary['phase_totals'],
+        'phase_means'                   :   summary['phase_means'],
+        'background_totals'             :   summary['background_totals'],
+        'unaccounted_time'              :   summary['unaccounted_time'],
+        'per_point'                     :   timer.points,
+    }
+
+def print_report(result):
+    print("Backend: %s, scan mode: %s, version: %s" % (result['backend'], result['scan_mode'], result['version']))
+    print("Total scan time: %.2f sec (expected %.2f sec, x%.2f)" % (result['total_time'], result['expected_duration'], result['overhead_ratio'] or 0))
+    if result['achieved_sample_frequency']['mean'] is not None:
+        print("Sample rate: requested %.2f Hz, achieved %.2f Hz (min %.2f Hz)" % (result['requested_sample_frequency'],
+              result['achieved_sample_frequency']['mean'], result['achieved_sample_frequency']['min']))
+    for phase, duration in result['phase_totals'].items():
+        print("  %-12s %8.3f sec total  %8.2f ms/point  %5.1f%%" % (phase, duration, result['phase_means'][phase] * 1e3,
+              100 * duration / result['total_time']))
+    print("  %-12s %8.3f sec" % ('unaccounted', result['unaccounted_time']))
+    for phase, duration in result['background_totals'].items():
+        print("  %-12s %8.3f sec total in background" % (phase, duration))
+
+def compare_results(baseline, result, threshold=REGRESSION_THRESHOLD):
+    """
+    Prints the per phase change against a baseline report and returns the regressed phases
+    """
+    regressions = []
+    rows = [('total', baseline['total_time'], result['total_time'])]
+    rows += [(phase, baseline['phase_means'].get(phase), mean) for phase, mean in result['phase_means'].items()]
+    for name, before, after in rows:
+        if not before:
+            continue
+        change = (after - before) / before
+        print("  %-12s %10.4f -> %10.4f sec  %+6.1f%%" % (name, before, after, 100 * change))
+        if change > threshold:
+            regressions.append(name)
+
+    return regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default='simulated', help="device backend")
+    parser.add_argument("--scan-mode", choices=PumpProbe.SCAN_MODES, default=PumpProbe.SCAN_MODE_STEP)
+    parser.add_argument("--points", type=int, default=DEFAULT_POINTS, help="delay points")
+    parser.add_argument("--start", type=float, default=1.0, help="first stage location (mm)")
+    parser.add_argument("--stop", type=float, default=-1.0, help="last stage location (mm)")
+    parser.add_argument("--samples", type=int, default=DEFAULT_SAMPLES, help="lock-in samples per point")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION_IN_SEC, help="capture duration per point (sec)")
+    parser.add_argument("--stage-speed", type=float, default=None, help="fly scan stage speed (mm/sec)")
+    parser.add_argument("--output", default=None, help="json report path")
+    parser.add_argument("--compare", default=None, help="baseline json report to compare against")
+    return parser.parse_args()
+
+#===============================================================================================
+#   Main
+#===============================================================================================
+def main():
+    args = parse_args()
+    locations = np.linspace(start=args.start, stop=args.stop, num=args.points)
+
+    result = run_benchmark(args.backend, locations, args.samples, args.duration, args.scan_mode, args.stage_speed)
+    print_report(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=4)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        print("Compared to %s (%s):" % (args.compare, baseline['version']))
+        regressions = compare_results(baseline, result)
+        if regressions:
+            print("Regressions: " + ", ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#===============================================================================================
+#   Name:           ImportBudget.py
+#   Description:    Fails if importing the devices package gets slow or loads vendor libraries
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import os, sys
+import json
+import argparse
+import subprocess
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+IMPORT_BUDGET_IN_SEC = 0.5
+REPEATS = 5
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEVICE_MODULES = [
+    'devices',
+    'devices.AutoLabDevice',
+    'devices.Registry',
+    'devices.SR860',
+    'devices.standa',
+    'devices.Attodry',
+]
+
+# must only be imported on connect()
+VENDOR_MODULES = ['qcodes', 'pyximc']
+
+# runs in a fresh interpreter so nothing is cached
+MEASURE_SCRIPT = '''
+import sys, time, json, importlib
+start = time.perf_counter()
+for name in %r:
+    importlib.import_module(name)
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "loaded": [name for name in %r if name in sys.modules]}))
+'''
+
+#===============================================================================================
+#   Functions
+#===============================================================================================
+def measure_import_time(modules=DEVICE_MODULES):
+    script = MEASURE_SCRIPT % (modules, VENDOR_MODULES)
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=PROJECT_DIR)
+    return json.loads(output)
+
+def check_import_budget(budget=IMPORT_BUDGET_IN_SEC, repeats=REPEATS):
+    """
+    Returns (ok, best import time, vendor modules that got imported)
+    """
+    results = [measure_import_time() for _ in range(repeats)]
+    best = min(result['elapsed'] for result in results)
+    loaded = sorted(set(name for result in results for name in result['loaded']))
+    return best <= budget and not loaded, best, loaded
+
+#===============================================================================================
+#   Main
+#===============================================================================================
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget", type=float, default=IMPORT_BUDGET_IN_SEC, help="allowed import time (sec)")
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    args = parser.parse_args()
+
+    ok, best, loaded = check_import_budget(args.budget, args.repeats)
+    print("devices import time: %.3f sec (budget %.3f sec)" % (best, args.budget))
+    if loaded:
+        print("Vendor modules imported at import time: " + ", ".join(loaded))
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,12 +7,19 @@
 #   Python Imports
 #===============================================================================================
 import os, sys
+import json
+import queue
+import threading
 import subprocess
 
+import logging
+logger = logging.getLogger(__name__)
+
 #===============================================================================================
 #   Solution Imports
 #===============================================================================================
 import devices.AutoLabDevice as AutoLabDevice
+import devices.Trace as Trace
 
 #===============================================================================================
 #   Constants
@@ -20,29 +27,170 @@ import devices.AutoLabDevice as AutoLabDevice
 PYTHON32BIT = r"C:\Users\Ron's Optics Lab\AppData\Local\Programs\Python\Python39-32\python.exe"
 ATTOLIB_PATH = r"C:\Users\Ron's Optics Lab\Desktop\AutoLab\devices\AttodryWin32.py"
 
+WORKER_START_TIMEOUT_IN_SEC = 30        # 32 bit interpreter start-up + dll load
+WORKER_REPLY_TIMEOUT_IN_SEC = 10
+WORKER_CLOSE_TIMEOUT_IN_SEC = 5
+
 #===============================================================================================
-#   Lockin class
+#   AttodryWorker
+#===============================================================================================
+class AttodryWorker(object):
+    """
+    A running AttodryWin32 worker. Requests are json lines written to its stdin, a reader thread
+    queues the json replies it prints to stdout.
+    """
+
+    def __init__(self, python_path=PYTHON32BIT, worker_path=ATTOLIB_PATH, worker_args=()):
+        super(AttodryWorker, self).__init__()
+        self._process = subprocess.Popen([python_path, worker_path, "--serve"] + list(worker_args),
+                                         stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True, bufsize=1)
+        self._replies = queue.Queue()
+        self._request_id = 0
+        self._lock = threading.Lock()
+        threading.Thread(target=self._read_replies, args=(self._process.stdout, self._replies), daemon=True).start()
+
+    @property
+    def is_running(self):
+        return self._process is not None and self._process.poll() is None
+
+    def request(self, cmd, timeout=WORKER_REPLY_TIMEOUT_IN_SEC, **args):
+        """
+        Sends one request and returns its reply - {"ok": ..., "value" or "error": ...}, or None if the
+        worker did not answer
+        """
+        if not self.is_running:
+            logger.error("Attodry worker is not running. Cannot send %s." % (cmd, ))
+            return None
+
+        with self._lock:
+            self._request_id += 1
+            request_id = self._request_id
+            try:
+                self._process.stdin.write(json.dumps({"id": request_id, "cmd": cmd, "args": args}) + "\n")
+                self._process.stdin.flush()
+            except OSError as err:
+                logger.error("Failed sending %s to the attodry worker: %s" % (cmd, err))
+                return None
+
+            # skip replies of requests that timed out earlier
+            while True:
+                try:
+                    reply = self._replies.get(timeout=timeout)
+                except queue.Empty:
+                    logger.error("Attodry worker did not reply to %s within %.1f sec." % (cmd, timeout))
+                    return None
+                if reply is None:
+                    logger.error("Attodry worker exited while handling %s." % (cmd, ))
+                    return None
+                if reply.get("id") == request_id:
+                    return reply
+
+    def close(self, timeout=WORKER_CLOSE_TIMEOUT_IN_SEC):
+        """
+        Asks the worker to quit, killing it if it does not
+        """
+        if self._process is None:
+            return
+
+        self.request("quit", timeout=timeout)
+        try:
+            self._process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            logger.error("Attodry worker did not exit. Killing it.")
+        self.kill()
+
+    def kill(self):
+        if self._process.poll() is None:
+            self._process.kill()
+            self._process.wait()
+        self._process = None
+
+    @staticmethod
+    def _read_replies(stdout, replies):
+        for line in stdout:
+            try:
+                replies.put(json.loads(line))
+            except ValueError:
+                logger.warning("Unexpected attodry worker output: " + line.rstrip())
+        replies.put(None)
+
+#===============================================================================================
+#   Cryostat class
 #===============================================================================================
 class CryostatDevice(AutoLabDevice.AutoLabDevice):
+    """
+    Talks to a long-lived AttodryWorker (32 bit interpreter) that keeps attoDRYLib.dll loaded.
+    The worker is opened as the "attodry" trace channel, so its requests can be recorded and replayed.
+    """
+
+    METRICS_NAME = 'attodry'
 
-    def __init__(self):
+    def __init__(self, python_path=PYTHON32BIT, worker_path=ATTOLIB_PATH, worker_args=()):
         super(CryostatDevice, self).__init__()
+        self.python_path = python_path
+        self.worker_path = worker_path
+        self.worker_args = list(worker_args)
+        self._worker = None
 
     def connect(self):
-    	"""
-    	Handled in AttodryWin32
-    	"""
-        pass
+        """
+        Starts the worker and waits for it to answer a status request.
+        Raises AutoLabDevice.DriverLoadError if the 32 bit interpreter cannot be started.
+        """
+        try:
+            self._worker = Trace.open_channel('attodry', lambda: AttodryWorker(self.python_path, self.worker_path, self.worker_args))
+        except OSError as err:
+            raise AutoLabDevice.DriverLoadError("Can't start the attodry worker %s %s: %s" % (self.python_path, self.worker_path, err)) from err
+
+        status = self._request("status", timeout=WORKER_START_TIMEOUT_IN_SEC)
+        if status is None:
+            logger.error("Attodry worker did not start.")
+            self._worker.kill()
+            self._worker = None
+            return
+
+        logger.info("Attodry worker started. Status: " + repr(status))
+        self._is_connected = True
 
     def close(self):
-    	"""
-    	Handled in AttodryWin32
-    	"""
-        pass
+        if self._worker is None:
+            return
+
+        self._worker.close()
+        self._worker = None
+        self._is_connected = False
+
+    def get_temperature(self):
+        """
+        Returns the sample temperature in kelvin (None on failure)
+        """
+        return self._request("get_temperature")
+
+    def set_temperature(self, tempInKelvin):
+        return self._request("set_temperature", temperature=tempInKelvin) is not None
+
+    def get_status(self):
+        return self._request("status")
+
+    async def get_temperature_async(self):
+        return await self.run_async(self.get_temperature)
+
+    async def set_temperature_async(self, tempInKelvin):
+        return await self.run_async(self.set_temperature, tempInKelvin)
 
-	def get_temperature(self):
-		subprocess.call([PYTHON32BIT, ATTOLIB_PATH, "--get"])
+    def _request(self, cmd, timeout=WORKER_REPLY_TIMEOUT_IN_SEC, **args):
+        if self._worker is None:
+            logger.error("Attodry worker is not running. Cannot send %s." % (cmd, ))
+            return None
 
-	def set_temperature(self, tempInKelvin):
-		subprocess.call([PYTHON32BIT, ATTOLIB_PATH, "--set", str(tempInKelvin)])
+        with self.command(cmd):
+            reply = self._worker.request(cmd, timeout, **args)
+        if reply is None:
+            self.count(cmd + '.errors')
+            return None
+        if not reply.get("ok"):
+            logger.error("Attodry %s failed: %s" % (cmd, reply.get("error")))
+            self.count(cmd + '.errors')
+            return None
 
+        return reply.get("value")
@@ -1,16 +1,167 @@
-import argparse
+#===============================================================================================
+#   Name:           AttodryWin32.py
+#   Description:    Attodry worker - runs on the 32 bit interpreter, owns attoDRYLib.dll
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#   Started once by CryostatDevice.connect with --serve. The dll is loaded a single time and
+#   requests are served over stdin/stdout, one json object per line:
+#       request:    {"id": 1, "cmd": "get_temperature", "args": {}}
+#       reply:      {"id": 1, "ok": true, "value": 299.93}
+#                   {"id": 1, "ok": false, "error": "..."}
+#   --stand-in replaces the dll with a simulated cryostat so the protocol runs on any OS.
+#   --get / --set keep the old one-shot command line behaviour.
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import sys
+import json
+import time
+import math
 import ctypes
+import argparse
 
-###Load Attodry800 dll to memory
+#===============================================================================================
+#   Constants
+#===============================================================================================
 LIB_ATTODRY800_PATH = r"C:\Users\Ron's Optics Lab\Desktop\AttodryDLL\attoDRYLib.dll"
-attodll = ctypes.CDLL(LIB_ATTODRY800_PATH)
+ATTODRY_COM_PORT = b"COM3"
+ATTODRY_SETUP_800 = 2               # setup version passed to AttoDRY_Interface_begin
+
+CMD_GET_TEMPERATURE = "get_temperature"
+CMD_SET_TEMPERATURE = "set_temperature"
+CMD_STATUS = "status"
+CMD_QUIT = "quit"
+
+STAND_IN_INITIAL_TEMPERATURE = 300.0
+STAND_IN_THERMAL_TIME_CONSTANT = 120.0
+
+#===============================================================================================
+#   Backends
+#===============================================================================================
+class AttodryLib(object):
+    """
+    attoDRYLib.dll, loaded once per worker
+    """
+
+    def __init__(self, path=LIB_ATTODRY800_PATH):
+        super(AttodryLib, self).__init__()
+        self.dll = ctypes.CDLL(path)
+        self.dll.AttoDRY_Interface_begin(ctypes.c_uint16(ATTODRY_SETUP_800))
+        self.dll.AttoDRY_Interface_Connect(ctypes.c_char_p(ATTODRY_COM_PORT))
+
+    def get_temperature(self):
+        value = ctypes.c_float()
+        self._check(self.dll.AttoDRY_Interface_getSampleTemperature(ctypes.byref(value)), "getSampleTemperature")
+        return value.value
+
+    def set_temperature(self, temperature):
+        self._check(self.dll.AttoDRY_Interface_setUserTemperature(ctypes.c_float(temperature)), "setUserTemperature")
+        return temperature
+
+    def status(self):
+        initialised = ctypes.c_int()
+        controlling = ctypes.c_int()
+        self._check(self.dll.AttoDRY_Interface_isDeviceInitialised(ctypes.byref(initialised)), "isDeviceInitialised")
+        self._check(self.dll.AttoDRY_Interface_isControllingTemperature(ctypes.byref(controlling)), "isControllingTemperature")
+        return {"initialised": bool(initialised.value), "controlling": bool(controlling.value)}
+
+    def close(self):
+        self.dll.AttoDRY_Interface_Disconnect()
+        self.dll.AttoDRY_Interface_end()
+
+    @staticmethod
+    def _check(result, name):
+        if result != 0:
+            raise RuntimeError("%s failed with error %d" % (name, result))
+
+class StandInLib(object):
+    """
+    Simulated cryostat with the AttodryLib interface - exponential relaxation to the set point
+    """
+
+    def __init__(self, temperature=STAND_IN_INITIAL_TEMPERATURE):
+        super(StandInLib, self).__init__()
+        self._set_point = temperature
+        self._start_temperature = temperature
+        self._set_time = time.monotonic()
+
+    def get_temperature(self):
+        relax = math.exp(-(time.monotonic() - self._set_time) / STAND_IN_THERMAL_TIME_CONSTANT)
+        return self._set_point + (self._start_temperature - self._set_point) * relax
+
+    def set_temperature(self, temperature):
+        self._start_temperature = self.get_temperature()
+        self._set_time = time.monotonic()
+        self._set_point = temperature
+        return temperature
+
+    def status(self):
+        return {"initialised": True, "controlling": True, "set_point": self._set_point}
+
+    def close(self):
+        pass
+
+#===============================================================================================
+#   Functions
+#===============================================================================================
+def handle_request(lib, request):
+    cmd = request.get("cmd")
+    args = request.get("args", {})
+    if cmd == CMD_GET_TEMPERATURE:
+        return lib.get_temperature()
+    if cmd == CMD_SET_TEMPERATURE:
+        return lib.set_temperature(float(args["temperature"]))
+    if cmd == CMD_STATUS:
+        return lib.status()
+    raise ValueError("Unknown command %r" % (cmd, ))
+
+def serve(lib, stdin=sys.stdin, stdout=sys.stdout):
+    for line in stdin:
+        if not line.strip():
+            continue
+
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            if request.get("cmd") == CMD_QUIT:
+                reply = {"id": request_id, "ok": True, "value": None}
+            else:
+                reply = {"id": request_id, "ok": True, "value": handle_request(lib, request)}
+        except Exception as err:
+            reply = {"id": request_id, "ok": False, "error": "%s: %s" % (type(err).__name__, err)}
+
+        stdout.write(json.dumps(reply) + "\n")
+        stdout.flush()
+        if reply["ok"] and request.get("cmd") == CMD_QUIT:
+            break
+
+    lib.close()
+
+#===============================================================================================
+#   Main
+#===============================================================================================
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-g", "--get", action="store_true", help="get temperature")
+    parser.add_argument("-s", "--set", type=float, help="sets temperature to value (kelvin)")
+    parser.add_argument("--serve", action="store_true", help="serve requests over stdin/stdout")
+    parser.add_argument("--stand-in", action="store_true", help="use a simulated cryostat instead of the dll")
+    args = parser.parse_args()
+
+    lib = StandInLib() if args.stand_in else AttodryLib()
+    if args.serve:
+        serve(lib)
+        return
+
+    if args.get:
+        print("%.3f" % (lib.get_temperature(), ))
+    elif args.set is not None:
+        lib.set_temperature(args.set)
+        print("Set %.2f" % (args.set, ))
+    lib.close()
 
-parser = argparse.ArgumentParser()
-parser.add_argument("-g", "--get", action="store_true", help="get temperature")
-parser.add_argument("-s", "--set", type=float, help="sets temperature to value (kelvin)")
-args = parser.parse_args()
 
-if args.get:
-	print("Get")
-elif args.set:
-	print("Set %.2f" % (args.set, ))
+if __name__ == '__main__':
+    main()
@@ -6,7 +6,9 @@
 #===============================================================================================
 #   Python Imports
 #===============================================================================================
-
+import asyncio
+import functools
+import threading
 
 import logging
 logger = logging.getLogger(__name__)
@@ -14,21 +16,50 @@ logger = logging.getLogger(__name__)
 #===============================================================================================
 #   Solution Imports
 #===============================================================================================
-
+import devices.Telemetry as Telemetry
 
 #===============================================================================================
 #   Constants
 #===============================================================================================
 INVALID_DEVICE_ID = -1
 
+#===============================================================================================
+#   Exceptions
+#===============================================================================================
+class AutoLabDeviceError(Exception):
+    pass
+
+class DriverLoadError(AutoLabDeviceError):
+    """
+    A vendor library needed by a device could not be loaded
+    """
+    pass
+
+class StageMoveError(AutoLabDeviceError):
+    """
+    A stage move failed or did not settle at its target
+    """
+    pass
+
 #===============================================================================================
 #   AutoLabDevice
 #===============================================================================================
 class AutoLabDevice(object):
+    """
+    Devices implement blocking connect/close and commands. The *_async methods run them on the
+    event loop's default executor, so several instruments can be driven concurrently from asyncio.
+    Devices talk to their instrument only inside command(), which holds device_lock, so no two
+    commands overlap on one instrument - whether they come from sync calls, async calls or a
+    background thread of the device. Commands are timed into the telemetry metrics under
+    METRICS_NAME (see devices.Telemetry).
+    """
+
+    METRICS_NAME = 'device'
 
     def __init__(self):
         super(AutoLabDevice, self).__init__()
         self._is_connected = False
+        self.device_lock = threading.RLock()
 
     @property
     def is_connected(self):
@@ -39,3 +70,58 @@ class AutoLabDevice(object):
 
     def close(self):
         raise NotImplementedError()
+
+    def command(self, name):
+        """
+        with self.command('move'): ... - holds device_lock and times the command into the histogram
+        <METRICS_NAME>.<name>. The lock is reentrant, so commands can be nested (e.g. status polls in a move).
+        """
+        return _Command(self.device_lock, Telemetry.METRICS.timed(self.METRICS_NAME + '.' + name))
+
+    def observe(self, name, value):
+        Telemetry.METRICS.observe(self.METRICS_NAME + '.' + name, value)
+
+    def set_gauge(self, name, value):
+        Telemetry.METRICS.set_gauge(self.METRICS_NAME + '.' + name, value)
+
+    def count(self, name, amount=1):
+        Telemetry.METRICS.increment(self.METRICS_NAME + '.' + name, amount)
+
+    async def run_async(self, func, *args, **kwargs):
+        """
+        Runs the blocking call func(*args, **kwargs) on an executor thread. The device commands it
+        issues take device_lock themselves - holding it for the whole call would block the device's
+        own background threads (e.g. the SR860 stream a capture waits for).
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+    async def call_async(self, method_name, *args, **kwargs):
+        """
+        Awaitable version of any blocking device method, e.g. await dev.call_async('move_stage', 1.0)
+        """
+        return await self.run_async(getattr(self, method_name), *args, **kwargs)
+
+    async def connect_async(self):
+        return await self.run_async(self.connect)
+
+    async def close_async(self):
+        return await self.run_async(self.close)
+
+class _Command(object):
+    __slots__ = ('lock', 'timed')
+
+    def __init__(self, lock, timed):
+        self.lock = lock
+        self.timed = timed
+
+    def __enter__(self):
+        self.lock.acquire()
+        self.timed.__enter__()      # time the instrument, not the wait for the lock
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.timed.__exit__(exc_type, exc_value, traceback)
+        finally:
+            self.lock.release()
@@ -0,0 +1,388 @@
+#===============================================================================================
+#   Name:           DeviceServer.py
+#   Description:    Long-lived local process that keeps the instrument sessions open between scripts
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#   The server creates devices through the Registry and connects each of them once. Scripts use
+#   RemoteDevice proxies, which forward attribute reads, writes and method calls over a local
+#   multiprocessing.connection socket. Closing a proxy only drops the script's connection - the
+#   instrument stays open for the next script. Calls from several scripts can overlap - the devices
+#   serialize their instrument commands on their device_lock (see AutoLabDevice.command).
+#   Requests are pickled, so connections authenticate with a secret key: AUTOLAB_SERVER_KEY, or
+#   a random key the server writes to ~/.autolab_server_key (readable by the user only) on first start.
+#
+#       python -m devices.DeviceServer --preload sr860 standa
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import os, sys
+import stat
+import pickle
+import secrets
+import argparse
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+
+import logging
+logger = logging.getLogger(__name__)
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import devices.AutoLabDevice as AutoLabDevice
+import devices.Registry as Registry
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 18860
+DEFAULT_ADDRESS = (DEFAULT_HOST, DEFAULT_PORT)
+SERVER_KEY_ENV = 'AUTOLAB_SERVER_KEY'
+SERVER_KEY_PATH = os.path.join(os.path.expanduser('~'), '.autolab_server_key')
+SERVER_KEY_BYTES = 32
+
+CMD_OPEN = 'open'
+CMD_GETATTR = 'getattr'
+CMD_SETATTR = 'setattr'
+CMD_CALL = 'call'
+CMD_LIST = 'list'
+CMD_SHUTDOWN = 'shutdown'
+
+_METHOD = '__method__'      # getattr reply for callables
+
+#===============================================================================================
+#   Exceptions
+#===============================================================================================
+class RemoteDeviceError(AutoLabDevice.AutoLabDeviceError):
+    """
+    The device server failed a request (or its error could not be sent back as is)
+    """
+    pass
+
+#===============================================================================================
+#   DeviceServer
+#===============================================================================================
+class _DeviceRef(object):
+    """
+    A RemoteDevice passed as a device argument (e.g. the stage of a simulated lock-in).
+    The server replaces it with its own device of that name.
+    """
+
+    def __init__(self, name):
+        super(_DeviceRef, self).__init__()
+        self.name = name
+
+class DeviceServer(object):
+
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=None):
+        super(DeviceServer, self).__init__()
+        self.requested_address = address
+        self.authkey = authkey or server_key(create=True)
+        self.devices = {}
+        self._devices_lock = threading.Lock()
+        self._listener = None
+        self._accept_thread = None
+        self._stop = threading.Event()
+
+    @property
+    def address(self):
+        return self._listener.address if self._listener is not None else self.requested_address
+
+    def start(self):
+        """
+        Listens on a background thread. Port 0 picks a free port (see address).
+        """
+        self._stop.clear()
+        self._listener = Listener(self.requested_address, authkey=self.authkey)
+        self._accept_thread = threading.Thread(target=self._accept_loop, name='DeviceServer', daemon=True)
+        self._accept_thread.start()
+        logger.info("Device server listening on %s:%d" % self.address)
+
+    def serve_forever(self):
+        self.start()
+        try:
+            self._stop.wait()
+        except KeyboardInterrupt:
+            pass
+        self.close()
+
+    def close(self):
+        """
+        Stops listening and closes all the devices
+        """
+        if self._listener is None:
+            return
+
+        self._stop.set()
+        try:
+            Client(self.address, authkey=self.authkey).close()    # wake up accept()
+        except OSError:
+            pass
+        self._accept_thread.join()
+        self._listener.close()
+        self._listener = None
+
+        with self._devices_lock:
+            for name, dev in self.devices.items():
+                logger.info("Closing %s" % (name, ))
+                dev.close()
+            self.devices = {}
+
+    def open_device(self, name, args=(), kwargs=None):
+        """
+        Returns the connection state of device name, creating and connecting it on first use
+        """
+        with self._devices_lock:
+            dev = self._create_device(name, args, kwargs or {})
+
+        with dev.device_lock:      # one connect when several scripts open the device at once
+            if not dev.is_connected:
+                logger.info("Connecting %s" % (name, ))
+                dev.connect()
+            return dev.is_connected
+
+    def handle(self, cmd, *args):
+        if cmd == CMD_OPEN:
+            return self.open_device(*args)
+        if cmd == CMD_LIST:
+            return {name: dev.is_connected for name, dev in self.devices.items()}
+        if cmd == CMD_SHUTDOWN:
+            self._stop.set()
+            return True
+
+        dev = self._device(args[0])
+        if cmd == CMD_GETATTR:
+            value = getattr(dev, args[1])
+            return _METHOD if callable(value) else value
+        if cmd == CMD_SETATTR:
+            return setattr(dev, args[1], args[2])
+        if cmd == CMD_CALL:
+            _, method, call_args, call_kwargs = args
+            return getattr(dev, method)(*call_args, **call_kwargs)
+
+        raise RemoteDeviceError("Unknown device server command %r" % (cmd, ))
+
+    def _device(self, name):
+        dev = self.devices.get(name)
+        if dev is None:
+            raise RemoteDeviceError("Device %r is not open on the server." % (name, ))
+        return dev
+
+    def _create_device(self, name, args=(), kwargs=None):
+        # called with _devices_lock held. Referenced devices are created (not connected) on demand,
+        # so a lock-in and the stage it refers to can be opened in any order
+        dev = self.devices.get(name)
+        if dev is None:
+            dev = Registry.create_device(name, *self._resolve(args), **self._resolve(kwargs or {}))
+            self.devices[name] = dev
+        return dev
+
+    def _resolve(self, value):
+        if isinstance(value, _DeviceRef):
+            return self._create_device(value.name)
+        if isinstance(value, dict):
+            return {key: self._resolve(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return type(value)(self._resolve(item) for item in value)
+        return value
+
+    def _accept_loop(self):
+        while not self._stop.is_set():
+            try:
+                conn = self._listener.accept()
+            except OSError:
+                if self._stop.is_set():
+                    break
+                logger.exception("Device server accept failed.")
+                continue
+            except (AuthenticationError, EOFError) as err:
+                logger.warning("Refused a device server client: %s" % (err, ))     # wrong key or dropped handshake
+                continue
+            threading.Thread(target=self._serve_connection, args=(conn, ), daemon=True).start()
+
+    def _serve_connection(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+
+                try:
+                    reply = ('ok', self.handle(*request))
+                except Exception as err:
+                    reply = ('error', err)
+
+                try:
+                    conn.send(reply)
+                except (pickle.PicklingError, TypeError, AttributeError) as err:
+                    conn.send(('error', RemoteDeviceError("Reply to %r could not be sent: %r" % (request[0], err))))
+
+#===============================================================================================
+#   RemoteDevice
+#===============================================================================================
+class RemoteDevice(AutoLabDevice.AutoLabDevice):
+    """
+    Script side proxy of a device held by the server. connect() opens the device on the server
+    (only the first script pays for it), close() just disconnects this proxy.
+    Other attributes and methods are forwarded, *_async methods run the remote call on an executor.
+    """
+
+    def __init__(self, name, *args, address=DEFAULT_ADDRESS, authkey=None, **kwargs):
+        super(RemoteDevice, self).__init__()
+        self._name = name
+        self._args = args
+        self._kwargs = kwargs
+        self._address = address
+        self._authkey = authkey
+        self._conn = None
+        self._conn_lock = threading.Lock()
+        self._methods = set()
+
+    @property
+    def name(self):
+        return self._name
+
+    def connect(self):
+        if self._conn is None:
+            try:
+                self._conn = Client(self._address, authkey=self._authkey or server_key())
+            except OSError as err:
+                raise RemoteDeviceError("Can't reach the device server at %s:%d: %s" % (self._address + (err, ))) from err
+            except AuthenticationError as err:
+                raise RemoteDeviceError("Device server at %s:%d refused the key - check %s." % (self._address + (SERVER_KEY_ENV, ))) from err
+        self._is_connected = self._request(CMD_OPEN, self._name, self._args, self._kwargs)
+
+    def close(self):
+        self._is_connected = False
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _request(self, *request):
+        if self._conn is None:
+            raise RemoteDeviceError("Remote device %r is not connected." % (self._name, ))
+
+        with self._conn_lock:
+            self._conn.send(request)
+            status, value = self._conn.recv()
+        if status == 'error':
+            raise value
+        return value
+
+    def _remote_method(self, method):
+        return lambda *args, **kwargs: self._request(CMD_CALL, self._name, method, args, kwargs)
+
+    def __getattr__(self, attr):
+        # only called for attributes missing locally
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        if attr.endswith('_async'):
+            return lambda *args, **kwargs: self.call_async(attr[:-len('_async')], *args, **kwargs)
+        if attr in self._methods:
+            return self._remote_method(attr)
+
+        value = self._request(CMD_GETATTR, self._name, attr)
+        if isinstance(value, str) and value == _METHOD:
+            self._methods.add(attr)
+            return self._remote_method(attr)
+        return value
+
+    def __setattr__(self, attr, value):
+        if attr.startswith('_') or attr == 'device_lock':
+            super(RemoteDevice, self).__setattr__(attr, value)
+        else:
+            self._request(CMD_SETATTR, self._name, attr, value)
+
+    def __reduce__(self):
+        return (_DeviceRef, (self._name, ))
+
+#===============================================================================================
+#   Functions
+#===============================================================================================
+def parse_address(text):
+    """
+    "host:port" or "port" -> (host, port)
+    """
+    host, _, port = text.rpartition(':')
+    return (host or DEFAULT_HOST, int(port))
+
+def server_key(create=False, path=SERVER_KEY_PATH):
+    """
+    The device server authentication key: AUTOLAB_SERVER_KEY, else the key file at path. With create
+    (the server) a missing key file is generated. Raises RemoteDeviceError if there is no usable key.
+    """
+    key = os.environ.get(SERVER_KEY_ENV)
+    if key:
+        return key.encode()
+
+    if create and not os.path.exists(path):
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass    # another server created it meanwhile
+        except OSError as err:
+            raise RemoteDeviceError("Can't create the device server key %s: %s" % (path, err)) from err
+        else:
+            with os.fdopen(fd, 'w') as f:
+                f.write(secrets.token_hex(SERVER_KEY_BYTES))
+            logger.info("Created device server key %s" % (path, ))
+
+    try:
+        # a key others can read is no secret
+        if os.name == 'posix' and os.stat(path).st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+            raise RemoteDeviceError("Device server key %s is accessible by other users - chmod 600 it." % (path, ))
+        with open(path, 'r') as f:
+            key = f.read().strip()
+    except OSError as err:
+        raise RemoteDeviceError("No device server key - set %s or start the server to create %s (%s)." % (SERVER_KEY_ENV, path, err)) from err
+    if not key:
+        raise RemoteDeviceError("Device server key %s is empty." % (path, ))
+    return key.encode()
+
+def shutdown_server(address=DEFAULT_ADDRESS, authkey=None):
+    with Client(address, authkey=authkey or server_key()) as conn:
+        conn.send((CMD_SHUTDOWN, ))
+        return conn.recv()[1]
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--address", type=parse_address, default=DEFAULT_ADDRESS, help="[host:]port to listen on")
+    parser.add_argument("--preload", nargs='*', default=[], choices=Registry.available_devices(),
+                        help="devices to connect at start up")
+    parser.add_argument("--shutdown", action="store_true", help="stop a running server")
+    return parser.parse_args()
+
+#===============================================================================================
+#   Main
+#===============================================================================================
+def main():
+    FORMAT = '%(asctime)s @ %(levelname)s --- %(filename)s: %(message)s'
+    logging.basicConfig(format=FORMAT, stream=sys.stdout, level=logging.INFO)
+    args = parse_args()
+
+    try:
+        if args.shutdown:
+            shutdown_server(args.address)
+            return
+        server = DeviceServer(args.address)
+    except RemoteDeviceError as err:
+        logger.error(err)
+        return
+
+    for name in args.preload:
+        try:
+            if not server.open_device(name):
+                logger.error("Failed connecting %s" % (name, ))
+        except AutoLabDevice.AutoLabDeviceError as err:
+            logger.error("Failed connecting %s: %s" % (name, err))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    # run the main of the imported module, so the unpickled _DeviceRef is the class the server checks
+    import devices.DeviceServer
+    devices.DeviceServer.main()
@@ -0,0 +1,52 @@
+#===============================================================================================
+#   Name:           Registry.py
+#   Description:    Lazy device registry - driver modules are imported only when a device is created
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import importlib
+
+import logging
+logger = logging.getLogger(__name__)
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+# device name -> "module:class". Vendor libraries are loaded by the class on connect()
+DEVICES = {
+    'sr860'                 :   'devices.SR860:SR860Device',
+    'standa'                :   'devices.standa:StandaDevice',
+    'attodry'               :   'devices.Attodry:CryostatDevice',
+    'simulated_sr860'       :   'devices.Simulated:SimulatedSR860Device',
+    'simulated_standa'      :   'devices.Simulated:SimulatedStandaDevice',
+    'simulated_attodry'     :   'devices.Simulated:SimulatedCryostatDevice',
+}
+
+#===============================================================================================
+#   Functions
+#===============================================================================================
+def register_device(name, class_path):
+    """
+    Registers a device class given as "module:class"
+    """
+    DEVICES[name] = class_path
+
+def available_devices():
+    return sorted(DEVICES)
+
+def get_device_class(name):
+    if name not in DEVICES:
+        raise KeyError("Unknown device %r. Available devices: %s" % (name, ", ".join(available_devices())))
+
+    module_name, class_name = DEVICES[name].split(':')
+    return getattr(importlib.import_module(module_name), class_name)
+
+def create_device(name, *args, **kwargs):
+    return get_device_class(name)(*args, **kwargs)
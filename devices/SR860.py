@@ -6,9 +6,10 @@
 #===============================================================================================
 #   Python Imports
 #===============================================================================================
+import math
 import time
+import threading
 import numpy as np
-from qcodes.instrument_drivers.stanford_research.SR860 import SR860  # the lock-in amplifier
 
 import logging
 logger = logging.getLogger(__name__)
@@ -17,47 +18,186 @@ logger = logging.getLogger(__name__)
 #   Solution Imports
 #===============================================================================================
 import devices.AutoLabDevice as AutoLabDevice
+import devices.Trace as Trace
+import scans.Statistics as Statistics
+import storage.RingBuffer as RingBuffer
 
 #===============================================================================================
 #   Constants
 #===============================================================================================
 LOCKIN_SERIAL_PORT = "USB0::0xB506::0x2000::004529::INSTR"
 
+# capture modes
+CAPTURE_MODE_POLLING = "polling"    # one get_data_channels_dict() round trip per sample
+CAPTURE_MODE_BUFFER = "buffer"      # lock-in internal capture buffer, one bulk binary transfer
+CAPTURE_MODE_STREAM = "stream"      # background thread keeps draining the lock-in into a ring buffer
+CAPTURE_MODES = [CAPTURE_MODE_POLLING, CAPTURE_MODE_BUFFER, CAPTURE_MODE_STREAM]
+
+BUFFER_CAPTURE_CONFIG = "X,Y,R,T"   # variables stored in the internal capture buffer
+BUFFER_BYTES_PER_SAMPLE = 4 * len(BUFFER_CAPTURE_CONFIG.split(","))     # float32 per variable
+
+# adaptive averaging
+ADAPTIVE_MIN_SAMPLES = 50
+ADAPTIVE_MAX_SAMPLES = 3000
+ADAPTIVE_BLOCK_SIZE = 50
+
+# low pass filter, by slope (dB/oct): equivalent noise bandwidth (x 1/time constant) and time to settle within 1% (x time constant)
+FILTER_NOISE_BANDWIDTH = {6: 1 / 4, 12: 1 / 8, 18: 3 / 32, 24: 5 / 64}
+FILTER_SETTLE_TIME_CONSTANTS = {6: 4.6, 12: 6.6, 18: 8.4, 24: 10.0}
+CAPTURE_EFFICIENCY = 0.9            # auto configuration takes the slowest rate within this of the shortest possible capture
+
+# streaming
+STREAM_BLOCK_IN_SEC = 0.25          # length of each buffer capture the stream thread drains
+STREAM_TIMEOUT_IN_SEC = 5.0         # extra wait for a stream window beyond its end time
+
 #===============================================================================================
 #   Lockin class
 #===============================================================================================
 class SR860Device(AutoLabDevice.AutoLabDevice):
 
-    def __init__(self):
+    METRICS_NAME = 'sr860'
+
+    def __init__(self, capture_mode=CAPTURE_MODE_BUFFER):
         super(SR860Device, self).__init__()
         self.lockin = None
+        self.capture_mode = capture_mode
         self._sample_frequency = 0
+        self._achieved_sample_frequency = 0
+        self._time_constant = None
+        self._filter_slope = None
+        self.settle_time = 0            # wait after a stage move before capturing (sec), set by auto_configure
+        self._last_effective_sample_count = 0
+        self._capture_start_time = None
+        self._stream = None
+        self._stream_thread = None
+        self._stream_stop = threading.Event()
+        self._stream_error = None
 
     def connect(self):
-        self.lockin = SR860("lockin", LOCKIN_SERIAL_PORT)
+        self.lockin = Trace.open_channel('sr860', self._open_lockin)
         self._is_connected = True
 
+    def _open_lockin(self):
+        # qcodes is heavy to import and is not needed by simulated or replayed lock-ins
+        try:
+            from qcodes.instrument_drivers.stanford_research.SR860 import SR860  # the lock-in amplifier
+        except ImportError as err:
+            raise AutoLabDevice.DriverLoadError("Can't import the qcodes SR860 driver: %s" % (err, )) from err
+
+        return SR860("lockin", LOCKIN_SERIAL_PORT)
+
     def close(self):
+        self.stop_stream()
         self._is_connected = False
 
     @property    
     def sample_frequency(self):
         return self._sample_frequency
 
+    @property
+    def achieved_sample_frequency(self):
+        """
+        The effective sample rate of the last capture (samples / wall time)
+        """
+        return self._achieved_sample_frequency
+
+    @property
+    def time_constant(self):
+        """
+        Lock-in time constant (sec) read by calc_capture_freq
+        """
+        return self._time_constant
+
+    @property
+    def filter_slope(self):
+        """
+        Lock-in low pass filter slope (dB/oct) read by calc_capture_freq
+        """
+        return self._filter_slope
+
+    @property
+    def sample_correlation(self):
+        """
+        Lag-1 correlation the low pass filter introduces between consecutive samples
+        """
+        time_constant = self.time_constant
+        if time_constant and self.filter_slope in FILTER_NOISE_BANDWIDTH:
+            time_constant = equivalent_time_constant(time_constant, self.filter_slope)
+        return Statistics.time_constant_correlation(self.sample_frequency, time_constant)
+
+    @property
+    def last_effective_sample_count(self):
+        """
+        Number of independent samples in the last capture_until_converged
+        """
+        return self._last_effective_sample_count
+
+    @property
+    def is_streaming(self):
+        return self._stream_thread is not None and self._stream_thread.is_alive()
+
+    @property
+    def stream(self):
+        """
+        The ring buffer of the running (or last) stream - t, x, y, r rows. Also used for live monitoring.
+        """
+        return self._stream
+
     def calc_capture_freq(self, desired_capture_rate):
         if not self.is_connected:
             logger.error("SR860 device is not connected. Cannot get capture frequency.")
             return None
 
-        chosen_freq = None
-        for freq in self.lockin.buffer.available_frequencies:
-            if desired_capture_rate >= freq:
-                chosen_freq = freq
-                break
+        # the stream thread owns the buffer - restart it with the new rate
+        streaming = self.is_streaming
+        if streaming:
+            self.stop_stream()
+
+        with self.command('configure'):
+            chosen_freq = None
+            for freq in self.lockin.buffer.available_frequencies:
+                if desired_capture_rate >= freq:
+                    chosen_freq = freq
+                    break
+
+            self._sample_frequency = chosen_freq
+            self._time_constant = self.lockin.time_constant()
+            self._filter_slope = self.lockin.filter_slope()
+
+            # the internal buffer fills at its own rate, so it has to be configured on the device
+            if chosen_freq and self.capture_mode != CAPTURE_MODE_POLLING:
+                self.lockin.buffer.capture_config(BUFFER_CAPTURE_CONFIG)
+                self.lockin.buffer.set_capture_rate(chosen_freq)
+
+        if streaming:
+            self.start_stream()
+
+    def auto_configure(self, independent_samples):
+        """
+        Reads the time constant and filter slope and sets the capture rate and settle time that collect
+        independent_samples uncorrelated samples per point in about the shortest time the filter allows.
+        Returns the capture plan (see plan_capture), or None if the lock-in is not connected.
+        """
+        if not self.is_connected:
+            logger.error("SR860 device is not connected. Cannot configure the capture.")
+            return None
 
-        self._sample_frequency = chosen_freq
+        with self.command('configure'):
+            time_constant, filter_slope = self.lockin.time_constant(), self.lockin.filter_slope()
+            available_frequencies = self.lockin.buffer.available_frequencies
+        plan = plan_capture(independent_samples, time_constant, filter_slope, available_frequencies)
+        self.calc_capture_freq(plan['sample_frequency'])
+        self.settle_time = plan['settle_time']
+        return plan
 
-    def capture_samples(self, samples_count):
+    def capture_samples(self, samples_count, mode=None):
+        """
+        Captures samples_count samples of X, Y and R and returns them as numpy arrays.
+        mode is CAPTURE_MODE_BUFFER (hardware paced capture, one bulk transfer),
+        CAPTURE_MODE_POLLING (one query per sample) or CAPTURE_MODE_STREAM (the samples streamed
+        during the next samples_count / sample_frequency seconds, returned as ring buffer views).
+        Defaults to the device's capture_mode. The achieved rate is kept in achieved_sample_frequency.
+        """
         if not self.is_connected:
             logger.error("SR860 device is not connected. Cannot capture samples.")
             return None, None, None
@@ -66,16 +206,247 @@ class SR860Device(AutoLabDevice.AutoLabDevice):
             logger.error("Sample frequency is not calculated for SR860 device. Cannot capture samples.")
             return None, None, None
 
+        mode = mode or self.capture_mode
+        start_time = time.perf_counter()
+        if mode == CAPTURE_MODE_BUFFER:
+            self.arm_capture(samples_count)
+            x, y, r = self.fetch_capture(samples_count)
+        elif mode == CAPTURE_MODE_STREAM:
+            if not self.is_streaming:
+                self.start_stream()
+            _, x, y, r = self.stream_window(start_time, start_time + samples_count / self.sample_frequency)
+            if x is None:
+                self.count('capture.errors')
+                return None, None, None
+        else:
+            x, y, r = self._poll_samples(samples_count)
+
+        elapsed = time.perf_counter() - start_time
+        self._achieved_sample_frequency = len(x) / elapsed if elapsed > 0 else 0
+        self.observe('capture', elapsed)
+        self.count('samples', len(x))
+        self.set_gauge('achieved_sample_frequency', self._achieved_sample_frequency)
+        logger.debug("Captured %d samples at %.2f Hz (requested %.2f Hz)" % (len(x), self.achieved_sample_frequency, self.sample_frequency))
+
+        return x, y, r
+
+    async def capture_samples_async(self, samples_count, mode=None):
+        return await self.run_async(self.capture_samples, samples_count, mode)
+
+    def capture_until_converged(self, target_error, min_samples=ADAPTIVE_MIN_SAMPLES, max_samples=ADAPTIVE_MAX_SAMPLES,
+                                block_size=ADAPTIVE_BLOCK_SIZE, mode=None):
+        """
+        Captures blocks of samples until the standard error of the X mean reaches target_error (V)
+        or max_samples were taken. The error uses the effective number of independent samples,
+        since the time constant correlates consecutive samples.
+        Returns all the captured X, Y and R samples.
+        """
+        stats = Statistics.RunningStats()
+        blocks = []
+        n_eff = 0
+        while stats.count < max_samples:
+            count = int(min(block_size, max_samples - stats.count))
+            block = self.capture_samples(count, mode)
+            if block[0] is None:
+                return None, None, None
+
+            blocks.append(block)
+            stats.update(block[0])
+            if stats.count < min_samples:
+                continue
+
+            samples_x = np.concatenate([b[0] for b in blocks])
+            correlation = max(Statistics.lag1_autocorrelation(samples_x), self.sample_correlation)
+            n_eff = Statistics.effective_sample_count(int(stats.count), correlation)
+            if np.sqrt(stats.variance / n_eff) <= target_error:
+                break
+
+        self._last_effective_sample_count = n_eff
+        logger.debug("Captured %d samples (%.1f effective) for a %.2e V target error" % (stats.count, n_eff, target_error))
+        return tuple(np.concatenate([b[i] for b in blocks]) for i in range(3))
+
+    def arm_capture(self, samples_count):
+        """
+        Starts a one-shot capture of samples_count samples into the lock-in internal buffer.
+        The buffer fills at sample_frequency without any host involvement.
+        """
+        buffer = self.lockin.buffer
+        with self.command('arm'):
+            buffer.set_capture_length_to_fit_samples(samples_count)
+            buffer.start_capture("ONE", "IMM")
+        self._capture_start_time = time.perf_counter()
+
+    def fetch_capture(self, samples_count):
+        """
+        Waits for an armed capture to hold samples_count samples and reads them in one binary transfer
+        """
+        buffer = self.lockin.buffer
+        with self.command('wait'):
+            buffer.wait_until_samples_captured(samples_count)
+        with self.command('read'):
+            data = buffer.get_capture_data(samples_count)
+            buffer.stop_capture()
+
+        return np.asarray(data['X']), np.asarray(data['Y']), np.asarray(data['R'])
+
+    def fetch_available_capture(self):
+        """
+        Stops an armed capture and reads whatever samples were captured so far.
+        Used when the capture duration is set by something else (e.g. a moving stage).
+        """
+        buffer = self.lockin.buffer
+        with self.command('stop'):
+            buffer.stop_capture()
+            samples_count = int(buffer.count_capture_bytes()) // BUFFER_BYTES_PER_SAMPLE
+        if not samples_count:
+            return np.zeros(0), np.zeros(0), np.zeros(0)
+
+        with self.command('read'):
+            data = buffer.get_capture_data(samples_count)
+        return np.asarray(data['X']), np.asarray(data['Y']), np.asarray(data['R'])
+
+    def start_stream(self, capacity=RingBuffer.DEFAULT_CAPACITY, block_duration=STREAM_BLOCK_IN_SEC):
+        """
+        Starts a thread that keeps capturing block_duration long buffer captures (or polling, in
+        CAPTURE_MODE_POLLING) and appends the timestamped samples to a ring buffer of capacity samples.
+        While streaming the thread owns the lock-in buffer - use stream_window instead of captures.
+        """
+        if not self.is_connected or not self.sample_frequency:
+            logger.error("SR860 device is not connected or has no sample frequency. Cannot stream.")
+            return False
+
+        if self.is_streaming:
+            return True
+
+        self._stream = RingBuffer.SampleRingBuffer(capacity)
+        self._stream_error = None
+        self._stream_stop.clear()
+        self._stream_thread = threading.Thread(target=self._stream_loop, args=(block_duration, ), name='SR860Stream', daemon=True)
+        self._stream_thread.start()
+        return True
+
+    def stop_stream(self):
+        if self._stream_thread is None:
+            return
+
+        self._stream_stop.set()
+        self._stream_thread.join()
+        self._stream_thread = None
+
+    def stream_window(self, start_time, end_time, timeout=STREAM_TIMEOUT_IN_SEC):
+        """
+        Waits until the stream passed end_time and returns the t, x, y, r samples taken between
+        start_time and end_time (time.perf_counter) as views into the ring buffer.
+        Returns Nones if the stream stopped or the window was already overwritten.
+        """
+        if self._stream is None:
+            logger.error("SR860 stream was not started.")
+            return None, None, None, None
+
+        wait_time = end_time - time.perf_counter() + timeout
+        if not self._stream.wait_for_time(end_time, max(wait_time, 0)):
+            logger.error("SR860 stream did not reach the end of the window (%r)." % (self._stream_error, ))
+            return None, None, None, None
+
+        window = self._stream.window(start_time, end_time)
+        if window is None:
+            return None, None, None, None
+        return tuple(window)
+
+    def _stream_loop(self, block_duration):
+        samples_count = max(1, int(round(block_duration * self.sample_frequency)))
+        try:
+            while not self._stream_stop.is_set():
+                if self.capture_mode == CAPTURE_MODE_POLLING:
+                    t, x, y, r = self._poll_samples(samples_count, timestamps=True)
+                else:
+                    self.arm_capture(samples_count)
+                    x, y, r = self.fetch_capture(samples_count)
+                    t = self._capture_start_time + np.arange(len(x)) / self.sample_frequency
+                self._stream.append((t, x, y, r))
+
+                # how far the newest streamed sample trails the clock, and how full the ring is
+                if len(t):
+                    self.set_gauge('stream_lag', time.perf_counter() - t[-1])
+                self.set_gauge('stream_fill', len(self._stream) / self._stream.capacity)
+        except Exception as err:
+            logger.exception("SR860 stream stopped.")
+            self.count('stream.errors')
+            self._stream_error = err
+
+    def _poll_samples(self, samples_count, timestamps=False):
         time_interval = 1 / self.sample_frequency
+        t = np.zeros(samples_count)
         x = np.zeros(samples_count)
         y = np.zeros(samples_count)
         r = np.zeros(samples_count)
 
         for i in range(samples_count):
-            data = self.lockin.get_data_channels_dict()
+            with self.command('read'):
+                data = self.lockin.get_data_channels_dict()
+            t[i] = time.perf_counter()
             x[i] = data['X']
             y[i] = data['Y']
             r[i] = data['R']
             time.sleep(time_interval)
 
+        if timestamps:
+            return t, x, y, r
         return x, y, r
+
+#===============================================================================================
+#   Functions
+#===============================================================================================
+def noise_bandwidth(time_constant, filter_slope):
+    """
+    Equivalent noise bandwidth (Hz) of the lock-in low pass filter
+    """
+    return FILTER_NOISE_BANDWIDTH[filter_slope] / time_constant
+
+def equivalent_time_constant(time_constant, filter_slope):
+    """
+    Time constant of the first order filter with the same noise bandwidth - the one the
+    sample correlation model (Statistics.time_constant_correlation) assumes
+    """
+    return 1 / (4 * noise_bandwidth(time_constant, filter_slope))
+
+def plan_capture(independent_samples, time_constant, filter_slope, available_frequencies, efficiency=CAPTURE_EFFICIENCY):
+    """
+    A filtered signal holds about 2 * noise bandwidth independent samples per second however fast
+    it is sampled, so faster capture rates only add correlated samples. Picks the slowest available
+    rate whose capture of independent_samples takes at most 1 / efficiency of that limit - or,
+    if none does (target_met False), the fastest one.
+    Returns the rate, sample count, capture duration and post-move settle time (sec).
+    Raises ValueError for an unknown filter slope or no available rates.
+    """
+    if filter_slope not in FILTER_NOISE_BANDWIDTH:
+        raise ValueError("Unknown filter slope %r dB/oct (expected one of %s)." % (filter_slope, sorted(FILTER_NOISE_BANDWIDTH)))
+    if not len(available_frequencies):
+        raise ValueError("No available capture rates to choose from.")
+
+    bandwidth = noise_bandwidth(time_constant, filter_slope)
+    shortest_duration = independent_samples / (2 * bandwidth)
+    filter_time_constant = equivalent_time_constant(time_constant, filter_slope)
+
+    target_met = False
+    for freq in sorted(available_frequencies):
+        correlation = min(Statistics.time_constant_correlation(freq, filter_time_constant), Statistics.MAX_CORRELATION)
+        samples_count = int(math.ceil(independent_samples * (1 + correlation) / (1 - correlation)))
+        if samples_count / freq * efficiency <= shortest_duration:
+            target_met = True
+            break
+    if not target_met:
+        logger.warning("No capture rate collects %d independent samples within %.0f%% of the %.3f sec minimum - using the fastest, %.1f Hz." %
+                       (independent_samples, 100 / efficiency, shortest_duration, freq))
+
+    return {
+        'sample_frequency'      :   freq,
+        'samples_count'         :   samples_count,
+        'capture_duration'      :   samples_count / freq,
+        'settle_time'           :   FILTER_SETTLE_TIME_CONSTANTS[filter_slope] * time_constant,
+        'independent_samples'   :   independent_samples,
+        'time_constant'         :   time_constant,
+        'filter_slope'          :   filter_slope,
+        'noise_bandwidth'       :   bandwidth,
+        'target_met'            :   target_met,
+    }
@@ -0,0 +1,465 @@
+#===============================================================================================
+#   Name:           Simulated.py
+#   Description:    Simulated SR860, Standa and Attodry devices with latency models
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import time
+import collections
+import numpy as np
+import scipy.constants
+import scipy.signal
+import scipy.special
+
+import logging
+logger = logging.getLogger(__name__)
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import devices.AutoLabDevice as AutoLabDevice
+import devices.SR860 as SR860
+import devices.Attodry as Attodry
+import devices.standa as standa
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+# standa
+STAGE_STEPS_PER_MM = 40000
+STAGE_COMMAND_LATENCY_IN_SEC = 0.002
+STAGE_CONNECT_LATENCY_IN_SEC = 2.0          # enumerate with network probe
+STAGE_VELOCITY_IN_MM_PER_SEC = 5.0
+STAGE_ACCELERATION_IN_MM_PER_SEC2 = 20.0
+STAGE_TRAJECTORY_HISTORY = 1000             # move segments kept for position_at() lookups
+STAGE_POLL_INTERVAL_IN_SEC = 0.01
+
+# lock-in
+LOCKIN_COMMAND_LATENCY_IN_SEC = 0.005       # VISA round trip
+LOCKIN_CONNECT_LATENCY_IN_SEC = 0.5
+LOCKIN_TRANSFER_RATE_IN_BYTES_PER_SEC = 1e6
+LOCKIN_MAX_CAPTURE_RATE = 1.25e6
+LOCKIN_CAPTURE_RATE_COUNT = 21              # max rate / 2**n, n = 0..20
+LOCKIN_TIME_CONSTANT_IN_SEC = 0.1
+LOCKIN_FILTER_SLOPE_IN_DB = 6                # the simulated filter is first order
+LOCKIN_NOISE_IN_V = 1e-5
+LOCKIN_QUADRATURE_FRACTION = 0.1            # part of the signal that shows up in Y
+
+# synthetic pump-probe response
+RESPONSE_AMPLITUDE_IN_V = 1e-3
+RESPONSE_DECAY_TIME_IN_SEC = 2e-12
+RESPONSE_PULSE_WIDTH_IN_SEC = 150e-15
+RESPONSE_TIME_ZERO_IN_MM = 0.0
+RESPONSE_OFFSET_IN_V = 0.0
+
+# cryostat
+CRYOSTAT_COMMAND_LATENCY_IN_SEC = 0.01      # worker round trip
+CRYOSTAT_THERMAL_TIME_CONSTANT_IN_SEC = 120.0
+CRYOSTAT_NOISE_IN_K = 0.01
+CRYOSTAT_INITIAL_TEMPERATURE_IN_K = 300.0
+
+#===============================================================================================
+#   Functions
+#===============================================================================================
+def pump_probe_response(delay, amplitude=RESPONSE_AMPLITUDE_IN_V, decay_time=RESPONSE_DECAY_TIME_IN_SEC,
+                        pulse_width=RESPONSE_PULSE_WIDTH_IN_SEC, offset=RESPONSE_OFFSET_IN_V):
+    """
+    Single exponential decay convolved with a gaussian pump-probe cross correlation.
+    delay is given in sec.
+    """
+    delay = np.asarray(delay, dtype=float)
+    with np.errstate(over='ignore', invalid='ignore'):
+        response = 0.5 * amplitude * np.exp(pulse_width ** 2 / (2 * decay_time ** 2) - delay / decay_time) * \
+                   scipy.special.erfc((pulse_width / decay_time - delay / pulse_width) / np.sqrt(2))
+
+    return np.nan_to_num(response) + offset
+
+def position_to_delay(position, time_zero=RESPONSE_TIME_ZERO_IN_MM):
+    return (np.asarray(position, dtype=float) - time_zero) * 1e-3 * 2 / scipy.constants.c
+
+def _travelled_distance(elapsed, distance, velocity, acceleration):
+    """
+    Distance travelled after elapsed sec along a trapezoidal (or triangular) velocity profile
+    """
+    distance = abs(distance)
+    accel_time = velocity / acceleration
+    if acceleration * accel_time ** 2 > distance:
+        accel_time = np.sqrt(distance / acceleration)
+        cruise_time = 0
+    else:
+        cruise_time = (distance - acceleration * accel_time ** 2) / velocity
+
+    peak_velocity = acceleration * accel_time
+    total_time = 2 * accel_time + cruise_time
+    elapsed = np.clip(elapsed, 0, total_time)
+    return np.where(elapsed < accel_time, 0.5 * acceleration * elapsed ** 2,
+                    np.where(elapsed < accel_time + cruise_time,
+                             0.5 * acceleration * accel_time ** 2 + peak_velocity * (elapsed - accel_time),
+                             distance - 0.5 * acceleration * (total_time - elapsed) ** 2))
+
+def _motion_duration(distance, velocity, acceleration):
+    distance = abs(distance)
+    accel_time = velocity / acceleration
+    if acceleration * accel_time ** 2 > distance:
+        return 2 * np.sqrt(distance / acceleration)
+
+    return 2 * accel_time + (distance - acceleration * accel_time ** 2) / velocity
+
+#===============================================================================================
+#   SimulatedStandaDevice
+#===============================================================================================
+class SimulatedStandaDevice(AutoLabDevice.AutoLabDevice):
+    """
+    Delay stage with a trapezoidal motion profile. Mirrors the StandaDevice API.
+    The trajectory history is kept so the stage position can be looked up at any past time.
+    """
+
+    METRICS_NAME = 'standa'
+
+    def __init__(self, command_latency=STAGE_COMMAND_LATENCY_IN_SEC, connect_latency=STAGE_CONNECT_LATENCY_IN_SEC,
+                 velocity=STAGE_VELOCITY_IN_MM_PER_SEC, acceleration=STAGE_ACCELERATION_IN_MM_PER_SEC2, position=0.0):
+        super(SimulatedStandaDevice, self).__init__()
+        self.device_id = AutoLabDevice.INVALID_DEVICE_ID
+        self.command_latency = command_latency
+        self.connect_latency = connect_latency
+        self.velocity = velocity
+        self.acceleration = acceleration
+        self.position = position
+        self._initial_position = position
+        self.last_move_time = 0
+        self.last_settle_time = 0
+        self._segments = collections.deque(maxlen=STAGE_TRAJECTORY_HISTORY)    # (start, from, to, velocity, acceleration, duration)
+
+    def connect(self):
+        time.sleep(self.connect_latency)
+        self.device_id = 0
+        self._is_connected = True
+
+    def close(self):
+        self._is_connected = False
+
+    def position_at(self, times):
+        """
+        Stage position (mm) at the given time.perf_counter timestamps
+        """
+        scalar = np.ndim(times) == 0
+        times = np.atleast_1d(np.asarray(times, dtype=float))
+        positions = np.full(times.shape, self._initial_position, dtype=float)
+        if not self._segments:
+            return positions[0] if scalar else positions
+
+        starts = [segment[0] for segment in self._segments]
+        segment_index = np.searchsorted(starts, times, side='right') - 1
+        for i in np.unique(segment_index):
+            if i < 0:
+                continue
+            start, origin, target, velocity, acceleration, _ = self._segments[i]
+            mask = segment_index == i
+            travelled = _travelled_distance(times[mask] - start, target - origin, velocity, acceleration)
+            positions[mask] = origin + np.sign(target - origin) * travelled
+
+        return positions[0] if scalar else positions
+
+    def move_stage(self, position, calibration=STAGE_STEPS_PER_MM, tolerance=standa.SETTLE_TOLERANCE_IN_MM,
+                   timeout=standa.MOVE_TIMEOUT_IN_SEC, poll_interval=standa.MOVE_POLL_INTERVAL_IN_SEC):
+        if not self.is_connected:
+            logger.info("Standa device is not connected. Cannot move stage.")
+            return
+
+        logger.info(f"Moving stage to {position:.2f}")
+        with self.command('move'):
+            start_time = time.perf_counter()
+            self.start_move(position, calibration)
+            arrival_time, settled_time, self.position = standa.wait_for_position(lambda: self.get_move_status(calibration), position, tolerance,
+                                                                                 timeout=timeout, poll_interval=poll_interval)
+        self.last_move_time = arrival_time - start_time
+        self.last_settle_time = settled_time - arrival_time
+        self.observe('settle', self.last_settle_time)
+
+    async def move_stage_async(self, position, **kwargs):
+        return await self.run_async(self.move_stage, position, **kwargs)
+
+    async def get_position_async(self, calibration=STAGE_STEPS_PER_MM):
+        return await self.run_async(self.get_position, calibration)
+
+    def start_move(self, position, calibration=STAGE_STEPS_PER_MM):
+        if not self.is_connected:
+            logger.info("Standa device is not connected. Cannot move stage.")
+            return None
+
+        with self.command('start_move'):
+            time.sleep(self.command_latency)
+            target = np.round(position * calibration) / calibration
+            now = time.perf_counter()
+            origin = float(self.position_at(now))
+            duration = _motion_duration(target - origin, self.velocity, self.acceleration)
+            self._segments.append((now, origin, target, self.velocity, self.acceleration, duration))
+        return 0
+
+    def get_position(self, calibration=STAGE_STEPS_PER_MM):
+        with self.command('position'):
+            time.sleep(self.command_latency)
+        return float(self.position_at(time.perf_counter()))
+
+    def is_moving(self):
+        with self.command('status'):
+            time.sleep(self.command_latency)
+        if not self._segments:
+            return False
+
+        start, _, _, _, _, duration = self._segments[-1]
+        return time.perf_counter() < start + duration
+
+    def get_move_status(self, calibration=STAGE_STEPS_PER_MM):
+        with self.command('status'):
+            time.sleep(self.command_latency)
+        now = time.perf_counter()
+        moving = bool(self._segments) and now < self._segments[-1][0] + self._segments[-1][5]
+        return float(self.position_at(now)), moving, False
+
+    def get_speed(self, calibration=STAGE_STEPS_PER_MM):
+        with self.command('speed'):
+            time.sleep(self.command_latency)
+        return self.velocity
+
+    def set_speed(self, speed, calibration=STAGE_STEPS_PER_MM):
+        with self.command('set_speed'):
+            time.sleep(self.command_latency)
+            self.velocity = speed
+        return True
+
+    def track_move(self, position, poll_interval=STAGE_POLL_INTERVAL_IN_SEC, calibration=STAGE_STEPS_PER_MM):
+        times = []
+        positions = []
+        if self.start_move(position, calibration) is None:
+            return np.array(times), np.array(positions)
+
+        while True:
+            moving = self.is_moving()
+            times.append(time.perf_counter())
+            positions.append(self.get_position(calibration))
+            if not moving:
+                break
+            time.sleep(poll_interval)
+
+        self.position = positions[-1]
+        return np.array(times), np.array(positions)
+
+#===============================================================================================
+#   Simulated SR860 instrument (stands in for the qcodes SR860 driver)
+#===============================================================================================
+class _SimulatedSR860Buffer(object):
+
+    def __init__(self, instrument):
+        super(_SimulatedSR860Buffer, self).__init__()
+        self._instrument = instrument
+        self.available_frequencies = [LOCKIN_MAX_CAPTURE_RATE / 2 ** n for n in range(LOCKIN_CAPTURE_RATE_COUNT)]
+        self._capture_config = SR860.BUFFER_CAPTURE_CONFIG
+        self._capture_rate = self.available_frequencies[-1]
+        self._capture_length = 0
+        self._one_shot = True
+        self._start_time = None
+        self._stop_time = None
+
+    def capture_config(self, value=None):
+        self._instrument._command()
+        if value is None:
+            return self._capture_config
+        self._capture_config = value
+
+    def capture_rate(self):
+        self._instrument._command()
+        return self._capture_rate
+
+    def set_capture_rate(self, capture_rate_hz):
+        self._instrument._command()
+        self._capture_rate = capture_rate_hz
+
+    def set_capture_length_to_fit_samples(self, sample_count):
+        self._instrument._command()
+        self._capture_length = sample_count
+
+    def start_capture(self, acquisition_mode, trigger_mode):
+        self._instrument._command()
+        self._one_shot = acquisition_mode == "ONE"
+        self._start_time = time.perf_counter()
+        self._stop_time = None
+
+    def stop_capture(self):
+        self._instrument._command()
+        if self._start_time is not None and self._stop_time is None:
+            self._stop_time = time.perf_counter()
+
+    def _captured_samples(self):
+        if self._start_time is None:
+            return 0
+
+        end_time = self._stop_time if self._stop_time is not None else time.perf_counter()
+        captured = int((end_time - self._start_time) * self._capture_rate)
+        return min(captured, self._capture_length) if self._one_shot else captured
+
+    def count_capture_bytes(self):
+        self._instrument._command()
+        return self._captured_samples() * 4 * len(self._capture_config.split(","))
+
+    def wait_until_samples_captured(self, sample_count):
+        done_time = self._start_time + sample_count / self._capture_rate
+        time.sleep(max(0, done_time - time.perf_counter()))
+
+    def get_capture_data(self, sample_count):
+        variables = self._capture_config.split(",")
+        self._instrument._command()
+        time.sleep(sample_count * 4 * len(variables) / LOCKIN_TRANSFER_RATE_IN_BYTES_PER_SEC)
+
+        times = self._start_time + np.arange(sample_count) / self._capture_rate
+        data = self._instrument._channels_at(times)
+        return {var: data[var].astype(np.float32) for var in variables}
+
+class _SimulatedSR860(object):
+
+    def __init__(self, stage=None, command_latency=LOCKIN_COMMAND_LATENCY_IN_SEC, noise=LOCKIN_NOISE_IN_V,
+                 time_constant=LOCKIN_TIME_CONSTANT_IN_SEC, filter_slope=LOCKIN_FILTER_SLOPE_IN_DB, response=pump_probe_response):
+        super(_SimulatedSR860, self).__init__()
+        self.stage = stage
+        self.command_latency = command_latency
+        self.noise = noise
+        self.response = response
+        self._time_constant = time_constant
+        self._filter_slope = filter_slope
+        self.buffer = _SimulatedSR860Buffer(self)
+        self._rng = np.random.default_rng()
+
+        # low pass filter state
+        self._state_time = None
+        self._state_output = 0.0
+        self._state_noise = np.zeros(2)
+
+    def _command(self):
+        time.sleep(self.command_latency)
+
+    def time_constant(self, value=None):
+        self._command()
+        if value is None:
+            return self._time_constant
+        self._time_constant = value
+
+    def filter_slope(self, value=None):
+        self._command()
+        if value is None:
+            return self._filter_slope
+        self._filter_slope = value
+
+    def get_data_channels_dict(self):
+        self._command()
+        data = self._channels_at(np.array([time.perf_counter()]))
+        return {key: float(value[0]) for key, value in data.items()}
+
+    def _signal_at(self, times):
+        positions = self.stage.position_at(times) if self.stage is not None else np.zeros(len(times))
+        return self.response(position_to_delay(positions))
+
+    def _channels_at(self, times):
+        """
+        Lock-in output at increasing times - the input signal and noise pass through a first order
+        low pass with the lock-in time constant, so consecutive samples are correlated.
+        """
+        signal = self._signal_at(times)
+        noise_shape = (len(times), 2)
+
+        # restart from steady state if asked about times before the filter state
+        if self._state_time is None or times[0] < self._state_time:
+            self._state_output = signal[0]
+            self._state_noise = self._rng.normal(0, self.noise, 2)
+            self._state_time = times[0]
+
+        decay = np.exp(-np.diff(np.concatenate(([self._state_time], times))) / self._time_constant)
+        innovations = self._rng.normal(0, self.noise, noise_shape) * np.sqrt(1 - decay ** 2)[:, None]
+
+        # the first step may be irregular, the following samples are evenly spaced
+        output = np.empty(len(times))
+        noise = np.empty(noise_shape)
+        output[0] = decay[0] * self._state_output + (1 - decay[0]) * signal[0]
+        noise[0] = decay[0] * self._state_noise + innovations[0]
+        if len(times) > 1:
+            step_decay = decay[1]
+            output[1:], _ = scipy.signal.lfilter([1 - step_decay], [1, -step_decay], signal[1:], zi=[step_decay * output[0]])
+            for axis in range(2):
+                noise[1:, axis], _ = scipy.signal.lfilter([1], [1, -step_decay], innovations[1:, axis], zi=[step_decay * noise[0, axis]])
+
+        self._state_time = times[-1]
+        self._state_output = output[-1]
+        self._state_noise = noise[-1]
+
+        x = output + noise[:, 0]
+        y = LOCKIN_QUADRATURE_FRACTION * output + noise[:, 1]
+        return {
+            'X'     :   x,
+            'Y'     :   y,
+            'R'     :   np.hypot(x, y),
+            'T'     :   np.degrees(np.arctan2(y, x)),
+            'Theta' :   np.degrees(np.arctan2(y, x)),
+        }
+
+#===============================================================================================
+#   SimulatedSR860Device
+#===============================================================================================
+class SimulatedSR860Device(SR860.SR860Device):
+    """
+    SR860Device running against a simulated instrument. stage is the (simulated) delay stage
+    whose position sets the synthetic pump-probe signal.
+    """
+
+    def __init__(self, stage=None, capture_mode=SR860.CAPTURE_MODE_BUFFER, connect_latency=LOCKIN_CONNECT_LATENCY_IN_SEC, **instrument_kwargs):
+        super(SimulatedSR860Device, self).__init__(capture_mode=capture_mode)
+        self.stage = stage
+        self.connect_latency = connect_latency
+        self.instrument_kwargs = instrument_kwargs
+
+    def connect(self):
+        time.sleep(self.connect_latency)
+        self.lockin = _SimulatedSR860(stage=self.stage, **self.instrument_kwargs)
+        self._is_connected = True
+
+#===============================================================================================
+#   SimulatedCryostatDevice
+#===============================================================================================
+class SimulatedCryostatDevice(Attodry.CryostatDevice):
+    """
+    Cryostat whose temperature relaxes exponentially to the set point
+    """
+
+    def __init__(self, temperature=CRYOSTAT_INITIAL_TEMPERATURE_IN_K, command_latency=CRYOSTAT_COMMAND_LATENCY_IN_SEC,
+                 thermal_time_constant=CRYOSTAT_THERMAL_TIME_CONSTANT_IN_SEC, noise=CRYOSTAT_NOISE_IN_K):
+        super(SimulatedCryostatDevice, self).__init__()
+        self.command_latency = command_latency
+        self.thermal_time_constant = thermal_time_constant
+        self.noise = noise
+        self._set_point = temperature
+        self._start_temperature = temperature
+        self._set_time = time.perf_counter()
+        self._rng = np.random.default_rng()
+
+    def connect(self):
+        self._is_connected = True
+
+    def close(self):
+        self._is_connected = False
+
+    def _temperature_at(self, t):
+        relax = np.exp(-(t - self._set_time) / self.thermal_time_constant)
+        return self._set_point + (self._start_temperature - self._set_point) * relax
+
+    def get_temperature(self):
+        with self.command('get_temperature'):
+            time.sleep(self.command_latency)
+        return float(self._temperature_at(time.perf_counter()) + self._rng.normal(0, self.noise))
+
+    def set_temperature(self, tempInKelvin):
+        with self.command('set_temperature'):
+            time.sleep(self.command_latency)
+        now = time.perf_counter()
+        self._start_temperature = self._temperature_at(now)
+        self._set_time = now
+        self._set_point = tempInKelvin
@@ -0,0 +1,283 @@
+#===============================================================================================
+#   Name:           Telemetry.py
+#   Description:    Always-on counters, gauges and latency histograms of the device commands
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#   Devices time their commands with AutoLabDevice.command(name), which feeds the histogram
+#   "<device>.<name>" and counts failures in "<device>.<name>.errors". Recording a value is a
+#   dict lookup, a bisect and a few additions under a lock (about a microsecond), so it stays on
+#   for every run. The metrics are read while the run goes on from a json file rewritten every
+#   few seconds (MetricsFileWriter) or from a local HTTP endpoint (MetricsServer):
+#
+#       python PumpProbe_Galium_300K.py --metrics-file metrics.json --metrics-port 8765
+#       curl http://127.0.0.1:8765/
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import os
+import json
+import time
+import bisect
+import threading
+import http.server
+
+import logging
+logger = logging.getLogger(__name__)
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+# histogram bucket upper bounds (sec): 4 per decade from 1 usec to 1000 sec
+BUCKET_BOUNDS_IN_SEC = [10 ** (exponent / 4) for exponent in range(-24, 13)]
+QUANTILES = [0.5, 0.9, 0.99]
+
+FLUSH_INTERVAL_IN_SEC = 5.0
+METRICS_HOST = '127.0.0.1'
+
+#===============================================================================================
+#   Histogram
+#===============================================================================================
+class Histogram(object):
+    """
+    Log bucketed distribution of durations (sec) - count, sum, min, max and approximate quantiles
+    """
+
+    def __init__(self, bounds=BUCKET_BOUNDS_IN_SEC):
+        super(Histogram, self).__init__()
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+        self.last = None
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.buckets[index] += 1
+            self.count += 1
+            self.total += value
+            self.last = value
+            if value < self.min:
+                self.min = value
+            if value > self.max:
+                self.max = value
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding the q quantile (the max for the open last bucket)
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.buckets):
+            cumulative += count
+            if cumulative >= rank and count:
+                return min(self.bounds[index], self.max) if index < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        with self._lock:
+            summary = {
+                'count'     :   self.count,
+                'sum'       :   self.total,
+                'mean'      :   self.total / self.count if self.count else None,
+                'min'       :   self.min if self.count else None,
+                'max'       :   self.max if self.count else None,
+                'last'      :   self.last,
+                'buckets'   :   {'%.3g' % (bound, ): count for bound, count in zip(self.bounds + [float('inf')], self.buckets) if count},
+            }
+        summary.update({'p%d' % (q * 100, ): self.quantile(q) for q in QUANTILES})
+        return summary
+
+#===============================================================================================
+#   Metrics
+#===============================================================================================
+class Metrics(object):
+    """
+    Named counters, gauges (last value) and histograms, created on first use
+    """
+
+    def __init__(self):
+        super(Metrics, self).__init__()
+        self.start_time = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def observe(self, name, value):
+        self.histogram(name).observe(value)
+
+    def timed(self, name):
+        """
+        with metrics.timed(name): ... - records the duration in histogram name and raised exceptions in counter name.errors
+        """
+        return _Timed(self, name)
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            histograms = dict(self.histograms)
+        return {
+            'time'          :   time.time(),
+            'uptime'        :   time.time() - self.start_time,
+            'counters'      :   counters,
+            'gauges'        :   gauges,
+            'histograms'    :   {name: histogram.snapshot() for name, histogram in sorted(histograms.items())},
+        }
+
+    def reset(self):
+        with self._lock:
+            self.start_time = time.time()
+            self.counters = {}
+            self.gauges = {}
+            self.histograms = {}
+
+class _Timed(object):
+    __slots__ = ('metrics', 'name', 'start_time')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.observe(self.name, time.perf_counter() - self.start_time)
+        if exc_type is not None:
+            self.metrics.increment(self.name + '.errors')
+
+#===============================================================================================
+#   MetricsFileWriter
+#===============================================================================================
+class MetricsFileWriter(object):
+    """
+    Rewrites path with a metrics snapshot every interval_in_sec from a background thread
+    """
+
+    def __init__(self, path, metrics=None, interval_in_sec=FLUSH_INTERVAL_IN_SEC):
+        super(MetricsFileWriter, self).__init__()
+        self.path = path
+        self.metrics = metrics or METRICS
+        self.interval_in_sec = interval_in_sec
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='MetricsFileWriter', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.flush()
+
+    def flush(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.metrics.snapshot(), f, indent=4)
+        os.replace(temp_path, self.path)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval_in_sec):
+            try:
+                self.flush()
+            except OSError as err:
+                logger.warning("Failed writing metrics to %s: %s" % (self.path, err))
+
+#===============================================================================================
+#   MetricsServer
+#===============================================================================================
+class MetricsServer(object):
+    """
+    Serves the metrics snapshot as json on http://host:port/ from a background thread
+    """
+
+    def __init__(self, port, host=METRICS_HOST, metrics=None):
+        super(MetricsServer, self).__init__()
+        self.address = (host, port)
+        self.metrics = metrics or METRICS
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        metrics = self.metrics
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(metrics.snapshot(), indent=4).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        self._server = http.server.ThreadingHTTPServer(self.address, Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, name='MetricsServer', daemon=True)
+        self._thread.start()
+        logger.info("Serving metrics on http://%s:%d/" % self._server.server_address[:2])
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+
+#===============================================================================================
+#   Functions
+#===============================================================================================
+METRICS = Metrics()     # the process wide metrics the devices record into
+
+def start_exporters(metrics_file=None, metrics_port=None):
+    """
+    Starts the requested exporters of METRICS. Returns them, to be passed to stop_exporters.
+    """
+    exporters = []
+    if metrics_file:
+        exporters.append(MetricsFileWriter(metrics_file))
+    if metrics_port:
+        exporters.append(MetricsServer(metrics_port))
+    for exporter in exporters:
+        exporter.start()
+    return exporters
+
+def stop_exporters(exporters):
+    for exporter in exporters:
+        exporter.stop()
@@ -0,0 +1,434 @@
+#===============================================================================================
+#   Name:           Trace.py
+#   Description:    Record and replay of the vendor calls the device drivers make
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#   Drivers open their vendor handle (the ximc lib, the qcodes SR860, the attodry worker) with
+#   open_channel. While recording, the handle is wrapped and every call is written to a gzip json
+#   lines trace with its arguments, response, ctypes output buffers and latency. While replaying,
+#   no vendor library is loaded at all: the channel serves the recorded responses, optionally
+#   sleeping the recorded latency times time_scale, so a lab session can be rerun on any machine.
+#
+#       python PumpProbe_Galium_300K.py --record session.trace.gz              (in the lab)
+#       python PumpProbe_Galium_300K.py --replay session.trace.gz --replay-time-scale 0
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import gzip
+import json
+import time
+import types
+import base64
+import ctypes
+import atexit
+import threading
+import functools
+import collections
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import devices.AutoLabDevice as AutoLabDevice
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+TRACE_FORMAT = 'autolab-trace'
+TRACE_VERSION = 1
+
+# event kinds
+KIND_CALL = 'call'          # method call - args, response, output buffers and latency
+KIND_GET = 'get'            # plain attribute read
+KIND_CHANNEL = 'channel'    # attribute holding an object with calls of its own (e.g. the SR860 buffer)
+KIND_MODULE = 'module'      # constants and structure layouts of a vendor module (pyximc)
+
+_CTYPES_TYPES = (ctypes._SimpleCData, ctypes.Structure, ctypes.Union, ctypes.Array, ctypes._Pointer)
+_CARG_TYPE = type(ctypes.byref(ctypes.c_int()))
+_PLAIN_TYPES = (type(None), bool, int, float, str, bytes, list, tuple, dict, np.ndarray, np.generic)
+
+#===============================================================================================
+#   Exceptions
+#===============================================================================================
+class TraceError(AutoLabDevice.AutoLabDeviceError):
+    """
+    The replayed session asked for something the trace does not hold
+    """
+    pass
+
+class RecordedCallError(TraceError):
+    """
+    A replayed call that raised when it was recorded
+    """
+    pass
+
+#===============================================================================================
+#   TraceRecorder
+#===============================================================================================
+class TraceRecorder(object):
+    """
+    Writes the events of the recorded channels to a trace file. Thread safe.
+    """
+
+    def __init__(self, path):
+        super(TraceRecorder, self).__init__()
+        self.path = path
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._start_time = time.perf_counter()
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        self._write({'format': TRACE_FORMAT, 'version': TRACE_VERSION, 'created': time.strftime('%Y-%m-%d %H:%M:%S')})
+
+    def open_channel(self, name, open_handle):
+        return _RecordingProxy(open_handle(), name, self)
+
+    def load_module(self, name, load):
+        module = load()
+        self.record(name, KIND_MODULE, name, response=snapshot_module(module))
+        return module
+
+    def record(self, channel, kind, name, args=(), kwargs=None, response=None, outputs=None, latency=0.0, error=None, start=None):
+        event = {'c': channel, 'k': kind, 'n': name}
+        if args:
+            event['a'] = encode_args(args)
+        if kwargs:
+            event['kw'] = encode_args(kwargs)
+        if response is not None:
+            event['r'] = encode(response)
+        if outputs:
+            event['o'] = outputs
+        if kind == KIND_CALL:
+            event['t'] = round((start or time.perf_counter()) - self._start_time, 6)
+            event['l'] = round(latency, 6)
+        if error is not None:
+            event['e'] = repr(error)
+        self._write(event)
+
+    def call(self, channel, name, func, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = func(*args, **kwargs)
+        except Exception as err:
+            self.record(channel, KIND_CALL, name, args, kwargs, latency=time.perf_counter() - start, error=err, start=start)
+            raise
+        latency = time.perf_counter() - start
+        self.record(channel, KIND_CALL, name, args, kwargs, response, output_buffers(args), latency, start=start)
+        return response
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        logger.info("Recorded %d device calls to %s" % (self.calls, self.path))
+
+    def _write(self, event):
+        line = json.dumps(event, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line)
+            self.calls += event.get('k') == KIND_CALL
+
+class _RecordingProxy(object):
+
+    def __init__(self, handle, channel, recorder):
+        object.__setattr__(self, '_handle', handle)
+        object.__setattr__(self, '_channel', channel)
+        object.__setattr__(self, '_recorder', recorder)
+        object.__setattr__(self, '_channels', {})
+
+    def __getattr__(self, attr):
+        value = getattr(self._handle, attr)
+        if callable(value):
+            return functools.partial(self._recorder.call, self._channel, attr, value)
+        if isinstance(value, _PLAIN_TYPES):
+            self._recorder.record(self._channel, KIND_GET, attr, response=value)
+            return value
+
+        if attr not in self._channels:
+            self._recorder.record(self._channel, KIND_CHANNEL, attr)
+            self._channels[attr] = _RecordingProxy(value, self._channel + '.' + attr, self._recorder)
+        return self._channels[attr]
+
+    def __setattr__(self, attr, value):
+        setattr(self._handle, attr, value)
+
+#===============================================================================================
+#   TraceReplayer
+#===============================================================================================
+class TraceReplayer(object):
+    """
+    Serves the events of a trace file. Calls are matched by channel and name, in recorded order -
+    a call made more often than recorded (e.g. an extra status poll) gets the last recorded response again.
+    time_scale multiplies the recorded latencies (0 - no waiting).
+    """
+
+    def __init__(self, path, time_scale=1.0):
+        super(TraceReplayer, self).__init__()
+        self.path = path
+        self.time_scale = time_scale
+        self.calls = 0
+        self.repeated = 0
+        self.mismatched = 0
+        self._lock = threading.Lock()
+        self._events = collections.defaultdict(collections.deque)
+        self._last = {}
+        self._kinds = {}
+        self._modules = {}
+
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            if header.get('format') != TRACE_FORMAT:
+                raise TraceError("%s is not a device trace." % (path, ))
+            for line in f:
+                event = json.loads(line)
+                if event['k'] == KIND_MODULE:
+                    self._modules[event['n']] = event['r']
+                    continue
+                self._kinds[(event['c'], event['n'])] = event['k']
+                self._events[(event['c'], event['n'])].append(event)
+
+    def open_channel(self, name, open_handle):
+        return _ReplayProxy(name, self)
+
+    def load_module(self, name, load):
+        if name not in self._modules:
+            raise TraceError("Module %s was not recorded in %s." % (name, self.path))
+        return rebuild_module(name, self._modules[name])
+
+    def kind(self, channel, name):
+        return self._kinds.get((channel, name))
+
+    def next_event(self, channel, name):
+        key = (channel, name)
+        with self._lock:
+            if self._events[key]:
+                self._last[key] = self._events[key].popleft()
+            elif key in self._last:
+                self.repeated += 1
+            else:
+                raise TraceError("%s.%s was not recorded in %s." % (channel, name, self.path))
+            return self._last[key]
+
+    def call(self, channel, name, *args, **kwargs):
+        event = self.next_event(channel, name)
+        self.calls += 1
+        if encode_args(args) != event.get('a', []) or encode_args(kwargs) != event.get('kw', {}):
+            self.mismatched += 1
+            logger.debug("Replayed %s.%s with different arguments than recorded." % (channel, name))
+
+        if self.time_scale:
+            time.sleep(event['l'] * self.time_scale)
+        if 'e' in event:
+            raise RecordedCallError("%s.%s raised %s when recorded." % (channel, name, event['e']))
+
+        for index, data in event.get('o', []):
+            write_buffer(args[index], base64.b64decode(data))
+        return decode(event.get('r'))
+
+    def close(self):
+        remaining = sum(len(events) for (_, _), events in self._events.items() if events and events[0]['k'] == KIND_CALL)
+        logger.info("Replayed %d device calls from %s (%d repeated, %d with different arguments, %d not replayed)" %
+                    (self.calls, self.path, self.repeated, self.mismatched, remaining))
+
+class _ReplayProxy(object):
+
+    def __init__(self, channel, replayer):
+        object.__setattr__(self, '_channel', channel)
+        object.__setattr__(self, '_replayer', replayer)
+        object.__setattr__(self, '_channels', {})
+
+    def __getattr__(self, attr):
+        kind = self._replayer.kind(self._channel, attr)
+        if kind == KIND_CALL:
+            return functools.partial(self._replayer.call, self._channel, attr)
+        if kind == KIND_GET:
+            return decode(self._replayer.next_event(self._channel, attr).get('r'))
+        if kind == KIND_CHANNEL:
+            if attr not in self._channels:
+                self._channels[attr] = _ReplayProxy(self._channel + '.' + attr, self._replayer)
+            return self._channels[attr]
+        raise TraceError("%s.%s was not recorded in %s." % (self._channel, attr, self._replayer.path))
+
+    def __setattr__(self, attr, value):
+        pass
+
+#===============================================================================================
+#   Functions
+#===============================================================================================
+_session = None
+
+def start_recording(path):
+    """
+    Records the channels opened from now on to path. Returns the recorder.
+    """
+    global _session
+    stop()
+    _session = TraceRecorder(path)
+    return _session
+
+def start_replay(path, time_scale=1.0):
+    """
+    Serves the channels opened from now on from the trace in path. Returns the replayer.
+    """
+    global _session
+    stop()
+    _session = TraceReplayer(path, time_scale)
+    return _session
+
+def stop():
+    global _session
+    if _session is not None:
+        _session.close()
+        _session = None
+
+def is_replaying():
+    return isinstance(_session, TraceReplayer)
+
+def open_channel(name, open_handle):
+    """
+    The vendor handle of a device. open_handle() opens the real one - recorded while a recording runs,
+    and not called at all while replaying.
+    """
+    if _session is None:
+        return open_handle()
+    return _session.open_channel(name, open_handle)
+
+def load_module(name, load):
+    """
+    A vendor module whose constants and structures the driver uses. While replaying it is rebuilt from the trace.
+    """
+    if _session is None:
+        return load()
+    return _session.load_module(name, load)
+
+def encode(value):
+    """
+    json form of a call argument or response
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, bytes):
+        return {'__type__': 'bytes', 'data': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, np.ndarray):
+        return {'__type__': 'ndarray', 'dtype': value.dtype.str, 'shape': list(value.shape),
+                'data': base64.b64encode(np.ascontiguousarray(value).tobytes()).decode('ascii')}
+    if isinstance(value, (list, tuple)):
+        return [encode(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): encode(item) for key, item in value.items()}
+    buffer = _ctypes_object(value)
+    if buffer is not None:
+        return {'__type__': 'ctypes', 'data': base64.b64encode(_buffer_bytes(buffer)).decode('ascii')}
+    return {'__type__': 'repr', 'repr': repr(value)}
+
+def decode(value):
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+
+    kind = value.get('__type__')
+    if kind in ('bytes', 'ctypes'):
+        return base64.b64decode(value['data'])
+    if kind == 'ndarray':
+        return np.frombuffer(base64.b64decode(value['data']), dtype=value['dtype']).reshape(value['shape']).copy()
+    if kind == 'repr':
+        return value['repr']
+    return {key: decode(item) for key, item in value.items()}
+
+def encode_args(args):
+    # ctypes arguments are output buffers - recorded separately, compared by type only
+    def encode_arg(arg):
+        buffer = _ctypes_object(arg)
+        return {'__type__': 'buffer', 'size': ctypes.sizeof(buffer)} if buffer is not None else encode(arg)
+
+    if isinstance(args, dict):
+        return {key: encode_arg(arg) for key, arg in args.items()}
+    return [encode_arg(arg) for arg in args]
+
+def output_buffers(args):
+    """
+    [index, base64 content] of the ctypes buffers among args, after the call filled them
+    """
+    outputs = []
+    for index, arg in enumerate(args):
+        buffer = _ctypes_object(arg)
+        if buffer is not None:
+            outputs.append([index, base64.b64encode(_buffer_bytes(buffer)).decode('ascii')])
+    return outputs
+
+def write_buffer(arg, data):
+    buffer = _ctypes_object(arg)
+    if buffer is not None:
+        ctypes.memmove(ctypes.addressof(buffer), data, min(len(data), ctypes.sizeof(buffer)))
+
+def snapshot_module(module):
+    """
+    The integer constant classes (e.g. Result, MoveState) and ctypes structure layouts of a vendor module
+    """
+    constants = {}
+    structures = {}
+    for name, value in vars(module).items():
+        # only the module's own classes, not the ctypes names it imported
+        if name.startswith('_') or not isinstance(value, type) or value.__module__ != module.__name__:
+            continue
+        if issubclass(value, ctypes.Structure):
+            fields = [[field, _ctype_name(field_type), getattr(field_type, '_length_', 0)] for field, field_type in value._fields_]
+            structures[name] = {'fields': fields, 'pack': getattr(value, '_pack_', 0), 'size': ctypes.sizeof(value)}
+        elif not issubclass(value, _CTYPES_TYPES):
+            values = {key: item for key, item in vars(value).items() if not key.startswith('_') and isinstance(item, int)}
+            if values:
+                constants[name] = values
+    return {'constants': constants, 'structures': structures}
+
+def rebuild_module(name, snapshot):
+    """
+    A stand-in for a module recorded by snapshot_module: the same constants and structure layouts
+    """
+    module = types.SimpleNamespace()
+    for class_name, values in snapshot['constants'].items():
+        setattr(module, class_name, type(class_name, (object, ), dict(values)))
+
+    def structure(struct_name):
+        if not hasattr(module, struct_name):
+            layout = snapshot['structures'][struct_name]
+            fields = []
+            for field, type_name, length in layout['fields']:
+                field_type = structure(type_name) if type_name in snapshot['structures'] else getattr(ctypes, type_name)
+                fields.append((field, field_type * length if length else field_type))
+            attributes = {'_fields_': fields}
+            if layout['pack']:
+                attributes['_pack_'] = layout['pack']
+            setattr(module, struct_name, type(struct_name, (ctypes.Structure, ), attributes))
+            if ctypes.sizeof(getattr(module, struct_name)) != layout['size']:
+                logger.warning("Rebuilt %s.%s is %d bytes, recorded %d." % (name, struct_name, ctypes.sizeof(getattr(module, struct_name)), layout['size']))
+        return getattr(module, struct_name)
+
+    for struct_name in snapshot['structures']:
+        structure(struct_name)
+    return module
+
+def _ctype_name(field_type):
+    if issubclass(field_type, ctypes.Array):
+        field_type = field_type._type_
+    return field_type.__name__
+
+def _ctypes_object(value):
+    if isinstance(value, _CARG_TYPE):
+        return value._obj
+    if isinstance(value, _CTYPES_TYPES):
+        return value
+    return None
+
+def _buffer_bytes(buffer):
+    return ctypes.string_at(ctypes.addressof(buffer), ctypes.sizeof(buffer))
+
+atexit.register(stop)
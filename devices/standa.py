@@ -13,6 +13,7 @@ import sys
 import platform
 import tempfile
 import re
+import importlib
 import numpy as np
 
 if sys.version_info >= (3, 0):
@@ -25,11 +26,17 @@ logger = logging.getLogger(__name__)
 #   Solution Imports
 #===============================================================================================
 import devices.AutoLabDevice as AutoLabDevice
+import devices.Trace as Trace
 
 #===============================================================================================
 #   Constants
 #===============================================================================================
-
+STEPS_PER_MM = 40000            # taken from the initial value in the STANDA software
+MICROSTEPS_PER_STEP = 256       # MICROSTEP_MODE_FRAC_256
+MOVE_POLL_INTERVAL_IN_SEC = 0.01
+SETTLE_TOLERANCE_IN_MM = 0.001  # 40 steps, ~7 fs of delay
+SETTLE_STABLE_POLLS = 3         # consecutive stopped polls inside the tolerance window
+MOVE_TIMEOUT_IN_SEC = 60.0
 
 #===============================================================================================
 #   Dependences
@@ -40,104 +47,257 @@ cur_dir = os.path.abspath(os.path.dirname(__file__))  # Specifies the current di
 ximc_dir = r"C:\Standa SDK\ximc-2.13.5\ximc"  # Formation of the directory name with all dependencies. The dependencies for the examples are located in the ximc directory.
 ximc_package_dir = os.path.join(ximc_dir, "crossplatform", "wrappers",
                                 "python")  # Formation of the directory name with python dependencies.
-sys.path.append(ximc_package_dir)  # add pyximc.py wrapper to python path
-
-# Depending on your version of Windows, add the path to the required DLLs to the environment variable
-# bindy.dll
-# libximc.dll
-# xiwrapper.dll
-if platform.system() == "Windows":
-    # Determining the directory with dependencies for windows depending on the bit depth.
-    arch_dir = "win64" if "64" in platform.architecture()[0] else "win32"  #
-    libdir = os.path.join(ximc_dir, arch_dir)
-    if sys.version_info >= (3, 8):
-        os.add_dll_directory(libdir)
-    else:
-        os.environ["Path"] = libdir + ";" + os.environ["Path"]  # add dll path into an environment variable
-
-try:
-    from pyximc import *
-except ImportError as err:
-    logger.error(
-        "Can't import pyximc module. The most probable reason is that you changed the relative location of the test_Python.py and pyximc.py files. See developers' documentation for details.")
-    exit()
-except OSError as err:
-    # logger.error(err.errno, err.filename, err.strerror, err.winerror) # Allows you to display detailed information by mistake.
+
+# pyximc module and the loaded library - set by load_library() on the first connect
+ximc = None
+lib = None
+
+def load_library():
+    """
+    Imports pyximc (which loads libximc). Called on connect so importing this module stays cheap.
+    Raises AutoLabDevice.DriverLoadError if the library cannot be loaded.
+    """
+    global ximc, lib
+    if lib is not None:
+        return
+
+    # a replayed session serves the recorded library calls, pyximc is not needed
+    if Trace.is_replaying():
+        ximc = Trace.load_module('ximc', None)
+        lib = Trace.open_channel('ximc', None)
+        log_library_version()
+        return
+
+    if ximc_package_dir not in sys.path:
+        sys.path.append(ximc_package_dir)  # add pyximc.py wrapper to python path
+
+    # Depending on your version of Windows, add the path to the required DLLs to the environment variable
+    # bindy.dll
+    # libximc.dll
+    # xiwrapper.dll
     if platform.system() == "Windows":
-        if err.winerror == 193:  # The bit depth of one of the libraries bindy.dll, libximc.dll, xiwrapper.dll does not correspond to the operating system bit.
+        # Determining the directory with dependencies for windows depending on the bit depth.
+        arch_dir = "win64" if "64" in platform.architecture()[0] else "win32"  #
+        libdir = os.path.join(ximc_dir, arch_dir)
+        if sys.version_info >= (3, 8):
+            os.add_dll_directory(libdir)
+        else:
+            os.environ["Path"] = libdir + ";" + os.environ["Path"]  # add dll path into an environment variable
+
+    try:
+        pyximc = Trace.load_module('ximc', lambda: importlib.import_module('pyximc'))
+    except ImportError as err:
+        raise AutoLabDevice.DriverLoadError(
+            "Can't import pyximc module. The most probable reason is that you changed the relative location of the test_Python.py and pyximc.py files. See developers' documentation for details.") from err
+    except OSError as err:
+        # logger.error(err.errno, err.filename, err.strerror, err.winerror) # Allows you to display detailed information by mistake.
+        if platform.system() == "Windows":
+            if err.winerror == 193:  # The bit depth of one of the libraries bindy.dll, libximc.dll, xiwrapper.dll does not correspond to the operating system bit.
+                logger.error(
+                    "Err: The bit depth of one of the libraries bindy.dll, libximc.dll, xiwrapper.dll does not correspond to the operating system bit.")
+                # logger.error(err)
+            elif err.winerror == 126:  # One of the library bindy.dll, libximc.dll, xiwrapper.dll files is missing.
+                logger.error("Err: One of the library bindy.dll, libximc.dll, xiwrapper.dll is missing.")
+                logger.error(
+                    "It is also possible that one of the system libraries is missing. This problem is solved by installing the vcredist package from the ximc\\winXX folder.")
+                # logger.error(err)
+            else:  # Other errors the value of which can be viewed in the code.
+                logger.error(err)
             logger.error(
-                "Err: The bit depth of one of the libraries bindy.dll, libximc.dll, xiwrapper.dll does not correspond to the operating system bit.")
-            # logger.error(err)
-        elif err.winerror == 126:  # One of the library bindy.dll, libximc.dll, xiwrapper.dll files is missing.
-            logger.error("Err: One of the library bindy.dll, libximc.dll, xiwrapper.dll is missing.")
-            logger.error(
-                "It is also possible that one of the system libraries is missing. This problem is solved by installing the vcredist package from the ximc\\winXX folder.")
-            # logger.error(err)
-        else:  # Other errors the value of which can be viewed in the code.
+                "Warning: If you are using the example as the basis for your module, make sure that the dependencies installed in the dependencies section of the example match your directory structure.")
+            logger.error("For correct work with the library you need: pyximc.py, bindy.dll, libximc.dll, xiwrapper.dll")
+        else:
             logger.error(err)
-        logger.error(
-            "Warning: If you are using the example as the basis for your module, make sure that the dependencies installed in the dependencies section of the example match your directory structure.")
-        logger.error("For correct work with the library you need: pyximc.py, bindy.dll, libximc.dll, xiwrapper.dll")
-    else:
-        logger.error(err)
-        logger.error(
-            "Can't load libximc library. Please add all shared libraries to the appropriate places. It is decribed in detail in developers' documentation. On Linux make sure you installed libximc-dev package.\nmake sure that the architecture of the system and the interpreter is the same")
-    exit()
-
-# variable 'lib' points to a loaded library
-# note that ximc uses stdcall on win
-logger.info("Library loaded")
-
-sbuf = create_string_buffer(64)
-lib.ximc_version(sbuf)
-logger.info("Library version: " + sbuf.raw.decode().rstrip("\0"))
+            logger.error(
+                "Can't load libximc library. Please add all shared libraries to the appropriate places. It is decribed in detail in developers' documentation. On Linux make sure you installed libximc-dev package.\nmake sure that the architecture of the system and the interpreter is the same")
+        raise AutoLabDevice.DriverLoadError("Can't load libximc library: %s" % (err, )) from err
+
+    # variable 'lib' points to a loaded library
+    # note that ximc uses stdcall on win
+    ximc = pyximc
+    lib = Trace.open_channel('ximc', lambda: pyximc.lib)
+    logger.info("Library loaded")
+    log_library_version()
+
+def log_library_version():
+    sbuf = create_string_buffer(64)
+    lib.ximc_version(sbuf)
+    logger.info("Library version: " + sbuf.raw.decode().rstrip("\0"))
 
 #===============================================================================================
 #   StandaDevice
 #===============================================================================================
 class StandaDevice(AutoLabDevice.AutoLabDevice):
 
+    METRICS_NAME = 'standa'
+
     def __init__(self, test_device=False):
         super(StandaDevice, self).__init__()
         self._flag_virtual = False
         self.device_id = AutoLabDevice.INVALID_DEVICE_ID
         self.position = 0
         self.test_device = test_device
+        self.last_move_time = 0
+        self.last_settle_time = 0
 
+    @property
     def is_connected(self):
         return self._is_connected and not self._flag_virtual
 
-    def move_stage(self, position, calibration=40000, wait=1000):
+    def move_stage(self, position, calibration=STEPS_PER_MM, tolerance=SETTLE_TOLERANCE_IN_MM, timeout=MOVE_TIMEOUT_IN_SEC,
+                   poll_interval=MOVE_POLL_INTERVAL_IN_SEC):
         """
-        Moves the delay stage to position given in mm.
-        The calibration of 40000 steps per mm is taken from the initial value in the STANDA software
-        and needs to be confirmed. After moving it will wait for wait (ms)
+        Moves the delay stage to position given in mm and returns once it stands still within
+        tolerance (mm) of the target. The calibration of 40000 steps per mm is taken from the initial
+        value in the STANDA software and needs to be confirmed.
+        Sets last_move_time and last_settle_time (sec). Raises AutoLabDevice.StageMoveError on failure.
         """
         if not self.is_connected:
             logger.info("Standa device is not connected. Cannot move stage.")
             return
 
         logger.info(f"Moving stage to {position:.2f}")
-        number = np.round(position*calibration)
-        number = int(number)
+        with self.command('move'):
+            start_time = time.perf_counter()
+            result = self.start_move(position, calibration)
+            if result != ximc.Result.Ok:
+                raise AutoLabDevice.StageMoveError("Standa move to %.4f mm failed. Result: %r" % (position, result))
 
-        result = lib.command_move(self.device_id, number, 0)
-        result = lib.command_wait_for_stop(self.device_id, wait)
+            arrival_time, settled_time, self.position = wait_for_position(lambda: self.get_move_status(calibration), position, tolerance,
+                                                                          timeout=timeout, poll_interval=poll_interval)
+        self.last_move_time = arrival_time - start_time
+        self.last_settle_time = settled_time - arrival_time
+        self.observe('settle', self.last_settle_time)
+
+    async def move_stage_async(self, position, **kwargs):
+        return await self.run_async(self.move_stage, position, **kwargs)
+
+    async def get_position_async(self, calibration=STEPS_PER_MM):
+        return await self.run_async(self.get_position, calibration)
+
+    def start_move(self, position, calibration=STEPS_PER_MM):
+        """
+        Starts moving the delay stage to position given in mm without waiting for it to stop
+        """
+        if not self.is_connected:
+            logger.info("Standa device is not connected. Cannot move stage.")
+            return None
 
-        self.position = position
+        number = int(np.round(position*calibration))
+        with self.command('start_move'):
+            return lib.command_move(self.device_id, number, 0)
+
+    def get_position(self, calibration=STEPS_PER_MM):
+        """
+        Returns the current stage position in mm (None on failure)
+        """
+        x_position = ximc.get_position_t()
+        with self.command('position'):
+            result = lib.get_position(self.device_id, byref(x_position))
+        if result != ximc.Result.Ok:
+            logger.error("Failed reading standa position. Result: " + repr(result))
+            return None
+
+        return (x_position.Position + x_position.uPosition / MICROSTEPS_PER_STEP) / calibration
+
+    def is_moving(self):
+        x_status = ximc.status_t()
+        with self.command('status'):
+            result = lib.get_status(self.device_id, byref(x_status))
+        if result != ximc.Result.Ok:
+            logger.error("Failed reading standa status. Result: " + repr(result))
+            return False
+
+        return bool(x_status.MoveSts & ximc.MoveState.MOVE_STATE_MOVING)
+
+    def get_move_status(self, calibration=STEPS_PER_MM):
+        """
+        Reads the position and state flags in a single get_status call.
+        Returns (position in mm, moving, alarm) or None on failure.
+        """
+        x_status = ximc.status_t()
+        with self.command('status'):
+            result = lib.get_status(self.device_id, byref(x_status))
+        if result != ximc.Result.Ok:
+            logger.error("Failed reading standa status. Result: " + repr(result))
+            self.count('status.errors')
+            return None
+
+        position = (x_status.CurPosition + x_status.uCurPosition / MICROSTEPS_PER_STEP) / calibration
+        moving = bool(x_status.MoveSts & ximc.MoveState.MOVE_STATE_MOVING)
+        alarm = bool(x_status.Flags & ximc.StateFlags.STATE_ALARM)
+        return position, moving, alarm
+
+    def get_speed(self, calibration=STEPS_PER_MM):
+        """
+        Returns the stage cruise speed in mm/sec (None on failure)
+        """
+        mvst = ximc.move_settings_t()
+        with self.command('speed'):
+            result = lib.get_move_settings(self.device_id, byref(mvst))
+        if result != ximc.Result.Ok:
+            logger.error("Failed reading standa move settings. Result: " + repr(result))
+            return None
+
+        return (mvst.Speed + mvst.uSpeed / MICROSTEPS_PER_STEP) / calibration
+
+    def set_speed(self, speed, calibration=STEPS_PER_MM):
+        """
+        Sets the stage cruise speed given in mm/sec
+        """
+        mvst = ximc.move_settings_t()
+        with self.command('set_speed'):     # read-modify-write of the move settings as one command
+            result = lib.get_move_settings(self.device_id, byref(mvst))
+            if result != ximc.Result.Ok:
+                logger.error("Failed reading standa move settings. Result: " + repr(result))
+                return False
+
+            steps_per_sec = speed * calibration
+            mvst.Speed = int(steps_per_sec)
+            mvst.uSpeed = int(np.round((steps_per_sec - int(steps_per_sec)) * MICROSTEPS_PER_STEP))
+            result = lib.set_move_settings(self.device_id, byref(mvst))
+        if result != ximc.Result.Ok:
+            logger.error("Failed writing standa move settings. Result: " + repr(result))
+            return False
+
+        return True
+
+    def track_move(self, position, poll_interval=MOVE_POLL_INTERVAL_IN_SEC, calibration=STEPS_PER_MM):
+        """
+        Moves the stage to position (mm) and samples its position until it stops.
+        Returns the timestamps (time.perf_counter) and positions (mm) as numpy arrays.
+        """
+        times = []
+        positions = []
+        if self.start_move(position, calibration) is None:
+            return np.array(times), np.array(positions)
+
+        while True:
+            moving = self.is_moving()
+            current = self.get_position(calibration)
+            if current is not None:
+                times.append(time.perf_counter())
+                positions.append(current)
+            if not moving:
+                break
+            time.sleep(poll_interval)
+
+        self.position = positions[-1] if positions else position
+        return np.array(times), np.array(positions)
 
     def connect(self):
+        load_library()
 
         # Set bindy (network) keyfile. Must be called before any call to "enumerate_devices" or "open_device" if you
         # wish to use network-attached controllers. Accepts both absolute and relative paths, relative paths are resolved
         # relative to the process working directory. If you do not need network devices then "set_bindy_key" is optional.
         # In Python make sure to pass byte-array object to this function (b"string literal").
         result = lib.set_bindy_key(os.path.join(ximc_dir, "win32", "keyfile.sqlite").encode("utf-8"))
-        if result != Result.Ok:
+        if result != ximc.Result.Ok:
             lib.set_bindy_key("keyfile.sqlite".encode("utf-8")) # Search for the key file in the current directory.
 
         # This is device search and enumeration with probing. It gives more information about devices.
-        probe_flags = EnumerateFlags.ENUMERATE_PROBE + EnumerateFlags.ENUMERATE_NETWORK
+        probe_flags = ximc.EnumerateFlags.ENUMERATE_PROBE + ximc.EnumerateFlags.ENUMERATE_NETWORK
         enum_hints = b"addr="
         # enum_hints = b"addr=" # Use this hint string for broadcast enumerate
         devenum = lib.enumerate_devices(probe_flags, enum_hints)
@@ -147,11 +307,11 @@ class StandaDevice(AutoLabDevice.AutoLabDevice):
         dev_count = lib.get_device_count(devenum)
         logger.debug("standa device count: " + repr(dev_count))
 
-        controller_name = controller_name_t()
+        controller_name = ximc.controller_name_t()
         for dev_ind in range(0, dev_count):
             enum_name = lib.get_device_name(devenum, dev_ind)
             result = lib.get_enumerate_device_controller_name(devenum, dev_ind, byref(controller_name))
-            if result == Result.Ok:
+            if result == ximc.Result.Ok:
                 logger.debug("Enumerated standa device #{} name (port name): ".format(dev_ind) + repr(enum_name) + ". Friendly name: " + repr(controller_name.ControllerName) + ".")
 
         open_name = None
@@ -193,7 +353,8 @@ class StandaDevice(AutoLabDevice.AutoLabDevice):
 
         logger.info("\nClosing standa device")
         # The device_t device parameter in this function is a C pointer, unlike most library functions that use this parameter
-        lib.close_device(byref(cast(self.device_id, POINTER(c_int))))
+        with self.command('close'):
+            lib.close_device(byref(cast(self.device_id, POINTER(c_int))))
         self._is_connected = False
 
 
@@ -202,10 +363,10 @@ class StandaDevice(AutoLabDevice.AutoLabDevice):
     #===============================================================================================
     def _test_info(self):
         logger.debug("\nGet device info")
-        x_device_information = device_information_t()
+        x_device_information = ximc.device_information_t()
         result = lib.get_device_information(self.device_id, byref(x_device_information))
         logger.debug("Result: " + repr(result))
-        if result == Result.Ok:
+        if result == ximc.Result.Ok:
             logger.debug("Device information:")
             logger.debug(" Manufacturer: " +
                     repr(string_at(x_device_information.Manufacturer).decode()))
@@ -219,10 +380,10 @@ class StandaDevice(AutoLabDevice.AutoLabDevice):
 
     def _test_status(self):
         logger.debug("\nGet status")
-        x_status = status_t()
+        x_status = ximc.status_t()
         result = lib.get_status(self.device_id, byref(x_status))
         logger.debug("Result: " + repr(result))
-        if result == Result.Ok:
+        if result == ximc.Result.Ok:
             logger.debug("Status.Ipwr: " + repr(x_status.Ipwr))
             logger.debug("Status.Upwr: " + repr(x_status.Upwr))
             logger.debug("Status.Iusb: " + repr(x_status.Iusb))
@@ -231,14 +392,14 @@ class StandaDevice(AutoLabDevice.AutoLabDevice):
     def _test_set_microstep_mode_256(self):
         logger.debug("\nSet microstep mode to 256")
         # Create engine settings structure
-        eng = engine_settings_t()
+        eng = ximc.engine_settings_t()
         # Get current engine settings from controller
         result = lib.get_engine_settings(self.device_id, byref(eng))
         # Print command return status. It will be 0 if all is OK
         logger.debug("Read command result: " + repr(result))
         # Change MicrostepMode parameter to MICROSTEP_MODE_FRAC_256
         # (use MICROSTEP_MODE_FRAC_128, MICROSTEP_MODE_FRAC_64 ... for other microstep modes)
-        eng.MicrostepMode = MicrostepMode.MICROSTEP_MODE_FRAC_256
+        eng.MicrostepMode = ximc.MicrostepMode.MICROSTEP_MODE_FRAC_256
         # Write new engine settings to controller
         result = lib.set_engine_settings(self.device_id, byref(eng))
         # Print command return status. It will be 0 if all is OK
@@ -247,7 +408,7 @@ class StandaDevice(AutoLabDevice.AutoLabDevice):
     def _test_set_speed(self, speed=1000):
         logger.debug("\nSet speed")
         # Create move settings structure
-        mvst = move_settings_t()
+        mvst = ximc.move_settings_t()
         # Get current move settings from controller
         result = lib.get_move_settings(self.device_id, byref(mvst))
         # Print command return status. It will be 0 if all is OK
@@ -270,4 +431,46 @@ class StandaDevice(AutoLabDevice.AutoLabDevice):
 
 #===============================================================================================
 #   Functions
-#==============================================================================================
\ No newline at end of file
+#==============================================================================================
+def wait_for_position(get_move_status, position, tolerance=SETTLE_TOLERANCE_IN_MM, stable_polls=SETTLE_STABLE_POLLS,
+                      timeout=MOVE_TIMEOUT_IN_SEC, poll_interval=MOVE_POLL_INTERVAL_IN_SEC):
+    """
+    Polls get_move_status() -> (position mm, moving, alarm) until the stage reports stopped within
+    tolerance of position for stable_polls polls in a row.
+    Returns the time.perf_counter the stage entered the tolerance window, the time it was declared
+    settled and the settled position. Raises AutoLabDevice.StageMoveError on a failed status read,
+    an alarm, the stage stopping outside the window or timeout.
+    """
+    start_time = time.perf_counter()
+    arrival_time = None
+    stable_count = 0
+    stopped_outside = 0
+    while True:
+        status = get_move_status()
+        now = time.perf_counter()
+        if status is None:
+            raise AutoLabDevice.StageMoveError("Failed reading stage status while moving to %.4f mm." % (position, ))
+
+        current, moving, alarm = status
+        if alarm:
+            raise AutoLabDevice.StageMoveError("Stage alarm while moving to %.4f mm (at %.4f mm)." % (position, current))
+
+        if abs(current - position) <= tolerance:
+            if arrival_time is None:
+                arrival_time = now
+            stable_count = 0 if moving else stable_count + 1
+            stopped_outside = 0
+            if stable_count >= stable_polls:
+                return arrival_time, now, current
+        else:
+            arrival_time = None
+            stable_count = 0
+            stopped_outside = 0 if moving else stopped_outside + 1
+            if stopped_outside >= stable_polls:
+                raise AutoLabDevice.StageMoveError("Stage stopped at %.4f mm, outside the %.4f mm window around %.4f mm." %
+                                                   (current, tolerance, position))
+
+        if now - start_time > timeout:
+            raise AutoLabDevice.StageMoveError("Stage did not settle at %.4f mm within %.1f sec (at %.4f mm)." % (position, timeout, current))
+
+        time.sleep(poll_interval)
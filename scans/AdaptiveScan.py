@@ -0,0 +1,105 @@
+#===============================================================================================
+#   Name:           AdaptiveScan.py
+#   Description:    Adaptive delay grid refinement - spend the points where the signal changes
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+COARSE_POINTS = 20
+RESOLUTION_IN_MM = 0.01             # intervals narrower than this are not split
+NOISE_FACTOR = 2.0                  # changes below NOISE_FACTOR standard errors are treated as noise
+MOVE_OVERHEAD_IN_SEC = 0.5          # command + settle time of a stage move
+STAGE_SPEED_IN_MM_PER_SEC = 5.0
+
+#===============================================================================================
+#   Functions
+#===============================================================================================
+def interval_scores(positions, values, errors, noise_factor=NOISE_FACTOR):
+    """
+    Refinement score of every interval between neighbouring (sorted) positions.
+    The score is the change across the interval plus the linear interpolation error
+    estimated from the second derivative at its ends, less the measurement noise.
+    """
+    positions = np.asarray(positions, dtype=float)
+    values = np.asarray(values, dtype=float)
+    errors = np.asarray(errors, dtype=float)
+
+    widths = np.diff(positions)
+    slopes = np.diff(values) / widths
+
+    # second derivative at the inner points, zero at the ends
+    second = np.zeros(len(positions))
+    if len(positions) > 2:
+        second[1:-1] = 2 * np.diff(slopes) / (positions[2:] - positions[:-2])
+    curvature = np.maximum(np.abs(second[:-1]), np.abs(second[1:]))
+
+    change = np.abs(np.diff(values)) + curvature * widths ** 2 / 8
+    noise = noise_factor * np.hypot(errors[:-1], errors[1:])
+    return np.maximum(change - noise, 0)
+
+def next_position(positions, values, errors, current_position, resolution=RESOLUTION_IN_MM, capture_time=1.0,
+                  stage_speed=STAGE_SPEED_IN_MM_PER_SEC, move_overhead=MOVE_OVERHEAD_IN_SEC, noise_factor=NOISE_FACTOR):
+    """
+    Returns the midpoint of the interval with the best score per second of measurement
+    (travel from current_position + capture), or None if no interval is worth splitting.
+    """
+    order = np.argsort(positions)
+    positions = np.asarray(positions, dtype=float)[order]
+    values = np.asarray(values, dtype=float)[order]
+    errors = np.asarray(errors, dtype=float)[order]
+
+    scores = interval_scores(positions, values, errors, noise_factor)
+    scores[np.diff(positions) < 2 * resolution] = 0
+    if not np.any(scores > 0):
+        return None
+
+    midpoints = (positions[1:] + positions[:-1]) / 2
+    cost = capture_time + move_overhead + np.abs(midpoints - current_position) / stage_speed
+    return midpoints[np.argmax(scores / cost)]
+
+def adaptive_scan(measure, start, stop, coarse_points=COARSE_POINTS, max_points=100, resolution=RESOLUTION_IN_MM,
+                  capture_time=1.0, stage_speed=STAGE_SPEED_IN_MM_PER_SEC, move_overhead=MOVE_OVERHEAD_IN_SEC,
+                  noise_factor=NOISE_FACTOR):
+    """
+    Measures a coarse grid from start to stop (mm) and then keeps inserting positions where the
+    signal changes the most per unit of measurement time, until max_points were measured or
+    no interval wider than 2 * resolution has a change above the noise.
+    measure(index, position) returns (mean, standard error) of the point.
+    Returns positions, values and errors in visit order.
+    """
+    positions = list(np.linspace(start, stop, coarse_points))
+    values = []
+    errors = []
+    for i, loc in enumerate(positions):
+        value, error = measure(i, loc)
+        values.append(value)
+        errors.append(error)
+
+    current_position = positions[-1]
+    while len(positions) < max_points:
+        loc = next_position(positions, values, errors, current_position, resolution, capture_time, stage_speed, move_overhead, noise_factor)
+        if loc is None:
+            logger.info("Adaptive scan converged after %d points." % (len(positions), ))
+            break
+
+        value, error = measure(len(positions), loc)
+        positions.append(loc)
+        values.append(value)
+        errors.append(error)
+        current_position = loc
+
+    return np.array(positions), np.array(values), np.array(errors)
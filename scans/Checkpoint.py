@@ -0,0 +1,118 @@
+#===============================================================================================
+#   Name:           Checkpoint.py
+#   Description:    Scan progress file, lets an interrupted scan continue where it stopped
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import os
+import json
+import time
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+CHECKPOINT_SUFFIX = '.checkpoint.json'
+
+#===============================================================================================
+#   ScanCheckpoint
+#===============================================================================================
+class ScanCheckpoint(object):
+    """
+    Progress of a scan, kept next to its data set (base_path + CHECKPOINT_SUFFIX): the
+    configuration the scan was started with, the completed point indices in completion order
+    and per point values (e.g. the adaptive scan's measured positions and means).
+    A point must be flushed to the data files before it is marked done, so the first
+    len(completed) data rows are always exactly the completed points.
+    The file is rewritten atomically after every point.
+    """
+
+    def __init__(self, base_path, config, completed=None, points=None, finished=False):
+        super(ScanCheckpoint, self).__init__()
+        self.base_path = base_path
+        self.config = _normalized(config)
+        self.completed = list(completed or [])
+        self.points = dict(points or {})
+        self.finished = finished
+        self._done = set(self.completed)
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return self.base_path + CHECKPOINT_SUFFIX
+
+    def is_done(self, index):
+        return index in self._done
+
+    def point(self, index):
+        """
+        Values stored with mark_done for index (None if none)
+        """
+        return self.points.get(str(index))
+
+    def mark_done(self, index, values=None):
+        with self._lock:
+            if index not in self._done:
+                self.completed.append(index)
+                self._done.add(index)
+            if values is not None:
+                self.points[str(index)] = values
+            self._save()
+
+    def finish(self):
+        with self._lock:
+            self.finished = True
+            self._save()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def mismatches(self, config):
+        """
+        Names of the configuration entries that differ from the ones the scan was started with
+        """
+        config = _normalized(config)
+        return sorted(key for key in set(config) | set(self.config) if config.get(key) != self.config.get(key))
+
+    def _save(self):
+        checkpoint = {
+            'updated'   :   time.strftime('%Y-%m-%d %H:%M:%S'),
+            'finished'  :   self.finished,
+            'config'    :   self.config,
+            'completed' :   self.completed,
+            'points'    :   self.points,
+        }
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(checkpoint, f, default=float)
+        os.replace(temp_path, self.path)
+
+#===============================================================================================
+#   Functions
+#===============================================================================================
+def _normalized(config):
+    # compare the configuration the way it is stored (json types, numpy values as floats)
+    return json.loads(json.dumps(config, default=float))
+
+def load_checkpoint(base_path):
+    """
+    Returns the ScanCheckpoint of the data set at base_path, or None if it has none
+    """
+    path = base_path + CHECKPOINT_SUFFIX
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'r') as f:
+        checkpoint = json.load(f)
+    return ScanCheckpoint(base_path, checkpoint['config'], checkpoint['completed'], checkpoint['points'], checkpoint['finished'])
@@ -0,0 +1,183 @@
+#===============================================================================================
+#   Name:           Experiment.py
+#   Description:    Declarative experiment definitions and the order a queue of them runs in
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#   A queue file is a json list of experiments. Missing settings take the experiment script's defaults:
+#
+#       [
+#           {"name": "Ga fine 300K", "locations_in_mm": {"start": 1, "stop": -1, "num": 200}, "sweeps": 4},
+#           {"name": "Ga T series", "temperatures": [10, 50, 100], "samples_per_loc": 600},
+#           {"name": "Ga fly", "scan_mode": "fly", "stage_speed": 0.05},
+#           {"name": "Ga 40 independent", "independent_samples": 40}
+#       ]
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import copy
+import json
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+# device roles -> registry names, see devices.Registry
+DEFAULT_DEVICES = {
+    'lockin'    :   'sr860',
+    'stage'     :   'standa',
+    'cryostat'  :   'attodry',
+}
+SIMULATED_DEVICES = {role: 'simulated_' + name for role, name in DEFAULT_DEVICES.items()}
+STAGE_COUPLED_DEVICES = {'simulated_sr860'}     # created with stage=<the stage device> (the signal follows the delay)
+
+#===============================================================================================
+#   ExperimentDefinition
+#===============================================================================================
+class ExperimentDefinition(object):
+    """
+    Everything a delay scan run needs besides the devices themselves: the stage grid, the lock-in
+    sampling, the scan mode and its options and the cryostat temperatures (None - the cryostat
+    is not used). devices maps the lockin / stage / cryostat roles to registry names.
+    sample_temperature (K) is what the catalog records for a run without temperatures.
+    """
+
+    FIELDS = ['name', 'experiment', 'scan_mode', 'locations_in_mm', 'samples_per_loc', 'capture_duration_in_sec', 'capture_mode',
+              'target_error', 'sweeps', 'noise_target', 'outlier_factor', 'temperatures', 'max_points', 'resolution', 'stage_speed',
+              'devices', 'independent_samples', 'sample_temperature']
+
+    def __init__(self, name=None, experiment=None, scan_mode=None, locations_in_mm=None, samples_per_loc=None, capture_duration_in_sec=None,
+                 capture_mode=None, target_error=None, sweeps=1, noise_target=None, outlier_factor=None, temperatures=None, max_points=None,
+                 resolution=None, stage_speed=None, devices=None, independent_samples=None, sample_temperature=None):
+        super(ExperimentDefinition, self).__init__()
+        self.name = name or experiment
+        self.experiment = experiment
+        self.scan_mode = scan_mode
+        self.locations_in_mm = parse_locations(locations_in_mm) if locations_in_mm is not None else None
+        self.samples_per_loc = samples_per_loc
+        self.capture_duration_in_sec = capture_duration_in_sec
+        self.capture_mode = capture_mode
+        self.target_error = target_error
+        self.sweeps = sweeps
+        self.noise_target = noise_target
+        self.outlier_factor = outlier_factor
+        self.temperatures = list(temperatures) if temperatures else None
+        self.max_points = max_points
+        self.resolution = resolution
+        self.stage_speed = stage_speed
+        self.devices = dict(devices or {})
+        self.independent_samples = independent_samples      # set - the lock-in picks the rate and samples_per_loc itself
+        self.sample_temperature = sample_temperature        # None - read from the cryostat, if one is connected
+
+    @classmethod
+    def from_dict(cls, entry, defaults=None):
+        """
+        Builds a definition from a queue entry. Settings missing from entry (or None) are taken from defaults.
+        """
+        unknown = sorted(set(entry) - set(cls.FIELDS))
+        if unknown:
+            raise ValueError("Unknown experiment settings %s in %r" % (", ".join(unknown), entry.get('name')))
+
+        settings = dict(defaults or {})
+        settings.update({key: value for key, value in entry.items() if value is not None})
+        settings['devices'] = dict((defaults or {}).get('devices') or {}, **(entry.get('devices') or {}))
+        return cls(**settings)
+
+    def to_dict(self):
+        entry = {field: getattr(self, field) for field in self.FIELDS}
+        entry['locations_in_mm'] = self.locations_in_mm.tolist() if self.locations_in_mm is not None else None
+        return entry
+
+    @property
+    def uses_cryostat(self):
+        return bool(self.temperatures)
+
+    @property
+    def lockin_settings(self):
+        """
+        The lock-in configuration - the queue keeps experiments sharing it together
+        """
+        return (self.devices.get('lockin'), self.capture_mode, self.samples_per_loc, self.capture_duration_in_sec, self.independent_samples)
+
+#===============================================================================================
+#   Functions
+#===============================================================================================
+def parse_locations(locations):
+    """
+    A list of stage positions (mm) or a {"start", "stop", "num"} linspace
+    """
+    if isinstance(locations, dict):
+        return np.linspace(start=locations['start'], stop=locations['stop'], num=int(locations['num']))
+    return np.asarray(locations, dtype=float)
+
+def load_queue(path, defaults=None):
+    """
+    Reads a json queue file - a list of experiment entries, or {"defaults": {...}, "experiments": [...]}
+    with settings shared by all its entries
+    """
+    with open(path, 'r') as f:
+        queue = json.load(f)
+
+    if isinstance(queue, dict):
+        file_defaults = queue.get('defaults', {})
+        devices = dict((defaults or {}).get('devices') or {}, **(file_defaults.get('devices') or {}))
+        defaults = dict(defaults or {}, **file_defaults)
+        defaults['devices'] = devices
+        entries = queue['experiments']
+    else:
+        entries = queue
+
+    return [ExperimentDefinition.from_dict(entry, defaults) for entry in entries]
+
+def queue_order(experiments, current_temperature=None, durations=None):
+    """
+    Run order that changes slow settings the fewest times. Experiments without temperatures run
+    first, at whatever temperature the cryostat holds. The others follow in one monotonic
+    temperature pass - starting from the end nearest current_temperature. Ties are grouped by
+    lock-in settings and, with durations (expected sec, one per experiment), run the shorter
+    experiments first - a queue cut short loses the fewest runs. Remaining ties keep the queue order.
+    Returns the run order as indices into experiments, and whether the temperatures are passed descending.
+    """
+    first_seen = {}
+    for experiment in experiments:
+        first_seen.setdefault(experiment.lockin_settings, len(first_seen))
+    duration = list(durations) if durations is not None else [0] * len(experiments)
+
+    ambient = [index for index, e in enumerate(experiments) if not e.uses_cryostat]
+    cooled = [index for index, e in enumerate(experiments) if e.uses_cryostat]
+    ambient.sort(key=lambda index: (first_seen[experiments[index].lockin_settings], duration[index]))
+    if not cooled:
+        return ambient, False
+
+    low = min(min(experiments[index].temperatures) for index in cooled)
+    high = max(max(experiments[index].temperatures) for index in cooled)
+    descending = current_temperature is not None and abs(current_temperature - high) < abs(current_temperature - low)
+
+    sign = -1 if descending else 1
+    cooled.sort(key=lambda index: (sign * np.mean(experiments[index].temperatures), first_seen[experiments[index].lockin_settings], duration[index]))
+    return ambient + cooled, descending
+
+def in_temperature_direction(experiment, descending=False):
+    """
+    A copy of the experiment visiting its temperatures in the pass direction
+    """
+    experiment = copy.copy(experiment)
+    if experiment.temperatures:
+        experiment.temperatures = sorted(experiment.temperatures, reverse=descending)
+    return experiment
+
+def order_queue(experiments, current_temperature=None, durations=None):
+    """
+    The experiments in queue_order, as copies whose own temperatures are visited in the
+    direction of the temperature pass. The given definitions are not changed.
+    """
+    order, descending = queue_order(experiments, current_temperature, durations)
+    return [in_temperature_direction(experiments[index], descending) for index in order]
@@ -0,0 +1,150 @@
+#===============================================================================================
+#   Name:           FlyScan.py
+#   Description:    Continuous-motion ("on-the-fly") delay scans - StandaDevice + SR860Device
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import time
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+SR860_MAX_BUFFER_SAMPLES = 4096 * 1024 // 16     # 4MB capture buffer, X,Y,R,T as float32
+CAPTURE_LENGTH_MARGIN = 1.5                     # capture longer than the expected motion time
+CAPTURE_LENGTH_SLACK_IN_SEC = 1.0
+
+#===============================================================================================
+#   Functions
+#===============================================================================================
+def grid_edges(locations):
+    """
+    Returns the bin edges (ascending) of the delay grid - each location owns the interval
+    halfway to its neighbours, the outer locations own half a step beyond them.
+    """
+    sorted_locs = np.sort(np.asarray(locations, dtype=float))
+    if len(sorted_locs) == 1:
+        return np.array([sorted_locs[0], sorted_locs[0]])
+
+    inner = (sorted_locs[1:] + sorted_locs[:-1]) / 2
+    first = sorted_locs[0] - (inner[0] - sorted_locs[0])
+    last = sorted_locs[-1] + (sorted_locs[-1] - inner[-1])
+    return np.concatenate(([first], inner, [last]))
+
+def bin_samples_to_grid(sample_positions, samples, locations):
+    """
+    Bins samples taken at sample_positions (mm) onto the delay grid locations (any order).
+    Returns mean, std and count arrays ordered like locations. Empty bins hold NaN.
+    """
+    locations = np.asarray(locations, dtype=float)
+    sample_positions = np.asarray(sample_positions, dtype=float)
+    samples = np.asarray(samples, dtype=float)
+    n = len(locations)
+
+    edges = grid_edges(locations)
+    in_grid = (sample_positions >= edges[0]) & (sample_positions <= edges[-1])
+    sample_positions = sample_positions[in_grid]
+    samples = samples[in_grid]
+
+    # index into the ascending grid, clipped so the upper edge belongs to the last bin
+    sorted_index = np.clip(np.searchsorted(edges, sample_positions, side='right') - 1, 0, n - 1)
+    counts = np.bincount(sorted_index, minlength=n)
+    sums = np.bincount(sorted_index, weights=samples, minlength=n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = sums / counts
+        deviations = samples - mean[sorted_index]
+        std = np.sqrt(np.bincount(sorted_index, weights=deviations ** 2, minlength=n) / counts)
+
+    # back from ascending order to the order of locations
+    order = np.argsort(locations)
+    mean_out = np.empty(n)
+    std_out = np.empty(n)
+    counts_out = np.empty(n, dtype=int)
+    mean_out[order] = mean
+    std_out[order] = std
+    counts_out[order] = counts
+    return mean_out, std_out, counts_out
+
+def fly_capture(lockin_dev, standa_dev, start, stop, speed):
+    """
+    Moves the stage from start to stop (mm) at a constant speed (mm/sec) while the lock-in
+    captures into its internal buffer. Sample timestamps are modelled from the capture rate (or
+    taken from the stream when the lock-in is streaming) and the stage position at each sample
+    is interpolated from the tracked trajectory.
+    Returns sample_positions, x, y, r as numpy arrays.
+    """
+    # run-up: get to the start position at the default speed, then switch to the scan speed
+    standa_dev.move_stage(start)
+    default_speed = standa_dev.get_speed()
+    if default_speed is None or not standa_dev.set_speed(speed):
+        return None, None, None, None
+
+    expected_duration = abs(stop - start) / speed
+    samples_count = int((expected_duration * CAPTURE_LENGTH_MARGIN + CAPTURE_LENGTH_SLACK_IN_SEC) * lockin_dev.sample_frequency)
+    if samples_count > SR860_MAX_BUFFER_SAMPLES:
+        logger.warning("Fly scan needs %d samples, buffer holds %d. The end of the scan will not be captured." % (samples_count, SR860_MAX_BUFFER_SAMPLES))
+        samples_count = SR860_MAX_BUFFER_SAMPLES
+
+    logger.info("Fly scan %.2f -> %.2f mm at %.4f mm/sec (%.2f sec)" % (start, stop, speed, expected_duration))
+    streaming = lockin_dev.is_streaming
+    try:
+        if streaming:
+            move_times, move_positions = standa_dev.track_move(stop)
+        else:
+            arm_start = time.perf_counter()
+            lockin_dev.arm_capture(samples_count)
+            capture_start = (arm_start + time.perf_counter()) / 2
+
+            move_times, move_positions = standa_dev.track_move(stop)
+            x, y, r = lockin_dev.fetch_available_capture()
+    finally:
+        # the next (step) scan must not inherit the slow scan speed
+        standa_dev.set_speed(default_speed)
+
+    if not len(move_times):
+        logger.error("Stage trajectory was not tracked. Cannot place fly scan samples.")
+        return None, None, None, None
+
+    if streaming:
+        sample_times, x, y, r = lockin_dev.stream_window(move_times[0], move_times[-1])
+        if x is None:
+            return None, None, None, None
+        return np.interp(sample_times, move_times, move_positions), x, y, r
+
+    sample_times = capture_start + np.arange(len(x)) / lockin_dev.sample_frequency
+    sample_positions = np.interp(sample_times, move_times, move_positions)
+
+    # samples taken after the stage stopped are not part of the scan
+    in_motion = sample_times <= move_times[-1]
+    return sample_positions[in_motion], x[in_motion], y[in_motion], r[in_motion]
+
+def fly_scan(lockin_dev, standa_dev, locations, speed):
+    """
+    Runs a continuous-motion scan across the delay grid locations (mm) and bins the X samples
+    onto it. Returns the same per-location mean/std arrays as a step scan, plus sample counts.
+    """
+    edges = grid_edges(locations)
+    if locations[0] > locations[-1]:
+        start, stop = edges[-1], edges[0]
+    else:
+        start, stop = edges[0], edges[-1]
+
+    sample_positions, x, _, _ = fly_capture(lockin_dev, standa_dev, start, stop, speed)
+    if x is None:
+        return None, None, None
+
+    mean, std, counts = bin_samples_to_grid(sample_positions, x, locations)
+    if np.any(counts == 0):
+        logger.warning("%d delay points got no fly scan samples. Lower the speed or coarsen the grid." % (np.count_nonzero(counts == 0), ))
+
+    return mean, std, counts
@@ -0,0 +1,285 @@
+#===============================================================================================
+#   Name:           LiveViewer.py
+#   Description:    Live plot of a running scan, drawn by a separate process
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#   The scan side only copies: point summaries go into a bounded queue with put_nowait and the
+#   newest raw sample block (min/max decimated) into a shared memory slot the viewer polls. If the
+#   viewer falls behind, points are dropped and blocks overwritten - the scan never waits for it.
+#   The viewer drains what arrived, redraws at most max_fps times a second, and blits only the
+#   data artists unless the axes have to grow.
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import time
+import queue
+import multiprocessing
+import multiprocessing.shared_memory
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import devices.Telemetry as Telemetry
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+MAX_FPS = 10
+QUEUE_SIZE = 1024                   # point summaries waiting for the viewer before new ones are dropped
+RAW_PLOT_POINTS = 2000              # raw block length after min/max decimation
+POLL_INTERVAL_IN_SEC = 0.02
+CLOSE_TIMEOUT_IN_SEC = 5.0
+
+_HEADER = 2                         # raw slot: [sequence, count, samples...], sequence is odd while writing
+_FINISHED = None
+
+#===============================================================================================
+#   LiveViewer
+#===============================================================================================
+class LiveViewer(object):
+    """
+    Scan side of the live plot. publish(row, samples) matches the MeasurementWriter listener
+    signature, so the viewer follows a scan with writer.add_listener(viewer.publish).
+    """
+
+    def __init__(self, max_fps=MAX_FPS, raw=False, raw_points=RAW_PLOT_POINTS, title=None):
+        super(LiveViewer, self).__init__()
+        self.max_fps = max_fps
+        self.raw = raw
+        self.raw_points = raw_points
+        self.title = title
+        self.dropped = 0
+        self._context = multiprocessing.get_context('spawn')     # a fresh interpreter - no forked GUI or device state
+        self._queue = None
+        self._process = None
+        self._raw_memory = None
+        self._raw_slot = None
+
+    @property
+    def is_alive(self):
+        return self._process is not None and self._process.is_alive()
+
+    def start(self):
+        self._queue = self._context.Queue(QUEUE_SIZE)
+        raw_name = None
+        if self.raw:
+            self._raw_memory = multiprocessing.shared_memory.SharedMemory(create=True, size=(_HEADER + self.raw_points) * 8)
+            self._raw_slot = np.ndarray(_HEADER + self.raw_points, dtype=np.float64, buffer=self._raw_memory.buf)
+            self._raw_slot[:] = 0
+            raw_name = self._raw_memory.name
+
+        self._process = self._context.Process(target=_viewer_main, args=(self._queue, raw_name, self.raw_points, self.max_fps, self.title),
+                                              name='LiveViewer', daemon=True)
+        self._process.start()
+
+    def publish(self, row, samples=None):
+        """
+        Hands one delay point (a summary row) and optionally its raw samples to the viewer without blocking
+        """
+        if self._process is None:
+            return
+
+        point = (int(row['index']), float(row['position']), float(row['x']), float(row['x_err']), float(row['temperature']), int(row['sweep']))
+        try:
+            self._queue.put_nowait(point)
+        except queue.Full:
+            self.dropped += 1
+            Telemetry.METRICS.increment('live_viewer.dropped')
+
+        if self._raw_slot is not None and samples is not None and len(samples[0]):
+            self.publish_raw(samples[0])
+
+    def publish_raw(self, samples):
+        """
+        Overwrites the raw slot with a decimated block (the viewer only ever shows the newest)
+        """
+        block = decimate(np.asarray(samples, dtype=float), self.raw_points)
+        slot = self._raw_slot
+        slot[0] += 1
+        slot[1] = len(block)
+        slot[_HEADER:_HEADER + len(block)] = block
+        slot[0] += 1
+
+    def close(self, timeout=CLOSE_TIMEOUT_IN_SEC):
+        """
+        Tells the viewer the scan ended and stops it
+        """
+        if self._process is None:
+            return
+
+        try:
+            self._queue.put_nowait(_FINISHED)
+        except queue.Full:
+            pass
+        self._process.join(timeout)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+        self._process = None
+
+        self._queue.close()
+        self._queue.cancel_join_thread()
+        if self._raw_memory is not None:
+            self._raw_slot = None
+            self._raw_memory.close()
+            self._raw_memory.unlink()
+            self._raw_memory = None
+
+        if self.dropped:
+            logger.info("Live viewer dropped %d points it could not keep up with." % (self.dropped, ))
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+#===============================================================================================
+#   Functions
+#===============================================================================================
+def decimate(samples, points):
+    """
+    Reduces samples to about points values keeping every bin's min and max, so spikes stay visible
+    """
+    if len(samples) <= points:
+        return samples
+
+    bins = points // 2
+    usable = len(samples) // bins * bins
+    binned = samples[:usable].reshape(bins, -1)
+    block = np.empty(2 * bins)
+    block[0::2] = binned.min(axis=1)
+    block[1::2] = binned.max(axis=1)
+    return block
+
+def _read_raw_slot(slot):
+    # seqlock read - returns None while the scan side is writing or nothing new arrived
+    sequence = slot[0]
+    if sequence % 2:
+        return sequence, None
+    block = np.array(slot[_HEADER:_HEADER + int(slot[1])])
+    if slot[0] != sequence:
+        return sequence, None
+    return sequence, block
+
+def _viewer_main(points_queue, raw_name, raw_points, max_fps, title):
+    """
+    Viewer process: collects the points per temperature (sweeps averaged per position) and redraws
+    at most max_fps times a second
+    """
+    import matplotlib.pyplot as plt
+
+    raw_memory = multiprocessing.shared_memory.SharedMemory(name=raw_name) if raw_name else None
+    raw_slot = np.ndarray(_HEADER + raw_points, dtype=np.float64, buffer=raw_memory.buf) if raw_memory else None
+
+    fig, axes = plt.subplots(2 if raw_slot is not None else 1, 1, squeeze=False)
+    ax_scan = axes[0, 0]
+    ax_scan.set(xlabel="position [mm]", ylabel="X [V]", title=title or "")
+    current, = ax_scan.plot([], [], 'o', color='red', animated=True)
+    ax_raw = raw_line = None
+    if raw_slot is not None:
+        ax_raw = axes[1, 0]
+        ax_raw.set(xlabel="sample (decimated)", ylabel="X [V]")
+        raw_line, = ax_raw.plot([], [], lw=0.8, animated=True)
+
+    closed = []
+    fig.canvas.mpl_connect('close_event', lambda event: closed.append(True))
+    plt.show(block=False)
+
+    sums = {}                       # temperature -> {position: [sum, count]}
+    lines = {}
+    last_point = None
+    raw_sequence = 0
+    background = None
+    finished = False
+    dirty = False
+    last_frame = 0
+
+    while not finished and not closed:
+        # drain everything that arrived since the last frame
+        while True:
+            try:
+                point = points_queue.get_nowait()
+            except queue.Empty:
+                break
+            if point is _FINISHED:
+                finished = True
+                break
+            _, position, x, _, temperature, _ = point
+            temperature = temperature if np.isfinite(temperature) else None     # nan keys never compare equal
+            entry = sums.setdefault(temperature, {}).setdefault(position, [0.0, 0])
+            entry[0] += x
+            entry[1] += 1
+            last_point = (position, x)
+            dirty = True
+
+        raw_block = None
+        if raw_slot is not None and raw_slot[0] != raw_sequence:
+            raw_sequence, raw_block = _read_raw_slot(raw_slot)
+            dirty = dirty or raw_block is not None
+
+        if not dirty or time.monotonic() - last_frame < 1.0 / max_fps:
+            fig.canvas.flush_events()
+            time.sleep(POLL_INTERVAL_IN_SEC)
+            continue
+
+        # update the data, a new series or data outside the axes needs a full redraw
+        full = background is None
+        for temperature, positions in sums.items():
+            if temperature not in lines:
+                label = "%.1f K" % (temperature, ) if temperature is not None else None
+                lines[temperature], = ax_scan.plot([], [], 'o', ms=4, label=label, animated=True)
+                if label:
+                    ax_scan.legend()
+                full = True
+            xs = np.array(sorted(positions))
+            ys = np.array([positions[p][0] / positions[p][1] for p in xs])
+            lines[temperature].set_data(xs, ys)
+            full = full or _outside(ax_scan, xs, ys)
+        if last_point is not None:
+            current.set_data([last_point[0]], [last_point[1]])
+        if raw_block is not None:
+            raw_line.set_data(np.arange(len(raw_block)), raw_block)
+            full = full or _outside(ax_raw, np.arange(len(raw_block)), raw_block)
+
+        artists = list(lines.values()) + [current] + ([raw_line] if raw_line is not None else [])
+        if full:
+            for ax in (ax_scan, ax_raw):
+                if ax is not None:
+                    ax.relim(visible_only=False)
+                    ax.autoscale_view()
+                    _pad_limits(ax)
+            fig.canvas.draw()
+            background = fig.canvas.copy_from_bbox(fig.bbox)
+        else:
+            fig.canvas.restore_region(background)
+        for artist in artists:
+            artist.axes.draw_artist(artist)
+        fig.canvas.blit(fig.bbox)
+        fig.canvas.flush_events()
+
+        dirty = False
+        last_frame = time.monotonic()
+
+    plt.close(fig)
+    if raw_memory is not None:
+        raw_slot = None
+        raw_memory.close()
+
+def _outside(ax, xs, ys):
+    if not len(xs):
+        return False
+    (x0, x1), (y0, y1) = sorted(ax.get_xlim()), sorted(ax.get_ylim())
+    return xs.min() < x0 or xs.max() > x1 or np.nanmin(ys) < y0 or np.nanmax(ys) > y1
+
+def _pad_limits(ax, margin=0.2):
+    # leave head room so the axes don't grow on every new extreme (each growth is a full redraw)
+    y0, y1 = ax.get_ylim()
+    span = (y1 - y0) or abs(y1) or 1.0
+    ax.set_ylim(y0 - margin * span, y1 + margin * span)
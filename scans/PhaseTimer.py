@@ -0,0 +1,132 @@
+#===============================================================================================
+#   Name:           PhaseTimer.py
+#   Description:    Per delay point wall time breakdown of a scan
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import time
+import threading
+import contextlib
+
+import logging
+logger = logging.getLogger(__name__)
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+PHASE_MOVE = 'move'
+PHASE_SETTLE = 'settle'
+PHASE_CAPTURE = 'capture'
+PHASE_STATISTICS = 'statistics'
+PHASE_WRITE = 'write'
+PHASE_TEMPERATURE = 'temperature'   # cryostat ramp and settle
+
+#===============================================================================================
+#   PhaseTimer
+#===============================================================================================
+class PhaseTimer(object):
+    """
+    Collects the time spent in each phase (move, settle, capture, ...) of every delay point,
+    plus free-form per point values such as the achieved sample rate.
+    Phases run on a background thread (overlapping the acquisition) are kept apart, so the
+    foreground phases still add up to the scan wall time.
+    """
+
+    def __init__(self):
+        super(PhaseTimer, self).__init__()
+        self.points = []
+        self.start_time = None
+        self.end_time = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.start_time = time.perf_counter()
+
+    def stop(self):
+        self.end_time = time.perf_counter()
+
+    @property
+    def total_time(self):
+        if self.start_time is None:
+            return 0
+        end_time = self.end_time if self.end_time is not None else time.perf_counter()
+        return end_time - self.start_time
+
+    def start_point(self, index, **values):
+        with self._lock:
+            self.points.append({'index': index, 'phases': {}, 'background': {}, 'values': dict(values)})
+
+    def _point(self, index):
+        if index is None:
+            return self.points[-1]
+        for point in reversed(self.points):
+            if point['index'] == index:
+                return point
+        raise KeyError(index)
+
+    def add(self, phase, duration, index=None, background=False):
+        """
+        Adds duration to phase of the current point, or of point index when given
+        """
+        with self._lock:
+            phases = self._point(index)['background' if background else 'phases']
+            phases[phase] = phases.get(phase, 0) + duration
+
+    def set_value(self, name, value):
+        with self._lock:
+            self.points[-1]['values'][name] = value
+
+    @contextlib.contextmanager
+    def phase(self, phase, index=None, background=False):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start_time, index, background)
+
+    def phase_totals(self, background=False):
+        totals = {}
+        for point in self.points:
+            for phase, duration in point['background' if background else 'phases'].items():
+                totals[phase] = totals.get(phase, 0) + duration
+        return totals
+
+    def summary(self):
+        totals = self.phase_totals()
+        accounted = sum(totals.values())
+        return {
+            'total_time'        :   self.total_time,
+            'points'            :   len(self.points),
+            'phase_totals'      :   totals,
+            'phase_means'       :   {phase: duration / len(self.points) for phase, duration in totals.items()} if self.points else {},
+            'background_totals' :   self.phase_totals(background=True),
+            'unaccounted_time'  :   self.total_time - accounted,
+        }
+
+#===============================================================================================
+#   NullPhaseTimer
+#===============================================================================================
+class NullPhaseTimer(PhaseTimer):
+    """
+    Does nothing - used by the scans when no timing is requested
+    """
+
+    def start_point(self, index, **values):
+        pass
+
+    def add(self, phase, duration, index=None, background=False):
+        pass
+
+    def set_value(self, name, value):
+        pass
+
+    @contextlib.contextmanager
+    def phase(self, phase, index=None, background=False):
+        yield
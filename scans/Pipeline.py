@@ -0,0 +1,116 @@
+#===============================================================================================
+#   Name:           Pipeline.py
+#   Description:    Background worker that processes captured points while the next one is acquired
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import queue
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import devices.Telemetry as Telemetry
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+DEFAULT_MAX_PENDING = 8         # captured points waiting for processing before submit() blocks
+_STOP = object()
+
+#===============================================================================================
+#   Exceptions
+#===============================================================================================
+class PipelineError(Exception):
+    """
+    The background worker failed processing a point
+    """
+    pass
+
+#===============================================================================================
+#   AcquisitionPipeline
+#===============================================================================================
+class AcquisitionPipeline(object):
+    """
+    Runs process(index, *args) for every submitted point on a single background thread, in
+    submission order. The queue is bounded, so a slow worker blocks submit() instead of piling
+    up samples in memory. A worker failure stops the processing and is raised from the next
+    submit() or from close(); points already submitted before an acquisition error are still
+    processed when the pipeline is closed.
+    """
+
+    def __init__(self, process, max_pending=DEFAULT_MAX_PENDING):
+        super(AcquisitionPipeline, self).__init__()
+        self.process = process
+        self.results = {}
+        self.error = None
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._work, name='AcquisitionPipeline', daemon=True)
+        self._thread.start()
+
+    def submit(self, index, *args):
+        """
+        Queues a captured point. Blocks while max_pending points are waiting.
+        """
+        self._raise_error()
+        with Telemetry.METRICS.timed('pipeline.submit'):
+            self._queue.put((index, args))
+        Telemetry.METRICS.set_gauge('pipeline.pending', self._queue.qsize())
+
+    def close(self):
+        """
+        Waits for the queued points to be processed and stops the worker
+        """
+        if self._thread is None:
+            return
+
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        self._raise_error()
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise PipelineError("Processing point failed: %r" % (self.error, )) from self.error
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            if self.error is not None:
+                continue    # keep draining so submit() never blocks on a dead worker
+
+            index, args = item
+            try:
+                self.results[index] = self.process(index, *args)
+            except Exception as err:
+                logger.exception("Processing point %d failed." % (index, ))
+                self.error = err
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+            return
+
+        # already failing - flush what was captured, but let the original error through
+        try:
+            self.close()
+        except PipelineError:
+            pass
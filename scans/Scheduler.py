@@ -0,0 +1,192 @@
+#===============================================================================================
+#   Name:           Scheduler.py
+#   Description:    Multi-dimensional scan scheduler with travel-minimizing visit order
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import time
+import itertools
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+STAGE_MOVE_OVERHEAD_IN_SEC = 0.5            # command + wait for stop
+STAGE_SPEED_IN_MM_PER_SEC = 5.0
+TEMPERATURE_RATE_IN_K_PER_SEC = 0.05
+TEMPERATURE_SETTLE_IN_SEC = 120.0
+TEMPERATURE_TOLERANCE_IN_K = 0.1
+TEMPERATURE_TIMEOUT_IN_SEC = 3600.0
+TEMPERATURE_POLL_INTERVAL_IN_SEC = 5.0
+PARAMETER_CHANGE_COST_IN_SEC = 0.05
+
+#===============================================================================================
+#   Axis
+#===============================================================================================
+class Axis(object):
+    """
+    One scanned device parameter. set_value(value) applies a value, cost(from_value, to_value)
+    estimates how long the change takes (sec). serpentine axes may be swept in either direction,
+    the others are always visited in the given order (e.g. never revisit a temperature).
+    """
+
+    def __init__(self, name, values, set_value, cost, serpentine=True):
+        super(Axis, self).__init__()
+        self.name = name
+        self.values = list(values)
+        self.set_value = set_value
+        self.cost = cost
+        self.serpentine = serpentine
+
+    def sweep_cost(self):
+        """
+        Cost of one pass over all the values
+        """
+        return sum(self.cost(a, b) for a, b in zip(self.values[:-1], self.values[1:]))
+
+    def change_cost(self):
+        """
+        Mean cost of a single value change - used to rank the axes
+        """
+        if len(self.values) < 2:
+            return 0
+        return self.sweep_cost() / (len(self.values) - 1)
+
+#===============================================================================================
+#   Axis factories
+#===============================================================================================
+def stage_axis(standa_dev, locations, speed=STAGE_SPEED_IN_MM_PER_SEC, overhead=STAGE_MOVE_OVERHEAD_IN_SEC, name='position'):
+    return Axis(name, locations, standa_dev.move_stage,
+                lambda a, b: overhead + abs(b - a) / speed)
+
+def temperature_axis(cryostat_dev, temperatures, rate=TEMPERATURE_RATE_IN_K_PER_SEC, settle=TEMPERATURE_SETTLE_IN_SEC,
+                     tolerance=TEMPERATURE_TOLERANCE_IN_K, name='temperature'):
+    def set_temperature(temperature):
+        cryostat_dev.set_temperature(temperature)
+        wait_for_temperature(cryostat_dev, temperature, tolerance)
+
+    return Axis(name, temperatures, set_temperature, lambda a, b: settle + abs(b - a) / rate, serpentine=False)
+
+def parameter_axis(name, values, set_value, cost=PARAMETER_CHANGE_COST_IN_SEC):
+    """
+    Any other device setting (e.g. a lock-in time constant) with a fixed change cost
+    """
+    return Axis(name, values, set_value, lambda a, b: cost if a != b else 0)
+
+def wait_for_temperature(cryostat_dev, temperature, tolerance=TEMPERATURE_TOLERANCE_IN_K, timeout=TEMPERATURE_TIMEOUT_IN_SEC,
+                         poll_interval=TEMPERATURE_POLL_INTERVAL_IN_SEC):
+    """
+    Blocks until the cryostat reads within tolerance of temperature. Returns False on timeout.
+    """
+    start_time = time.monotonic()
+    while time.monotonic() - start_time < timeout:
+        current = cryostat_dev.get_temperature()
+        if current is not None and abs(current - temperature) <= tolerance:
+            return True
+        time.sleep(poll_interval)
+
+    logger.error("Cryostat did not reach %.2f K within %.0f sec." % (temperature, timeout))
+    return False
+
+#===============================================================================================
+#   ScanScheduler
+#===============================================================================================
+class ScanScheduler(object):
+    """
+    Visits the full grid of a set of axes. The most expensive axis to change is the outermost loop,
+    so it changes the fewest times, and the inner serpentine axes reverse direction every time an
+    outer axis steps (boustrophedon), so there is never a fly-back.
+    """
+
+    def __init__(self, axes, order=None):
+        super(ScanScheduler, self).__init__()
+        self.axes = list(axes)
+        if order is None:
+            # slowest first, keeping the declared order for ties
+            self.order = sorted(range(len(self.axes)), key=lambda i: -self.axes[i].change_cost())
+        else:
+            self.order = [[axis.name for axis in self.axes].index(name) for name in order]
+
+    @property
+    def nested_axes(self):
+        return [self.axes[i] for i in self.order]
+
+    def __len__(self):
+        return int(np.prod([len(axis.values) for axis in self.axes]))
+
+    def plan(self):
+        """
+        Returns the visit order as a list of {axis name: value} dicts
+        """
+        nested = self.nested_axes
+        names = [axis.name for axis in nested]
+        points = []
+        for steps in itertools.product(*[range(len(axis.values)) for axis in nested]):
+            values = [self._axis_value(nested, depth, steps[:depth], steps[depth]) for depth in range(len(nested))]
+            points.append(dict(zip(names, values)))
+
+        return points
+
+    @staticmethod
+    def _axis_value(nested, depth, outer_steps, step):
+        """
+        Value of the axis at depth for its step-th step, reversed on every odd pass
+        """
+        axis = nested[depth]
+        passes = 0
+        for outer_depth, outer_step in enumerate(outer_steps):
+            passes = passes * len(nested[outer_depth].values) + outer_step
+        if axis.serpentine and passes % 2:
+            return axis.values[len(axis.values) - 1 - step]
+        return axis.values[step]
+
+    def estimate_duration(self, measure_time, start=None):
+        """
+        Expected run time (sec): every value change along the plan plus measure_time per point.
+        start is the {axis name: value} the devices are at before the run.
+        """
+        total = 0
+        previous = dict(start or {})
+        for point in self.plan():
+            for axis in self.nested_axes:
+                value = point[axis.name]
+                if axis.name in previous and previous[axis.name] != value:
+                    total += axis.cost(previous[axis.name], value)
+                previous[axis.name] = value
+            total += measure_time
+
+        return total
+
+    def run(self, measure, start_point=None, skip=None):
+        """
+        Applies every point of the plan (only the axes whose value changed, outermost first)
+        and calls measure(index, point). start_point(index, point) runs before the values are set.
+        Plan indices in skip (e.g. already measured before a restart) are not visited.
+        Returns the list of measure results, None for skipped points.
+        """
+        results = []
+        current = {}
+        for index, point in enumerate(self.plan()):
+            if skip is not None and index in skip:
+                results.append(None)
+                continue
+            if start_point is not None:
+                start_point(index, point)
+            for axis in self.nested_axes:
+                value = point[axis.name]
+                if current.get(axis.name) != value:
+                    axis.set_value(value)
+                    current[axis.name] = value
+            results.append(measure(index, point))
+
+        return results
@@ -0,0 +1,131 @@
+#===============================================================================================
+#   Name:           Statistics.py
+#   Description:    Streaming statistics for lock-in samples
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+MAX_CORRELATION = 0.999
+
+#===============================================================================================
+#   RunningStats
+#===============================================================================================
+class RunningStats(object):
+    """
+    Welford running mean/variance. Works elementwise on arrays (one accumulator per delay point)
+    and two accumulators can be merged, so partial results (blocks, sweeps) combine exactly.
+    """
+
+    def __init__(self, shape=()):
+        super(RunningStats, self).__init__()
+        self.count = np.zeros(shape)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    def update(self, samples):
+        """
+        Adds a batch of samples along the first axis
+        """
+        samples = np.asarray(samples, dtype=float)
+        if not len(samples):
+            return
+
+        batch = RunningStats()
+        batch.count = np.full(samples.shape[1:], len(samples), dtype=float)
+        batch.mean = samples.mean(axis=0)
+        batch.m2 = ((samples - batch.mean) ** 2).sum(axis=0)
+        self.merge(batch)
+
+    def copy(self):
+        stats = RunningStats()
+        stats.count = np.copy(self.count)
+        stats.mean = np.copy(self.mean)
+        stats.m2 = np.copy(self.m2)
+        return stats
+
+    def merge(self, other):
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.mean = np.where(count > 0, self.mean + delta * np.divide(other.count, count), 0)
+            self.m2 = self.m2 + other.m2 + np.where(count > 0, delta ** 2 * self.count * np.divide(other.count, count), 0)
+        self.count = count
+
+    @property
+    def variance(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 1, self.m2 / np.maximum(self.count - 1, 1), np.nan)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    @property
+    def standard_error(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.std / np.sqrt(self.count)
+
+#===============================================================================================
+#   Functions
+#===============================================================================================
+def merged(*stats):
+    """
+    A new RunningStats holding all the samples of the given accumulators
+    """
+    total = stats[0].copy()
+    for other in stats[1:]:
+        total.merge(other)
+    return total
+
+def lag1_autocorrelation(samples):
+    samples = np.asarray(samples, dtype=float)
+    if len(samples) < 3:
+        return 0.0
+
+    deviations = samples - samples.mean()
+    denominator = np.dot(deviations, deviations)
+    if not denominator:
+        return 0.0
+
+    return float(np.dot(deviations[1:], deviations[:-1]) / denominator)
+
+def time_constant_correlation(sample_frequency, time_constant):
+    """
+    Lag-1 correlation a first order low pass with time_constant (sec) leaves between samples
+    """
+    if not sample_frequency or not time_constant:
+        return 0.0
+
+    return float(np.exp(-1 / (sample_frequency * time_constant)))
+
+def effective_sample_count(count, correlation):
+    """
+    Number of independent samples equivalent to count AR(1) samples with the given lag-1 correlation
+    """
+    correlation = min(max(correlation, 0.0), MAX_CORRELATION)
+    return max(min(count * (1 - correlation) / (1 + correlation), count), 1.0 if count else 0.0)
+
+def correlated_statistics(samples, model_correlation=0.0):
+    """
+    Returns mean, std, effective sample count and standard error of the mean of samples,
+    using the larger of the measured and model (time constant) lag-1 correlation.
+    """
+    samples = np.asarray(samples, dtype=float)
+    correlation = max(lag1_autocorrelation(samples), model_correlation)
+    n_eff = effective_sample_count(len(samples), correlation)
+    std = samples.std()
+    return samples.mean(), std, n_eff, std / np.sqrt(n_eff) if n_eff else np.nan
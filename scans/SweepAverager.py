@@ -0,0 +1,93 @@
+#===============================================================================================
+#   Name:           SweepAverager.py
+#   Description:    Running average of repeated delay sweeps with outlier sweep rejection
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import scans.Statistics as Statistics
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+OUTLIER_FACTOR = 3.0                # sweeps deviating more than OUTLIER_FACTOR x the typical sweep are dropped
+MIN_SWEEPS_FOR_OUTLIERS = 3         # accepted sweeps needed before any sweep is judged
+MIN_SWEEPS_TO_CONVERGE = 3          # the spread of fewer sweeps is too uncertain to stop on
+
+#===============================================================================================
+#   SweepAverager
+#===============================================================================================
+class SweepAverager(object):
+    """
+    Per delay point running mean / variance over repeated sweeps, in constant memory.
+    Every sweep contributes one value per point (its mean there), so the spread between sweeps -
+    drift included - sets the error. Forward and backward sweeps are accumulated apart and
+    merged for the average, which keeps a direction dependent offset (hysteresis) visible.
+    A sweep whose RMS deviation from the current average is more than outlier_factor times
+    the median deviation of the accepted sweeps is dropped (outlier_factor=None keeps all).
+    """
+
+    def __init__(self, points, outlier_factor=OUTLIER_FACTOR, min_sweeps_for_outliers=MIN_SWEEPS_FOR_OUTLIERS):
+        super(SweepAverager, self).__init__()
+        self.outlier_factor = outlier_factor
+        self.min_sweeps_for_outliers = min_sweeps_for_outliers
+        self.directions = {1: Statistics.RunningStats(points), -1: Statistics.RunningStats(points)}
+        self.deviations = []        # RMS deviation of each accepted sweep from the average before it
+        self.accepted = 0
+        self.rejected = []
+
+    @property
+    def stats(self):
+        return Statistics.merged(*self.directions.values())
+
+    @property
+    def mean(self):
+        return self.stats.mean
+
+    @property
+    def standard_error(self):
+        return self.stats.standard_error
+
+    @property
+    def noise(self):
+        """
+        The largest standard error over the points (NaN before two sweeps)
+        """
+        error = self.standard_error
+        return np.nanmax(error) if np.any(np.isfinite(error)) else np.nan
+
+    def add_sweep(self, values, direction=1, sweep=None):
+        """
+        Adds the per point values of one sweep (in grid order). Returns False if it was dropped.
+        """
+        values = np.asarray(values, dtype=float)
+        stats = self.stats
+        deviation = np.sqrt(np.nanmean((values - stats.mean) ** 2)) if self.accepted else np.nan
+
+        if self.outlier_factor and self.accepted >= self.min_sweeps_for_outliers and len(self.deviations):
+            typical = np.median(self.deviations)
+            if typical > 0 and deviation > self.outlier_factor * typical:
+                logger.warning("Dropping sweep %s - deviates %.2e from the average (typical %.2e)." % (sweep, deviation, typical))
+                self.rejected.append(sweep)
+                return False
+
+        self.directions[1 if direction >= 0 else -1].update(values[None, :])
+        if np.isfinite(deviation):
+            self.deviations.append(deviation)
+        self.accepted += 1
+        return True
+
+    def converged(self, target):
+        """
+        True once every point's standard error is at or below target
+        """
+        return self.accepted >= MIN_SWEEPS_TO_CONVERGE and self.noise <= target
@@ -0,0 +1,342 @@
+#===============================================================================================
+#   Name:           Catalog.py
+#   Description:    SQLite index of measurement runs - what was measured, how and where it is stored
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#   One row per data set (MeasurementWriter base path) with the experiment, the lock-in and stage
+#   settings and the start / end times, so runs are found without opening their files:
+#
+#       catalog = Catalog.RunCatalog()
+#       runs = catalog.query(experiment='PumpProbe_Galium_300K', temperature=300, integration_time=4)
+#       df = Catalog.load_summaries(runs)
+#
+#       python -m storage.Catalog --index data           # register data sets written before the catalog
+#       python -m storage.Catalog --experiment PumpProbe_Galium_300K --temperature 300
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import os, sys
+import glob
+import json
+import time
+import sqlite3
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+
+import logging
+logger = logging.getLogger(__name__)
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import storage.MeasurementWriter as MeasurementWriter
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+DEFAULT_CATALOG_PATH = os.environ.get('AUTOLAB_CATALOG', 'autolab_catalog.sqlite')
+BUSY_TIMEOUT_IN_SEC = 30            # another script may be registering a run at the same moment
+
+STATUS_RUNNING = 'running'          # also what a crashed run is left as - see latest()
+STATUS_FINISHED = 'finished'
+STATUS_FAILED = 'failed'
+
+TEMPERATURE_TOLERANCE_IN_K = 0.5
+RELATIVE_TOLERANCE = 0.05           # for integration time and sample frequency matches
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id                  INTEGER PRIMARY KEY AUTOINCREMENT,
+    data_path           TEXT NOT NULL UNIQUE,
+    experiment          TEXT,
+    scan_mode           TEXT,
+    status              TEXT,
+    started             TEXT,
+    finished            TEXT,
+    sample_frequency    REAL,
+    time_constant       REAL,
+    capture_mode        TEXT,
+    samples_per_loc     INTEGER,
+    integration_time    REAL,
+    position_min        REAL,
+    position_max        REAL,
+    position_count      INTEGER,
+    row_count           INTEGER,
+    metadata            TEXT
+);
+CREATE TABLE IF NOT EXISTS run_temperatures (
+    run_id              INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    temperature         REAL NOT NULL,
+    PRIMARY KEY (run_id, temperature)
+);
+CREATE INDEX IF NOT EXISTS runs_experiment ON runs(experiment, started);
+CREATE INDEX IF NOT EXISTS run_temperatures_temperature ON run_temperatures(temperature);
+"""
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+#===============================================================================================
+#   RunCatalog
+#===============================================================================================
+class RunCatalog(object):
+    """
+    The run index. Data paths are stored absolute, so the catalog can be queried from any
+    directory. Query results are dicts of the run columns plus 'temperatures' and the full
+    'metadata' of the run.
+    """
+
+    def __init__(self, path=DEFAULT_CATALOG_PATH):
+        super(RunCatalog, self).__init__()
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_IN_SEC, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA foreign_keys = ON")
+        with self._conn:
+            self._conn.executescript(SCHEMA)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def register(self, data_path, metadata, temperatures=None, started=None, status=STATUS_RUNNING):
+        """
+        Adds the run stored at data_path (a MeasurementWriter base path) and returns its id.
+        Registering a known data path again (e.g. on resume) updates it and marks it running.
+        temperatures defaults to the metadata 'temperatures'.
+        """
+        data_path = os.path.abspath(data_path)
+        metadata = metadata or {}
+        if temperatures is None:
+            temperatures = metadata.get('temperatures') or []
+        locations = np.asarray(metadata.get('locations_in_mm') or [], dtype=float)
+        sample_frequency = metadata.get('sample_frequency')
+        samples_per_loc = metadata.get('samples_per_loc')
+        # the requested capture time per point, older data sets only have the sample count and rate
+        integration_time = metadata.get('integration_time')
+        if integration_time is None and samples_per_loc and sample_frequency:
+            integration_time = samples_per_loc / sample_frequency
+
+        columns = {
+            'data_path'         :   data_path,
+            'experiment'        :   metadata.get('experiment'),
+            'scan_mode'         :   metadata.get('scan_mode'),
+            'status'            :   status,
+            'started'           :   started or time.strftime(TIME_FORMAT),
+            'finished'          :   None,
+            'sample_frequency'  :   sample_frequency,
+            'time_constant'     :   metadata.get('time_constant'),
+            'capture_mode'      :   metadata.get('capture_mode'),
+            'samples_per_loc'   :   samples_per_loc,
+            'integration_time'  :   integration_time,
+            'position_min'      :   float(locations.min()) if len(locations) else None,
+            'position_max'      :   float(locations.max()) if len(locations) else None,
+            'position_count'    :   len(locations),
+            'metadata'          :   json.dumps(metadata, default=str),
+        }
+
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT id, started FROM runs WHERE data_path = ?", (data_path, )).fetchone()
+            if row is None:
+                names = ", ".join(columns)
+                cursor = self._conn.execute("INSERT INTO runs (%s) VALUES (%s)" % (names, ", ".join("?" * len(columns))), list(columns.values()))
+                run_id = cursor.lastrowid
+            else:
+                # a resumed run keeps its original start time
+                run_id = row['id']
+                columns['started'] = started or row['started']
+                assignments = ", ".join("%s = ?" % (name, ) for name in columns)
+                self._conn.execute("UPDATE runs SET %s WHERE id = ?" % (assignments, ), list(columns.values()) + [run_id])
+                self._conn.execute("DELETE FROM run_temperatures WHERE run_id = ?", (run_id, ))
+
+            self._conn.executemany("INSERT OR IGNORE INTO run_temperatures (run_id, temperature) VALUES (?, ?)",
+                                   [(run_id, float(temperature)) for temperature in temperatures])
+
+        return run_id
+
+    def finish(self, run_id, status=STATUS_FINISHED, finished=None, row_count=None):
+        """
+        Records the end of a run. row_count defaults to the number of summary rows on disk.
+        """
+        run = self.get(run_id)
+        if row_count is None and run is not None:
+            row_count = MeasurementWriter.row_count(run['data_path'])
+
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE runs SET status = ?, finished = ?, row_count = ? WHERE id = ?",
+                               (status, finished or time.strftime(TIME_FORMAT), row_count, run_id))
+
+    def get(self, run_id):
+        runs = self._select("runs.id = ?", [run_id])
+        return runs[0] if runs else None
+
+    def query(self, experiment=None, scan_mode=None, status=None, temperature=None, integration_time=None, sample_frequency=None,
+              since=None, until=None, temperature_tolerance=TEMPERATURE_TOLERANCE_IN_K, relative_tolerance=RELATIVE_TOLERANCE, limit=None):
+        """
+        Runs matching all the given criteria, oldest first. temperature matches runs that measured
+        at that temperature (any of their set points), integration_time (sec per delay point) and
+        sample_frequency (Hz) match within relative_tolerance, since / until compare the start time
+        ('YYYY-MM-DD[ HH:MM:SS]').
+        """
+        conditions = []
+        values = []
+        for column, value in (('experiment', experiment), ('scan_mode', scan_mode), ('status', status)):
+            if value is not None:
+                conditions.append("runs.%s = ?" % (column, ))
+                values.append(value)
+        for column, value in (('integration_time', integration_time), ('sample_frequency', sample_frequency)):
+            if value is not None:
+                conditions.append("runs.%s BETWEEN ? AND ?" % (column, ))
+                values += [value * (1 - relative_tolerance), value * (1 + relative_tolerance)]
+        if temperature is not None:
+            conditions.append("runs.id IN (SELECT run_id FROM run_temperatures WHERE temperature BETWEEN ? AND ?)")
+            values += [temperature - temperature_tolerance, temperature + temperature_tolerance]
+        if since is not None:
+            conditions.append("runs.started >= ?")
+            values.append(since)
+        if until is not None:
+            conditions.append("runs.started < ?")
+            values.append(until)
+
+        return self._select(" AND ".join(conditions) or "1", values, limit=limit)
+
+    def latest(self, experiment, unfinished=False):
+        """
+        The most recent run of experiment - with unfinished, the most recent one that did not
+        finish (a crashed run stays STATUS_RUNNING), the one to resume.
+        """
+        condition = "runs.experiment = ?" + (" AND runs.status != ?" if unfinished else "")
+        values = [experiment] + ([STATUS_FINISHED] if unfinished else [])
+        runs = self._select(condition, values, order="DESC", limit=1)
+        return runs[0] if runs else None
+
+    def remove(self, run_id):
+        """
+        Drops a run from the catalog (its files are not touched)
+        """
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM runs WHERE id = ?", (run_id, ))
+
+    def index_data_set(self, base_path):
+        """
+        Registers a data set from its json sidecar, e.g. one written before the catalog existed.
+        The file times stand in for the start and end times.
+        """
+        meta = MeasurementWriter.load_metadata(base_path)
+        finished = time.strftime(TIME_FORMAT, time.localtime(os.path.getmtime(base_path + MeasurementWriter.SUMMARY_SUFFIX)))
+        run_id = self.register(base_path, meta.get('metadata'), started=meta.get('created'), status=STATUS_FINISHED)
+        self.finish(run_id, finished=finished)
+        return run_id
+
+    def index_directory(self, directory):
+        """
+        Registers every data set under directory (recursively). Returns the number of data sets found.
+        """
+        count = 0
+        for summary_path in sorted(glob.glob(os.path.join(directory, '**', '*' + MeasurementWriter.SUMMARY_SUFFIX), recursive=True)):
+            base_path = summary_path[:-len(MeasurementWriter.SUMMARY_SUFFIX)]
+            if not os.path.exists(base_path + MeasurementWriter.META_SUFFIX):
+                continue
+            self.index_data_set(base_path)
+            count += 1
+        return count
+
+    def _select(self, condition, values, order="ASC", limit=None):
+        sql = "SELECT runs.*, (SELECT group_concat(temperature) FROM run_temperatures WHERE run_id = runs.id) AS temperatures " \
+              "FROM runs WHERE %s ORDER BY runs.started %s, runs.id %s" % (condition, order, order)
+        if limit is not None:
+            sql += " LIMIT %d" % (limit, )
+
+        with self._lock:
+            rows = self._conn.execute(sql, values).fetchall()
+
+        runs = []
+        for row in rows:
+            run = dict(row)
+            run['temperatures'] = sorted(float(t) for t in row['temperatures'].split(',')) if row['temperatures'] else []
+            run['metadata'] = json.loads(row['metadata']) if row['metadata'] else {}
+            runs.append(run)
+        return runs
+
+#===============================================================================================
+#   Functions
+#===============================================================================================
+def iter_runs(runs, raw=False, mmap=True):
+    """
+    Yields (run, summary, raw) for query results, opening one data set at a time.
+    The arrays are memory-mapped, so only the rows that are actually used are read from disk.
+    raw is None unless requested. Runs whose files are missing are skipped with a warning.
+    """
+    for run in runs:
+        base_path = run['data_path']
+        if not os.path.exists(base_path + MeasurementWriter.SUMMARY_SUFFIX):
+            logger.warning("Data set %s of run %d is missing." % (base_path, run['id']))
+            continue
+        summary = MeasurementWriter.load_summary(base_path, mmap)
+        raw_samples = MeasurementWriter.load_raw(base_path, mmap) if raw else None
+        yield run, summary, raw_samples
+
+def load_summaries(runs, fields=None):
+    """
+    The summary rows of all the runs as one DataFrame with a run_id column.
+    fields restricts the columns copied out of the memory-mapped files.
+    """
+    frames = []
+    for run, summary, _ in iter_runs(runs):
+        names = [name for name in (fields or summary.dtype.names) if name in summary.dtype.names]
+        frame = pd.DataFrame({name: np.asarray(summary[name]) for name in names})
+        frame.insert(0, 'run_id', run['id'])
+        frames.append(frame)
+
+    if not frames:
+        return pd.DataFrame(columns=['run_id'] + list(fields or MeasurementWriter.SUMMARY_DTYPE.names))
+    return pd.concat(frames, ignore_index=True)
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--catalog", default=DEFAULT_CATALOG_PATH, help="catalog file")
+    parser.add_argument("--index", nargs='+', default=[], metavar="DIR", help="register the data sets found under these directories")
+    parser.add_argument("--experiment", default=None)
+    parser.add_argument("--scan-mode", default=None)
+    parser.add_argument("--status", default=None)
+    parser.add_argument("--temperature", type=float, default=None, help="K")
+    parser.add_argument("--integration-time", type=float, default=None, help="sec per delay point")
+    parser.add_argument("--since", default=None, help="YYYY-MM-DD")
+    parser.add_argument("--until", default=None, help="YYYY-MM-DD")
+    return parser.parse_args()
+
+#===============================================================================================
+#   Main
+#===============================================================================================
+def main():
+    FORMAT = '%(asctime)s @ %(levelname)s --- %(filename)s: %(message)s'
+    logging.basicConfig(format=FORMAT, stream=sys.stdout, level=logging.INFO)
+    args = parse_args()
+
+    with RunCatalog(args.catalog) as catalog:
+        for directory in args.index:
+            logger.info("Indexed %d data sets under %s" % (catalog.index_directory(directory), directory))
+
+        runs = catalog.query(experiment=args.experiment, scan_mode=args.scan_mode, status=args.status, temperature=args.temperature,
+                             integration_time=args.integration_time, since=args.since, until=args.until)
+
+    for run in runs:
+        temperatures = ", ".join("%g" % (t, ) for t in run['temperatures']) or "-"
+        integration_time = "%.2f s" % (run['integration_time'], ) if run['integration_time'] else "-"
+        print("%5d  %-19s  %-8s  %-22s  %-8s  T=%-12s  %8s  %5s rows  %s" % (run['id'], run['started'], run['status'], run['experiment'],
+                                                                          run['scan_mode'], temperatures, integration_time,
+                                                                          run['row_count'], run['data_path']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+#===============================================================================================
+#   Name:           MeasurementWriter.py
+#   Description:    Streaming, append-only binary measurement sink
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import os
+import time
+import json
+import numpy as np
+import pandas as pd
+import scipy.constants
+
+import logging
+logger = logging.getLogger(__name__)
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+# one row per delay point. raw_offset/raw_count locate the point's samples in the raw file
+SUMMARY_DTYPE = np.dtype([
+    ('index',       '<i4'),
+    ('position',    '<f8'),     # stage position [mm]
+    ('t',           '<f8'),     # delta time [sec]
+    ('x',           '<f8'),     # mean X [V]
+    ('x_err',       '<f8'),     # std X [V]
+    ('n_samples',   '<i4'),     # captured samples
+    ('n_eff',       '<f8'),     # effective independent samples (time constant correlation)
+    ('temperature', '<f8'),     # cryostat set point [K], NaN if not scanned
+    ('sweep',       '<i4'),     # repetition of the delay sweep
+    ('raw_offset',  '<i8'),
+    ('raw_count',   '<i4'),
+])
+
+# raw lock-in samples, every point's block is stored back to back
+RAW_DTYPE = np.dtype([
+    ('x',   '<f8'),
+    ('y',   '<f8'),
+    ('r',   '<f8'),
+])
+
+SUMMARY_SUFFIX = '.summary.bin'
+RAW_SUFFIX = '.raw.bin'
+META_SUFFIX = '.json'
+
+FLUSH_INTERVAL_IN_SEC = 10
+FLUSH_ROWS = 64
+
+#===============================================================================================
+#   MeasurementWriter
+#===============================================================================================
+class MeasurementWriter(object):
+    """
+    Keeps the data files of a measurement open and appends fixed-size summary rows and raw
+    sample blocks to them. Rows are buffered in memory and written in chunks once flush_rows
+    rows are pending or flush_interval_in_sec passed since the last flush.
+    The files are plain little-endian arrays (np.fromfile / np.memmap) described by a json sidecar.
+    """
+
+    def __init__(self, base_path, metadata=None, flush_interval_in_sec=FLUSH_INTERVAL_IN_SEC, flush_rows=FLUSH_ROWS, append=False):
+        super(MeasurementWriter, self).__init__()
+        self.base_path = base_path
+        self.metadata = metadata or {}
+        self.append_mode = append
+        self.flush_interval_in_sec = flush_interval_in_sec
+        self.flush_rows = flush_rows
+
+        self._summary_file = None
+        self._raw_file = None
+        self._rows = np.zeros(flush_rows, dtype=SUMMARY_DTYPE)
+        self._pending_rows = 0
+        self._raw_blocks = []
+        self._raw_offset = 0
+        self._last_flush_time = 0
+        self._listeners = []
+
+    @property
+    def is_open(self):
+        return self._summary_file is not None
+
+    def open(self, append=None):
+        """
+        Creates the data files, or with append adds to an existing data set of the same layout
+        """
+        append = self.append_mode if append is None else append
+        if append and summary_dtype(self.base_path) != SUMMARY_DTYPE:
+            raise ValueError("Can't append to %s - it was written with a different row layout." % (self.base_path, ))
+
+        mode = 'ab' if append else 'wb'
+        self._summary_file = open(self.base_path + SUMMARY_SUFFIX, mode)
+        self._raw_file = open(self.base_path + RAW_SUFFIX, mode)
+        self._raw_offset = self._raw_file.tell() // RAW_DTYPE.itemsize
+        self._last_flush_time = time.monotonic()
+
+        if not append:
+            self._write_metadata()
+
+    def add_listener(self, listener):
+        """
+        listener(row, samples) is called after every appended point. It runs on the appending thread and
+        row is reused once flushed - listeners copy what they keep and must not block.
+        """
+        self._listeners.append(listener)
+
+    def append(self, index, position, t, x, x_err, samples=None, n_samples=None, n_eff=np.nan, temperature=np.nan, sweep=0):
+        """
+        Adds one delay point. samples is the (x, y, r) arrays returned by capture_samples.
+        n_samples defaults to the number of raw samples.
+        """
+        row = self._rows[self._pending_rows]
+        row['index'] = index
+        row['position'] = position
+        row['t'] = t
+        row['x'] = x
+        row['x_err'] = x_err
+        row['n_samples'] = n_samples if n_samples is not None else (len(samples[0]) if samples is not None else 0)
+        row['n_eff'] = n_eff
+        row['temperature'] = temperature
+        row['sweep'] = sweep
+        row['raw_offset'] = self._raw_offset
+        row['raw_count'] = 0
+
+        if samples is not None:
+            samples_x, samples_y, samples_r = samples
+            block = np.empty(len(samples_x), dtype=RAW_DTYPE)
+            block['x'] = samples_x
+            block['y'] = samples_y
+            block['r'] = samples_r
+            self._raw_blocks.append(block)
+            self._raw_offset += len(block)
+            row['raw_count'] = len(block)
+
+        for listener in self._listeners:
+            listener(row, samples)
+
+        self._pending_rows += 1
+        if self._pending_rows >= self.flush_rows or time.monotonic() - self._last_flush_time >= self.flush_interval_in_sec:
+            self.flush()
+
+    def flush(self):
+        if not self.is_open:
+            return
+
+        self._rows[:self._pending_rows].tofile(self._summary_file)
+        for block in self._raw_blocks:
+            block.tofile(self._raw_file)
+        self._summary_file.flush()
+        self._raw_file.flush()
+
+        self._pending_rows = 0
+        self._raw_blocks = []
+        self._last_flush_time = time.monotonic()
+
+    def close(self):
+        if not self.is_open:
+            return
+
+        self.flush()
+        self._summary_file.close()
+        self._raw_file.close()
+        self._summary_file = None
+        self._raw_file = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write_metadata(self):
+        meta = {
+            'created'       :   time.strftime('%Y-%m-%d %H:%M:%S'),
+            'summary_dtype' :   SUMMARY_DTYPE.descr,
+            'raw_dtype'     :   RAW_DTYPE.descr,
+            'metadata'      :   self.metadata,
+        }
+        with open(self.base_path + META_SUFFIX, 'w') as f:
+            json.dump(meta, f, indent=4, default=str)
+
+#===============================================================================================
+#   Functions
+#===============================================================================================
+def load_metadata(base_path):
+    with open(base_path + META_SUFFIX, 'r') as f:
+        return json.load(f)
+
+def summary_dtype(base_path):
+    """
+    The summary row layout the data set was written with (older files have fewer columns)
+    """
+    return np.dtype([tuple(field) for field in load_metadata(base_path)['summary_dtype']])
+
+def load_summary(base_path, mmap=True):
+    path = base_path + SUMMARY_SUFFIX
+    dtype = summary_dtype(base_path)
+    if not os.path.getsize(path):
+        return np.zeros(0, dtype=dtype)
+    if mmap:
+        return np.memmap(path, dtype=dtype, mode='r')
+    return np.fromfile(path, dtype=dtype)
+
+def row_count(base_path):
+    """
+    Number of summary rows on disk, without reading them
+    """
+    return os.path.getsize(base_path + SUMMARY_SUFFIX) // summary_dtype(base_path).itemsize
+
+def load_raw(base_path, mmap=True):
+    path = base_path + RAW_SUFFIX
+    if not os.path.getsize(path):
+        return np.zeros(0, dtype=RAW_DTYPE)
+    if mmap:
+        return np.memmap(path, dtype=RAW_DTYPE, mode='r')
+    return np.fromfile(path, dtype=RAW_DTYPE)
+
+def raw_samples_of_row(raw, row):
+    """
+    Returns the raw sample block (view) of one summary row
+    """
+    return raw[row['raw_offset']:row['raw_offset'] + row['raw_count']]
+
+def truncate(base_path, rows):
+    """
+    Cuts the data set down to its first rows summary rows and their raw samples
+    (drops rows written after the last checkpoint and partially written rows)
+    """
+    summary = load_summary(base_path, mmap=False)[:rows]
+    raw_end = int(summary['raw_offset'][-1] + summary['raw_count'][-1]) if len(summary) else 0
+    with open(base_path + SUMMARY_SUFFIX, 'r+b') as f:
+        f.truncate(len(summary) * summary.dtype.itemsize)
+    with open(base_path + RAW_SUFFIX, 'r+b') as f:
+        f.truncate(raw_end * RAW_DTYPE.itemsize)
+
+def export_csv(base_path, csv_path):
+    """
+    Post-processing export of the summary to the csv layout the experiment scripts used to write
+    """
+    summary = load_summary(base_path, mmap=False)
+    columns = {
+        't'         :   summary['t'],
+        't_err'     :   '',
+        'DR'        :   summary['x'],
+        'DR err'    :   summary['x_err'],
+    }
+    if 'n_samples' in summary.dtype.names:
+        columns['N'] = summary['n_samples']
+        columns['N eff'] = summary['n_eff']
+    if 'temperature' in summary.dtype.names and np.isfinite(summary['temperature']).any():
+        columns['T'] = summary['temperature']
+
+    df = pd.DataFrame(columns)
+    df.to_csv(csv_path, index=False)
+
+def export_average_csv(csv_path, positions, averages):
+    """
+    Writes sweep averages in the experiment csv layout, one block of rows per (temperature, mean,
+    error, sweeps) in averages (temperature None - no T column). The file is replaced atomically,
+    so a reader (or a crash) never sees half an average.
+    """
+    t = np.asarray(positions) * 2 / scipy.constants.c
+    frames = []
+    for temperature, mean, error, sweeps in averages:
+        columns = {
+            't'         :   t,
+            't_err'     :   '',
+            'DR'        :   mean,
+            'DR err'    :   error,
+            'sweeps'    :   sweeps,
+        }
+        if temperature is not None:
+            columns['T'] = temperature
+        frames.append(pd.DataFrame(columns))
+
+    temp_path = csv_path + '.tmp'
+    pd.concat(frames, ignore_index=True).to_csv(temp_path, index=False)
+    os.replace(temp_path, csv_path)
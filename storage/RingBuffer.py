@@ -0,0 +1,145 @@
+#===============================================================================================
+#   Name:           RingBuffer.py
+#   Description:    Fixed-size in-memory ring of timestamped lock-in samples
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import threading
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+SAMPLE_FIELDS = ('t', 'x', 'y', 'r')     # t is a time.perf_counter timestamp
+DEFAULT_CAPACITY = 2 ** 20                  # samples, 32 MB for the four fields
+
+#===============================================================================================
+#   SampleRingBuffer
+#===============================================================================================
+class SampleRingBuffer(object):
+    """
+    Preallocated (fields, capacity) array written by a single producer thread. Samples are
+    addressed by a sequence number that keeps counting across wraps, so a consumer can tell
+    whether a range was already overwritten. Windows are returned as views into the ring -
+    they stay valid until capacity more samples are written, copy them to keep them longer.
+    Timestamps must increase. Appends copy under the condition lock and lookups search under it,
+    so a lookup never sees a block that is half written over the oldest samples.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, fields=SAMPLE_FIELDS):
+        super(SampleRingBuffer, self).__init__()
+        self.capacity = int(capacity)
+        self.fields = tuple(fields)
+        self._data = np.zeros((len(self.fields), self.capacity))
+        self._written = 0
+        self._condition = threading.Condition()
+
+    @property
+    def written(self):
+        """
+        Total number of samples appended (the sequence number of the next sample)
+        """
+        return self._written
+
+    @property
+    def oldest(self):
+        """
+        Sequence number of the oldest sample still held
+        """
+        return max(0, self._written - self.capacity)
+
+    def __len__(self):
+        return self._written - self.oldest
+
+    def append(self, block):
+        """
+        Appends a (fields, n) block, e.g. (t, x, y, r) arrays of equal length
+        """
+        block = np.asarray(block, dtype=float)
+        count = block.shape[1]
+        skipped = max(0, count - self.capacity)    # only the newest capacity samples fit, the rest still get sequence numbers
+        block = block[:, skipped:]
+
+        with self._condition:
+            start = (self._written + skipped) % self.capacity
+            first = min(count - skipped, self.capacity - start)
+            self._data[:, start:start + first] = block[:, :first]
+            self._data[:, :count - skipped - first] = block[:, first:]
+            self._written += count
+            self._condition.notify_all()
+
+    def views(self, start_seq, end_seq):
+        """
+        Returns the samples [start_seq, end_seq) as one or two (when wrapping) views.
+        Returns None if part of the range was already overwritten or not written yet.
+        """
+        with self._condition:
+            if start_seq < self.oldest or end_seq > self._written or start_seq > end_seq:
+                return None
+
+            start = start_seq % self.capacity
+            count = end_seq - start_seq
+            if start + count <= self.capacity:
+                return [self._data[:, start:start + count]]
+            return [self._data[:, start:], self._data[:, :start + count - self.capacity]]
+
+    def read(self, start_seq, end_seq):
+        """
+        Samples [start_seq, end_seq) as a single (fields, n) array - a view unless the range wraps
+        """
+        with self._condition:
+            views = self.views(start_seq, end_seq)
+            if views is None:
+                return None
+            return views[0] if len(views) == 1 else np.concatenate(views, axis=1)
+
+    def sequence_at(self, timestamp):
+        """
+        Sequence number of the first held sample at or after timestamp
+        """
+        with self._condition:
+            oldest, written = self.oldest, self._written
+            times = self.views(oldest, written)
+            if times is None:
+                return written
+
+            offset = 0
+            for view in times:
+                index = int(np.searchsorted(view[0], timestamp, side='left'))
+                if index < view.shape[1]:
+                    return oldest + offset + index
+                offset += view.shape[1]
+            return written
+
+    def window(self, start_time, end_time):
+        """
+        Samples with start_time <= t < end_time as a (fields, n) array, None if they were overwritten
+        """
+        with self._condition:
+            if self._written > self.capacity and self._data[0, self.oldest % self.capacity] > start_time:
+                logger.warning("Ring buffer window starting at %.3f was already overwritten." % (start_time, ))
+                return None
+            return self.read(self.sequence_at(start_time), self.sequence_at(end_time))
+
+    def latest_time(self):
+        with self._condition:
+            if not self._written:
+                return None
+            return self._data[0, (self._written - 1) % self.capacity]
+
+    def wait_for_time(self, timestamp, timeout=None):
+        """
+        Blocks until a sample at or after timestamp was appended. Returns False on timeout.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self.latest_time() is not None and self.latest_time() >= timestamp, timeout)
@@ -0,0 +1,79 @@
+#===============================================================================================
+#   Name:           conftest.py
+#   Description:    Shared fixtures - fast simulated devices and fresh telemetry
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import pytest
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import devices.Simulated as Simulated
+import devices.Telemetry as Telemetry
+import scans.Experiment as Experiment
+import storage.Catalog as Catalog
+import PumpProbe_Galium_300K as PumpProbe
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+LOCATIONS_IN_MM = np.linspace(0.3, -0.3, 5)
+SAMPLES_PER_LOC = 20
+CAPTURE_DURATION_IN_SEC = 0.05
+
+#===============================================================================================
+#   Fixtures
+#===============================================================================================
+@pytest.fixture(autouse=True)
+def metrics():
+    Telemetry.METRICS.reset()
+    yield Telemetry.METRICS
+
+@pytest.fixture
+def stage():
+    stage_dev = Simulated.SimulatedStandaDevice(command_latency=0, connect_latency=0, velocity=50.0, acceleration=1000.0)
+    stage_dev.connect()
+    yield stage_dev
+    stage_dev.close()
+
+@pytest.fixture
+def lockin(stage):
+    lockin_dev = Simulated.SimulatedSR860Device(stage=stage, connect_latency=0, command_latency=0)
+    lockin_dev.connect()
+    yield lockin_dev
+    lockin_dev.close()
+
+@pytest.fixture
+def cryostat():
+    cryostat_dev = Simulated.SimulatedCryostatDevice(command_latency=0, thermal_time_constant=1e-6, noise=0)     # reaches every set point at once
+    cryostat_dev.connect()
+    yield cryostat_dev
+    cryostat_dev.close()
+
+@pytest.fixture
+def experiment():
+    """
+    A small simulated step scan, change its settings per test
+    """
+    return Experiment.ExperimentDefinition(name='test', experiment='test', scan_mode='step', locations_in_mm=LOCATIONS_IN_MM,
+                                           samples_per_loc=SAMPLES_PER_LOC, capture_duration_in_sec=CAPTURE_DURATION_IN_SEC,
+                                           capture_mode='buffer', outlier_factor=3.0, devices=Experiment.SIMULATED_DEVICES)
+
+@pytest.fixture
+def run_scan(lockin, stage, tmp_path):
+    """
+    run_scan(experiment, cryostat=None, **kwargs) - runs the experiment on the simulated lock-in and stage into tmp_path.
+    Returns the run_experiment result and the catalog runs.
+    """
+    def run(experiment, cryostat=None, **kwargs):
+        with Catalog.RunCatalog(str(tmp_path / 'catalog.sqlite')) as catalog:
+            result = PumpProbe.run_experiment(lockin, stage, cryostat, experiment, catalog, data_path=str(tmp_path / 'run'), **kwargs)
+            return result, catalog.query()
+
+    return run
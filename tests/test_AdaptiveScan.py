@@ -0,0 +1,73 @@
+#===============================================================================================
+#   Name:           test_AdaptiveScan.py
+#   Description:    Interval scoring and refinement order of the adaptive delay grid
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import pytest
+import numpy as np
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import scans.AdaptiveScan as AdaptiveScan
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+EDGE_IN_MM = 0.33
+
+#===============================================================================================
+#   Tests
+#===============================================================================================
+def test_scores_of_a_line_are_its_changes():
+    positions = np.array([0.0, 1.0, 2.0, 4.0])
+    scores = AdaptiveScan.interval_scores(positions, 3 * positions, np.zeros(4))
+    np.testing.assert_allclose(scores, [3.0, 3.0, 6.0])
+
+def test_curvature_raises_the_score():
+    positions = np.array([0.0, 1.0, 2.0])
+    flat = AdaptiveScan.interval_scores(positions, [0.0, 1.0, 2.0], np.zeros(3))
+    curved = AdaptiveScan.interval_scores(positions, [0.0, 1.0, 0.0], np.zeros(3))
+    assert (curved > flat - 1e-12).all()
+    np.testing.assert_allclose(curved, 1.0 + 2.0 / 8)
+
+def test_changes_within_the_noise_score_zero():
+    scores = AdaptiveScan.interval_scores([0.0, 1.0, 2.0, 3.0], [0.0, 0.1, 0.2, 5.0], [0.1, 0.1, 0.1, 0.1])
+    assert scores[0] == 0 and scores[2] > 0
+
+def test_next_position_splits_the_biggest_change():
+    positions = [1.0, 0.0, 3.0, 2.0]                  # any order
+    values = [0.0, 0.0, 1.0, 1.0]
+    assert AdaptiveScan.next_position(positions, values, np.zeros(4), current_position=0.0) == 1.5
+
+def test_next_position_prefers_the_nearer_interval():
+    positions, values = [0.0, 1.0, 2.0, 3.0], [0.0, 1.0, 1.0, 2.0]
+    assert AdaptiveScan.next_position(positions, values, np.zeros(4), current_position=0.0, stage_speed=0.1) == 0.5
+    assert AdaptiveScan.next_position(positions, values, np.zeros(4), current_position=3.0, stage_speed=0.1) == 2.5
+
+def test_nothing_worth_splitting():
+    positions = [0.0, 1.0, 2.0]
+    assert AdaptiveScan.next_position(positions, [0.0, 0.01, 0.0], [0.1, 0.1, 0.1], current_position=0.0) is None
+    assert AdaptiveScan.next_position([0.0, 0.015], [0.0, 1.0], [0.0, 0.0], current_position=0.0, resolution=0.01) is None
+
+def test_adaptive_scan_refines_around_the_edge():
+    measured = []
+
+    def measure(index, position):
+        measured.append(index)
+        return float(position > EDGE_IN_MM), 0.01
+
+    positions, values, errors = AdaptiveScan.adaptive_scan(measure, 0.0, 1.0, coarse_points=11, max_points=40, resolution=0.001)
+    assert measured == list(range(len(positions)))
+    refined = positions[11:]
+    assert len(refined) > 0
+    assert np.all(np.abs(refined - EDGE_IN_MM) < 0.1)
+    assert np.min(np.abs(positions - EDGE_IN_MM)) < 0.002
+
+def test_adaptive_scan_stops_when_converged():
+    positions, _, _ = AdaptiveScan.adaptive_scan(lambda index, position: (2 * position, 0.0), 0.0, 1.0, coarse_points=5, max_points=100,
+                                                 resolution=0.2)
+    assert len(positions) == 5
@@ -0,0 +1,64 @@
+#===============================================================================================
+#   Name:           test_Attodry.py
+#   Description:    CryostatDevice against an AttodryWin32 --stand-in worker
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import os, sys
+import pytest
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import devices.Attodry as Attodry
+import devices.AutoLabDevice as AutoLabDevice
+import PumpProbe_Galium_300K as PumpProbe
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+WORKER_PATH = os.path.join(os.path.dirname(Attodry.__file__), 'AttodryWin32.py')
+
+#===============================================================================================
+#   Fixtures
+#===============================================================================================
+@pytest.fixture
+def stand_in_cryostat():
+    cryostat_dev = Attodry.CryostatDevice(python_path=sys.executable, worker_path=WORKER_PATH, worker_args=['--stand-in'])
+    cryostat_dev.connect()
+    yield cryostat_dev
+    cryostat_dev.close()
+
+#===============================================================================================
+#   Tests
+#===============================================================================================
+def test_stand_in_round_trip(stand_in_cryostat):
+    assert stand_in_cryostat.is_connected
+    assert isinstance(stand_in_cryostat.get_temperature(), float)
+    assert stand_in_cryostat.set_temperature(280.0)
+    assert stand_in_cryostat.get_status() is not None
+
+def test_requests_are_timed(stand_in_cryostat, metrics):
+    stand_in_cryostat.get_temperature()
+    assert metrics.histogram('attodry.get_temperature').count == 1
+    assert 'attodry.get_temperature.errors' not in metrics.snapshot()['counters']
+
+def test_unknown_request_fails_without_killing_the_worker(stand_in_cryostat, metrics):
+    assert stand_in_cryostat._request('no_such_command') is None
+    assert metrics.snapshot()['counters']['attodry.no_such_command.errors'] == 1
+    assert stand_in_cryostat.get_temperature() is not None
+
+def test_close_stops_the_worker(stand_in_cryostat):
+    worker = stand_in_cryostat._worker
+    stand_in_cryostat.close()
+    assert not worker.is_running
+    assert not stand_in_cryostat.is_connected
+
+def test_missing_interpreter_is_a_driver_load_error():
+    cryostat_dev = Attodry.CryostatDevice(python_path='/nonexistent/python', worker_path=WORKER_PATH)
+    with pytest.raises(AutoLabDevice.DriverLoadError):
+        cryostat_dev.connect()
+    assert not cryostat_dev.is_connected
+    assert PumpProbe.connect_devices(cryostat_dev) is False
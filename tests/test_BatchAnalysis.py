@@ -0,0 +1,118 @@
+#===============================================================================================
+#   Name:           test_BatchAnalysis.py
+#   Description:    Recovering known time constants from synthetic pump-probe scans
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import pytest
+import numpy as np
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import analysis.BatchAnalysis as BatchAnalysis
+import storage.MeasurementWriter as MeasurementWriter
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+TIME_ZERO_IN_PS = 1.0
+SIGMA_IN_PS = 0.15
+TAUS_IN_PS = [0.8, 8.0]
+AMPLITUDES = [2e-4, 1e-4]
+PLATEAU = 2e-5
+BASELINE = 5e-6
+NOISE = 1e-7
+DELAY_IN_PS = np.concatenate([np.linspace(-3, 3, 61), np.linspace(3.2, 40, 60)])
+
+#===============================================================================================
+#   Helpers
+#===============================================================================================
+def synthetic_signal(delay, seed=0, baseline=BASELINE):
+    signal = BatchAnalysis.design_matrix(delay, TIME_ZERO_IN_PS, SIGMA_IN_PS, TAUS_IN_PS) @ np.array(AMPLITUDES + [PLATEAU])
+    return signal + baseline + np.random.default_rng(seed).normal(0, NOISE, len(delay))
+
+def synthetic_scan(seed=0, temperature=np.nan):
+    position = DELAY_IN_PS / BatchAnalysis.PS_PER_MM / BatchAnalysis.DELAY_SIGN
+    return BatchAnalysis.DelayScan(position, synthetic_signal(DELAY_IN_PS, seed), np.full(len(position), NOISE), 'synthetic', temperature=temperature)
+
+def write_data_set(base_path, temperatures=(10.0, 100.0), sweeps=2):
+    position = DELAY_IN_PS / BatchAnalysis.PS_PER_MM / BatchAnalysis.DELAY_SIGN
+    with MeasurementWriter.MeasurementWriter(base_path) as writer:
+        index = 0
+        for temperature in temperatures:
+            for sweep in range(sweeps):
+                for loc, x in zip(position, synthetic_signal(DELAY_IN_PS, seed=index)):
+                    writer.append(index, loc, 0.0, x, NOISE * 10, n_samples=100, temperature=temperature, sweep=sweep)
+                    index += 1
+
+#===============================================================================================
+#   Tests
+#===============================================================================================
+def test_exponential_response_limits():
+    late = np.array([20.0, 30.0])
+    np.testing.assert_allclose(BatchAnalysis.exponential_response(late, 0.0, 0.1, 10.0), np.exp(-late / 10.0), rtol=1e-3)
+    assert BatchAnalysis.exponential_response(0.0, 0.0, 0.1, np.inf) == pytest.approx(0.5)
+    assert BatchAnalysis.exponential_response(-5.0, 0.0, 0.1, 1.0) == pytest.approx(0.0, abs=1e-12)
+    assert np.isfinite(BatchAnalysis.exponential_response(np.linspace(-50, 50, 11), 0.0, 0.01, 0.01)).all()
+
+def test_time_zero_and_baseline():
+    signals = np.array([synthetic_signal(DELAY_IN_PS, seed) for seed in range(3)])
+    time_zero = BatchAnalysis.find_time_zero(DELAY_IN_PS, signals)
+    np.testing.assert_allclose(time_zero, TIME_ZERO_IN_PS, atol=0.1)
+
+    corrected, baseline = BatchAnalysis.subtract_baseline(DELAY_IN_PS, signals, time_zero)
+    np.testing.assert_allclose(baseline, BASELINE, atol=5 * NOISE)
+    assert abs(corrected[:, DELAY_IN_PS < -1].mean()) < NOISE
+
+def test_initial_time_constants_are_near_the_truth():
+    signals = np.array([synthetic_signal(DELAY_IN_PS, seed, baseline=0) for seed in range(2)])
+    weights = np.full(signals.shape, 1 / NOISE)
+    taus = BatchAnalysis.initial_time_constants(DELAY_IN_PS, signals, weights, np.full(2, TIME_ZERO_IN_PS), sigma=SIGMA_IN_PS)
+
+    grid_step = BatchAnalysis.TAU_GRID_IN_PS[1] / BatchAnalysis.TAU_GRID_IN_PS[0]
+    assert taus.shape == (2, 2)
+    assert np.all(np.abs(np.log(taus / TAUS_IN_PS)) <= np.log(grid_step) * 1.5)
+
+def test_fit_scan_recovers_the_time_constants():
+    signal = synthetic_signal(DELAY_IN_PS, baseline=0)
+    fit = BatchAnalysis.fit_scan(DELAY_IN_PS, signal, np.full(len(signal), 1 / NOISE), TIME_ZERO_IN_PS + 0.05, [0.5, 12.0])
+
+    assert fit['converged']
+    assert fit['tau_1_ps'] == pytest.approx(TAUS_IN_PS[0], rel=0.02)
+    assert fit['tau_2_ps'] == pytest.approx(TAUS_IN_PS[1], rel=0.02)
+    assert fit['amplitude_1'] == pytest.approx(AMPLITUDES[0], rel=0.02)
+    assert fit['plateau'] == pytest.approx(PLATEAU, rel=0.05)
+    assert fit['time_zero_ps'] == pytest.approx(TIME_ZERO_IN_PS, abs=0.01)
+    assert fit['sigma_ps'] == pytest.approx(SIGMA_IN_PS, rel=0.05)
+    assert fit['chi2_reduced'] == pytest.approx(1.0, rel=0.5)
+
+def test_analyze_scans_end_to_end():
+    rows = BatchAnalysis.analyze_scans([synthetic_scan(seed, temperature) for seed, temperature in enumerate([10.0, 50.0])])
+    assert [row['temperature'] for row in rows] == [10.0, 50.0]
+    for row in rows:
+        assert row['error'] is None
+        assert row['tau_1_ps'] == pytest.approx(TAUS_IN_PS[0], rel=0.05)
+        assert row['tau_2_ps'] == pytest.approx(TAUS_IN_PS[1], rel=0.05)
+        assert row['baseline'] == pytest.approx(BASELINE, abs=5 * NOISE)
+
+def test_load_scans_averages_the_sweeps(tmp_path):
+    write_data_set(str(tmp_path / 'run'))
+    scans = BatchAnalysis.load_scans(str(tmp_path / 'run'), run_id=7)
+    assert [scan.temperature for scan in scans] == [10.0, 100.0]
+    assert all(len(scan.position) == len(DELAY_IN_PS) and scan.run_id == 7 for scan in scans)
+    # two sweeps of error NOISE * 10 / sqrt(100) each
+    np.testing.assert_allclose(scans[0].error, NOISE / np.sqrt(2))
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_analyze_batch(tmp_path, workers):
+    paths = [str(tmp_path / 'first'), str(tmp_path / 'second')]
+    for path in paths:
+        write_data_set(path, temperatures=(10.0, ), sweeps=1)
+
+    summary = BatchAnalysis.analyze_batch(paths + [str(tmp_path / 'missing')], run_ids=[1, 2, 3], workers=workers)
+    assert list(summary['run_id']) == [1, 2, 3]
+    np.testing.assert_allclose(summary['tau_2_ps'][:2], TAUS_IN_PS[1], rtol=0.05)
+    assert summary['error'][:2].isna().all() and summary['error'][2]
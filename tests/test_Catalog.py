@@ -0,0 +1,114 @@
+#===============================================================================================
+#   Name:           test_Catalog.py
+#   Description:    Run catalog registration, queries and indexing of existing data sets
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import os
+import pytest
+import numpy as np
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import storage.Catalog as Catalog
+import storage.MeasurementWriter as MeasurementWriter
+
+#===============================================================================================
+#   Helpers
+#===============================================================================================
+def metadata(experiment='ga', scan_mode='step', samples_per_loc=300, sample_frequency=100.0, locations=(1.0, -1.0, 0.0)):
+    return {'experiment': experiment, 'scan_mode': scan_mode, 'samples_per_loc': samples_per_loc, 'sample_frequency': sample_frequency,
+            'locations_in_mm': list(locations)}
+
+def write_data_set(base_path, rows=3, **settings):
+    os.makedirs(os.path.dirname(base_path), exist_ok=True)
+    with MeasurementWriter.MeasurementWriter(base_path, metadata=metadata(**settings)) as writer:
+        for index in range(rows):
+            writer.append(index, float(index), 0.0, 1.0, 0.1, samples=(np.ones(5), np.zeros(5), np.ones(5)))
+
+#===============================================================================================
+#   Fixtures
+#===============================================================================================
+@pytest.fixture
+def catalog(tmp_path):
+    with Catalog.RunCatalog(str(tmp_path / 'catalog.sqlite')) as run_catalog:
+        yield run_catalog
+
+#===============================================================================================
+#   Tests
+#===============================================================================================
+def test_register_stores_the_run_columns(catalog, tmp_path):
+    run_id = catalog.register(str(tmp_path / 'run'), metadata(), temperatures=[300.0, 10.0])
+    run = catalog.get(run_id)
+
+    assert run['data_path'] == os.path.abspath(str(tmp_path / 'run'))
+    assert run['status'] == Catalog.STATUS_RUNNING
+    assert run['integration_time'] == pytest.approx(3.0)
+    assert (run['position_min'], run['position_max'], run['position_count']) == (-1.0, 1.0, 3)
+    assert run['temperatures'] == [10.0, 300.0]
+    assert run['metadata']['scan_mode'] == 'step'
+
+def test_registering_a_known_path_updates_it(catalog, tmp_path):
+    run_id = catalog.register(str(tmp_path / 'run'), metadata(), temperatures=[10.0], started='2026-01-01 10:00:00')
+    catalog.finish(run_id, status=Catalog.STATUS_FAILED, row_count=2)
+
+    assert catalog.register(str(tmp_path / 'run'), metadata(samples_per_loc=600), temperatures=[20.0]) == run_id
+    run = catalog.get(run_id)
+    assert run['status'] == Catalog.STATUS_RUNNING
+    assert run['started'] == '2026-01-01 10:00:00'
+    assert run['samples_per_loc'] == 600 and run['temperatures'] == [20.0]
+    assert len(catalog.query()) == 1
+
+def test_query_criteria(catalog, tmp_path):
+    cold = catalog.register(str(tmp_path / 'cold'), metadata(), temperatures=[10.0, 50.0], started='2026-01-01 10:00:00')
+    fly = catalog.register(str(tmp_path / 'fly'), metadata(scan_mode='fly', samples_per_loc=100), started='2026-01-02 10:00:00')
+    other = catalog.register(str(tmp_path / 'other'), metadata(experiment='si'), temperatures=[300.0], started='2026-01-03 10:00:00')
+    catalog.finish(fly, row_count=0)
+
+    def ids(**criteria):
+        return [run['id'] for run in catalog.query(**criteria)]
+
+    assert ids() == [cold, fly, other]
+    assert ids(experiment='ga') == [cold, fly]
+    assert ids(scan_mode='fly') == [fly]
+    assert ids(status=Catalog.STATUS_RUNNING) == [cold, other]
+    assert ids(temperature=50.05) == [cold]
+    assert ids(temperature=49.0) == []
+    assert ids(integration_time=3.0 * (1 + Catalog.RELATIVE_TOLERANCE / 2)) == [cold, other]
+    assert ids(since='2026-01-02', until='2026-01-03') == [fly]
+    assert ids(limit=1) == [cold]
+    assert catalog.latest('ga')['id'] == fly
+    assert catalog.latest('ga', unfinished=True)['id'] == cold
+
+    catalog.remove(cold)
+    assert ids() == [fly, other]
+
+def test_index_directory(catalog, tmp_path):
+    write_data_set(str(tmp_path / 'data' / 'first'))
+    write_data_set(str(tmp_path / 'data' / 'nested' / 'second'), rows=5, scan_mode='adaptive')
+    os.remove(str(tmp_path / 'data' / 'first') + MeasurementWriter.META_SUFFIX)        # no sidecar - not a data set
+    write_data_set(str(tmp_path / 'data' / 'third'))
+
+    assert catalog.index_directory(str(tmp_path / 'data')) == 2
+    runs = {os.path.basename(run['data_path']): run for run in catalog.query()}
+    assert sorted(runs) == ['second', 'third']
+    assert runs['second']['status'] == Catalog.STATUS_FINISHED
+    assert runs['second']['row_count'] == 5 and runs['second']['scan_mode'] == 'adaptive'
+
+    # indexing again updates the runs instead of adding them twice
+    assert catalog.index_directory(str(tmp_path / 'data')) == 2
+    assert len(catalog.query()) == 2
+
+def test_load_summaries(catalog, tmp_path):
+    write_data_set(str(tmp_path / 'first'), rows=2)
+    write_data_set(str(tmp_path / 'second'), rows=3)
+    catalog.index_data_set(str(tmp_path / 'first'))
+    catalog.index_data_set(str(tmp_path / 'second'))
+    catalog.register(str(tmp_path / 'missing'), metadata())
+
+    frame = Catalog.load_summaries(catalog.query(), fields=['position', 'x'])
+    assert list(frame.columns) == ['run_id', 'position', 'x']
+    assert list(frame.groupby('run_id').size()) == [2, 3]
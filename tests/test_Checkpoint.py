@@ -0,0 +1,84 @@
+#===============================================================================================
+#   Name:           test_Checkpoint.py
+#   Description:    Resuming interrupted simulated scans from their checkpoint
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import pytest
+import numpy as np
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import PumpProbe_Galium_300K as PumpProbe
+import scans.Checkpoint as Checkpoint
+import storage.Catalog as Catalog
+import storage.MeasurementWriter as MeasurementWriter
+
+#===============================================================================================
+#   Helpers
+#===============================================================================================
+class Interrupted(Exception):
+    pass
+
+def fail_after_moves(stage, moves):
+    """
+    Makes the stage raise Interrupted on its moves+1'th move, like a scan killed mid run
+    """
+    move_stage = stage.move_stage
+    done = []
+
+    def failing_move(*args, **kwargs):
+        if len(done) == moves:
+            raise Interrupted()
+        done.append(args[0])
+        return move_stage(*args, **kwargs)
+
+    stage.move_stage = failing_move
+    return lambda: setattr(stage, 'move_stage', move_stage)
+
+#===============================================================================================
+#   Tests
+#===============================================================================================
+def test_step_scan_without_checkpoint(lockin, stage, experiment, tmp_path):
+    PumpProbe.configure_lockin(lockin, experiment)
+    with MeasurementWriter.MeasurementWriter(str(tmp_path / 'run')) as writer:
+        positions, measurements_x, _ = PumpProbe.run_step_scan(lockin, stage, experiment.locations_in_mm, writer, samples_count=10)
+
+    np.testing.assert_allclose(positions, experiment.locations_in_mm)
+    assert np.isfinite(measurements_x).all()
+
+def test_resume_measures_only_the_missing_points(stage, experiment, tmp_path, run_scan):
+    restore = fail_after_moves(stage, 3)
+    with pytest.raises(Interrupted):
+        run_scan(experiment)
+    restore()
+
+    data_path = str(tmp_path / 'run')
+    checkpoint = Checkpoint.load_checkpoint(data_path)
+    assert not checkpoint.finished
+    assert len(checkpoint.completed) == 3
+
+    moves = []
+    move_stage = stage.move_stage
+    stage.move_stage = lambda position, *args, **kwargs: moves.append(position) or move_stage(position, *args, **kwargs)
+    (_, _, measurements_x, _), runs = run_scan(experiment, resume=True)
+
+    assert len(moves) == len(experiment.locations_in_mm) - 3
+    summary = MeasurementWriter.load_summary(data_path, mmap=False)
+    assert sorted(summary['index']) == list(range(len(experiment.locations_in_mm)))
+    assert np.isfinite(measurements_x).all()
+    assert Checkpoint.load_checkpoint(data_path).finished
+    assert [run['status'] for run in runs] == [Catalog.STATUS_FINISHED]
+
+def test_resume_refuses_a_changed_configuration(stage, experiment, run_scan):
+    restore = fail_after_moves(stage, 1)
+    with pytest.raises(Interrupted):
+        run_scan(experiment)
+    restore()
+
+    experiment.samples_per_loc *= 2
+    (data_path, _, measurements_x, _), _ = run_scan(experiment, resume=True)
+    assert data_path is None and measurements_x is None
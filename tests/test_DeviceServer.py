@@ -0,0 +1,117 @@
+#===============================================================================================
+#   Name:           test_DeviceServer.py
+#   Description:    DeviceServer / RemoteDevice loopback and the server key
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import os
+import asyncio
+import pytest
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import devices.DeviceServer as DeviceServer
+import devices.Simulated as Simulated
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+SERVER_KEY = b'test server key'
+
+#===============================================================================================
+#   Fixtures
+#===============================================================================================
+@pytest.fixture
+def server(monkeypatch):
+    # the simulated devices the server creates connect without their start-up latencies
+    monkeypatch.setattr(Simulated, 'STAGE_CONNECT_LATENCY_IN_SEC', 0)
+    monkeypatch.setattr(Simulated.SimulatedStandaDevice.__init__, '__defaults__',
+                        (0, 0) + Simulated.SimulatedStandaDevice.__init__.__defaults__[2:])
+    monkeypatch.setattr(Simulated.SimulatedSR860Device.__init__, '__defaults__', (None, 'buffer', 0))
+
+    device_server = DeviceServer.DeviceServer(('127.0.0.1', 0), authkey=SERVER_KEY)
+    device_server.start()
+    yield device_server
+    device_server.close()
+
+def remote(server, name, *args, **kwargs):
+    return DeviceServer.RemoteDevice(name, *args, address=server.address, authkey=SERVER_KEY, **kwargs)
+
+#===============================================================================================
+#   Tests
+#===============================================================================================
+def test_remote_calls_run_on_the_server_device(server):
+    stage = remote(server, 'simulated_standa')
+    stage.connect()
+    try:
+        assert stage.is_connected
+        stage.move_stage(0.2)
+        assert stage.get_position() == pytest.approx(0.2, abs=1e-3)
+        assert server.devices['simulated_standa'].position == pytest.approx(0.2, abs=1e-3)
+        assert asyncio.run(stage.get_position_async()) == pytest.approx(0.2, abs=1e-3)
+
+        stage.velocity = 7.0
+        assert server.devices['simulated_standa'].velocity == 7.0
+        with pytest.raises(AttributeError):
+            stage.no_such_attribute
+    finally:
+        stage.close()
+
+def test_device_stays_open_between_scripts(server):
+    stage = remote(server, 'simulated_standa')
+    stage.connect()
+    stage.close()
+    assert server.devices['simulated_standa'].is_connected
+
+    stage = remote(server, 'simulated_standa')
+    stage.connect()
+    assert stage.is_connected
+    stage.close()
+
+def test_stream_capture_through_the_server(server):
+    stage = remote(server, 'simulated_standa')
+    lockin = remote(server, 'simulated_sr860', stage=stage)
+    stage.connect()
+    lockin.connect()
+    try:
+        # the lock-in refers to the server's own stage, and stream captures do not deadlock on its device lock
+        assert server.devices['simulated_sr860'].stage is server.devices['simulated_standa']
+        lockin.capture_mode = 'stream'
+        lockin.calc_capture_freq(100)
+        x, y, r = lockin.capture_samples(10)
+        assert len(x) > 0
+    finally:
+        server.devices['simulated_sr860'].stop_stream()
+        lockin.close()
+        stage.close()
+
+def test_wrong_key_is_refused(server):
+    stage = DeviceServer.RemoteDevice('simulated_standa', address=server.address, authkey=b'wrong key')
+    with pytest.raises(DeviceServer.RemoteDeviceError):
+        stage.connect()
+
+    # the server keeps accepting clients with the right key
+    stage = remote(server, 'simulated_standa')
+    stage.connect()
+    assert stage.is_connected
+    stage.close()
+
+def test_server_key_file(tmp_path, monkeypatch):
+    monkeypatch.delenv(DeviceServer.SERVER_KEY_ENV, raising=False)
+    path = str(tmp_path / 'server_key')
+    with pytest.raises(DeviceServer.RemoteDeviceError):
+        DeviceServer.server_key(path=path)
+
+    key = DeviceServer.server_key(create=True, path=path)
+    assert len(key) == 2 * DeviceServer.SERVER_KEY_BYTES
+    assert DeviceServer.server_key(path=path) == key
+    if os.name == 'posix':
+        os.chmod(path, 0o644)
+        with pytest.raises(DeviceServer.RemoteDeviceError):
+            DeviceServer.server_key(path=path)
+
+    monkeypatch.setenv(DeviceServer.SERVER_KEY_ENV, 'from environment')
+    assert DeviceServer.server_key(path=path) == b'from environment'
@@ -0,0 +1,85 @@
+#===============================================================================================
+#   Name:           test_Experiment.py
+#   Description:    Queue files and the order a queue runs in
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import json
+import pytest
+import numpy as np
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import scans.Experiment as Experiment
+
+#===============================================================================================
+#   Helpers
+#===============================================================================================
+def definition(name, temperatures=None, **settings):
+    return Experiment.ExperimentDefinition(name=name, temperatures=temperatures, devices=Experiment.SIMULATED_DEVICES, **settings)
+
+def names(experiments):
+    return [experiment.name for experiment in experiments]
+
+#===============================================================================================
+#   Tests
+#===============================================================================================
+def test_ambient_experiments_run_first():
+    queue = [definition('cold', [10.0]), definition('ambient 1'), definition('warm', [200.0]), definition('ambient 2')]
+    assert names(Experiment.order_queue(queue)) == ['ambient 1', 'ambient 2', 'cold', 'warm']
+
+def test_one_monotonic_temperature_pass():
+    queue = [definition('mid', [150.0, 100.0]), definition('hot', [250.0]), definition('cold', [50.0, 10.0])]
+    ordered = Experiment.order_queue(queue)
+    assert names(ordered) == ['cold', 'mid', 'hot']
+    assert [experiment.temperatures for experiment in ordered] == [[10.0, 50.0], [100.0, 150.0], [250.0]]
+
+def test_pass_starts_at_the_end_nearest_the_cryostat():
+    queue = [definition('cold', [10.0, 50.0]), definition('hot', [250.0]), definition('mid', [100.0, 150.0])]
+    ordered = Experiment.order_queue(queue, current_temperature=290.0)
+    assert names(ordered) == ['hot', 'mid', 'cold']
+    assert ordered[2].temperatures == [50.0, 10.0]
+    assert names(Experiment.order_queue(queue, current_temperature=20.0)) == ['cold', 'mid', 'hot']
+
+def test_ties_group_lockin_settings_then_run_shorter_first():
+    queue = [definition('a long', samples_per_loc=100), definition('b', samples_per_loc=500), definition('a short', samples_per_loc=100)]
+    assert names(Experiment.order_queue(queue)) == ['a long', 'a short', 'b']
+    assert names(Experiment.order_queue(queue, durations=[60.0, 1.0, 30.0])) == ['a short', 'a long', 'b']
+
+    cooled = [definition('long', [100.0]), definition('short', [100.0])]
+    assert names(Experiment.order_queue(cooled, durations=[60.0, 30.0])) == ['short', 'long']
+
+def test_order_queue_leaves_the_definitions_alone():
+    queue = [definition('cold', [50.0, 10.0]), definition('hot', [250.0, 200.0])]
+    ordered = Experiment.order_queue(queue)
+    assert ordered[0].temperatures == [10.0, 50.0]
+    assert queue[0].temperatures == [50.0, 10.0] and queue[1].temperatures == [250.0, 200.0]
+
+    order, descending = Experiment.queue_order(queue, current_temperature=300.0)
+    assert order == [1, 0] and descending
+
+def test_load_queue_merges_the_defaults(tmp_path):
+    path = str(tmp_path / 'queue.json')
+    with open(path, 'w') as f:
+        json.dump({
+            'defaults'      :   {'samples_per_loc': 200, 'devices': {'cryostat': 'simulated_attodry'}},
+            'experiments'   :   [
+                {'name': 'fine', 'locations_in_mm': {'start': 1, 'stop': -1, 'num': 5}, 'samples_per_loc': None},
+                {'name': 'series', 'temperatures': [10, 50], 'samples_per_loc': 600, 'devices': {'lockin': 'simulated_sr860'}},
+            ],
+        }, f)
+
+    fine, series = Experiment.load_queue(path, defaults={'scan_mode': 'step', 'devices': dict(Experiment.DEFAULT_DEVICES)})
+    np.testing.assert_allclose(fine.locations_in_mm, [1.0, 0.5, 0.0, -0.5, -1.0])
+    assert fine.samples_per_loc == 200 and fine.scan_mode == 'step'
+    assert fine.devices == {'lockin': 'sr860', 'stage': 'standa', 'cryostat': 'simulated_attodry'}
+    assert series.samples_per_loc == 600 and series.temperatures == [10, 50]
+    assert series.devices['lockin'] == 'simulated_sr860' and series.devices['stage'] == 'standa'
+    assert not fine.uses_cryostat and series.uses_cryostat
+
+def test_unknown_setting_is_refused():
+    with pytest.raises(ValueError, match='sample_per_loc'):
+        Experiment.ExperimentDefinition.from_dict({'name': 'typo', 'sample_per_loc': 10})
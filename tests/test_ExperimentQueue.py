@@ -0,0 +1,104 @@
+#===============================================================================================
+#   Name:           test_ExperimentQueue.py
+#   Description:    Queue runs on a pool of fast simulated devices and the temperatures they catalog
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import copy
+import pytest
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import ExperimentQueue
+import PumpProbe_Galium_300K as PumpProbe
+import devices.AutoLabDevice as AutoLabDevice
+import devices.Simulated as Simulated
+import storage.Catalog as Catalog
+import storage.MeasurementWriter as MeasurementWriter
+
+#===============================================================================================
+#   Helpers
+#===============================================================================================
+class MissingDriverDevice(AutoLabDevice.AutoLabDevice):
+    """
+    A device whose connect fails with something other than AutoLabDeviceError
+    """
+
+    def connect(self):
+        raise FileNotFoundError("no such interpreter")
+
+class FastDevicePool(ExperimentQueue.DevicePool):
+    """
+    DevicePool creating latency free simulated devices
+    """
+
+    FACTORIES = {
+        'simulated_standa'      :   lambda: Simulated.SimulatedStandaDevice(command_latency=0, connect_latency=0, velocity=50.0, acceleration=1000.0),
+        'simulated_sr860'       :   lambda stage: Simulated.SimulatedSR860Device(stage=stage, connect_latency=0, command_latency=0),
+        'simulated_attodry'     :   lambda: Simulated.SimulatedCryostatDevice(command_latency=0, thermal_time_constant=1e-6, noise=0),
+        'missing'               :   MissingDriverDevice,
+    }
+
+    def create_device(self, name, *args, **kwargs):
+        if name not in self.devices:
+            self.devices[name] = self.FACTORIES[name](*args, **kwargs)
+        return self.devices[name]
+
+#===============================================================================================
+#   Fixtures
+#===============================================================================================
+@pytest.fixture
+def pool():
+    device_pool = FastDevicePool()
+    yield device_pool
+    device_pool.close()
+
+@pytest.fixture
+def catalog(tmp_path, monkeypatch):
+    monkeypatch.setattr(PumpProbe, 'DATA_DIR', str(tmp_path / 'data'))
+    with Catalog.RunCatalog(str(tmp_path / 'catalog.sqlite')) as run_catalog:
+        yield run_catalog
+
+#===============================================================================================
+#   Tests
+#===============================================================================================
+def test_failed_connect_is_recorded_and_the_queue_goes_on(experiment, pool, catalog, tmp_path):
+    broken = copy.deepcopy(experiment)
+    broken.name = 'broken'
+    broken.temperatures = [290.0]
+    broken.devices['cryostat'] = 'missing'
+
+    report = ExperimentQueue.run_queue([broken, experiment], pool, catalog, report_path=str(tmp_path / 'report.json'), keep_order=True)
+
+    failed, finished = report['entries']
+    assert failed['status'] == ExperimentQueue.STATUS_FAILED
+    assert 'FileNotFoundError' in failed['error']
+    assert 'finished' in failed and 'total_time' in failed
+    assert finished['status'] == ExperimentQueue.STATUS_FINISHED
+    assert finished['data_path'] is not None and finished['error'] is None
+
+def test_queue_runs_in_order_without_changing_the_definitions(experiment, pool, catalog):
+    cooled = copy.deepcopy(experiment)
+    cooled.name = 'cooled'
+    cooled.temperatures = [280.0, 290.0]     # the simulated cryostat starts at 300 K - the pass runs down
+
+    report = ExperimentQueue.run_queue([cooled, experiment], pool, catalog)
+
+    assert report['order'] == ['test', 'cooled']
+    assert [entry['queue_index'] for entry in report['entries']] == [1, 0]
+    assert [entry['status'] for entry in report['entries']] == [ExperimentQueue.STATUS_FINISHED] * 2
+    assert report['expected_duration'] == pytest.approx(sum(entry['expected_duration'] for entry in report['entries']))
+    assert cooled.temperatures == [280.0, 290.0]
+    summary = MeasurementWriter.load_summary(report['entries'][1]['data_path'], mmap=False)
+    assert summary['temperature'][0] == 290.0 and summary['temperature'][-1] == 280.0
+
+def test_catalog_temperature_of_a_run_without_temperature_axis(cryostat, experiment, run_scan):
+    cryostat.set_temperature(80.0)
+    _, runs = run_scan(experiment, cryostat=cryostat)
+    assert runs[0]['temperatures'] == pytest.approx([80.0])
+
+    experiment.sample_temperature = PumpProbe.SAMPLE_TEMPERATURE_IN_K
+    assert PumpProbe.catalog_temperatures(experiment, cryostat) == [PumpProbe.SAMPLE_TEMPERATURE_IN_K]
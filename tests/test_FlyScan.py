@@ -0,0 +1,85 @@
+#===============================================================================================
+#   Name:           test_FlyScan.py
+#   Description:    Fly scan binning, and fly scans against step scans on the simulator
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import pytest
+import numpy as np
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import PumpProbe_Galium_300K as PumpProbe
+import devices.Simulated as Simulated
+import scans.FlyScan as FlyScan
+import storage.MeasurementWriter as MeasurementWriter
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+FLY_LOCATIONS_IN_MM = np.linspace(1.5, 0.5, 6)     # on the decay, where the signal changes smoothly
+FLY_SPEED_IN_MM_PER_SEC = 1.0
+FLY_TOLERANCE = 0.05            # a bin averages over its width, the step scan samples its centre
+
+#===============================================================================================
+#   Fixtures
+#===============================================================================================
+@pytest.fixture
+def fast_lockin(stage):
+    # a short time constant, so the filter does not smear the moving signal
+    lockin_dev = Simulated.SimulatedSR860Device(stage=stage, connect_latency=0, command_latency=0, time_constant=1e-3, noise=1e-7)
+    lockin_dev.connect()
+    lockin_dev.calc_capture_freq(1000)
+    yield lockin_dev
+    lockin_dev.close()
+
+#===============================================================================================
+#   Tests
+#===============================================================================================
+def test_grid_edges():
+    np.testing.assert_allclose(FlyScan.grid_edges([0.0, 1.0, 3.0]), [-0.5, 0.5, 2.0, 4.0])
+    np.testing.assert_allclose(FlyScan.grid_edges([3.0, 1.0, 0.0]), [-0.5, 0.5, 2.0, 4.0])
+    np.testing.assert_allclose(FlyScan.grid_edges([2.0]), [2.0, 2.0])
+
+def test_descending_grid_keeps_the_location_order():
+    locations = [2.0, 1.0, 0.0]
+    mean, std, counts = FlyScan.bin_samples_to_grid([2.1, 1.9, 1.2, 0.1, -0.2], [1.0, 3.0, 5.0, 7.0, 9.0], locations)
+    np.testing.assert_allclose(mean, [2.0, 5.0, 8.0])
+    np.testing.assert_allclose(std, [1.0, 0.0, 1.0])
+    np.testing.assert_array_equal(counts, [2, 1, 2])
+
+def test_samples_outside_the_grid_are_dropped():
+    mean, _, counts = FlyScan.bin_samples_to_grid([-0.6, -0.5, 0.2, 2.5, 2.6], [100.0, 1.0, 2.0, 3.0, 100.0], [0.0, 1.0, 2.0])
+    np.testing.assert_array_equal(counts, [2, 0, 1])       # the upper edge belongs to the last bin
+    np.testing.assert_allclose(mean[[0, 2]], [1.5, 3.0])
+
+def test_empty_bins_are_nan():
+    mean, std, counts = FlyScan.bin_samples_to_grid([0.1, 0.2], [1.0, 2.0], [0.0, 1.0, 2.0])
+    np.testing.assert_array_equal(counts, [2, 0, 0])
+    assert np.isnan(mean[1:]).all() and np.isnan(std[1:]).all()
+
+def test_single_point_grid():
+    mean, _, counts = FlyScan.bin_samples_to_grid([0.9, 1.0, 1.0, 1.1], [5.0, 1.0, 3.0, 5.0], [1.0])
+    np.testing.assert_array_equal(counts, [2])
+    np.testing.assert_allclose(mean, [2.0])
+
+def test_fly_scan_matches_a_step_scan(fast_lockin, stage, tmp_path):
+    fly_x, _, counts = FlyScan.fly_scan(fast_lockin, stage, FLY_LOCATIONS_IN_MM, FLY_SPEED_IN_MM_PER_SEC)
+    assert (counts > 0).all()
+    assert stage.velocity == 50.0
+
+    with MeasurementWriter.MeasurementWriter(str(tmp_path / 'step')) as writer:
+        _, step_x, _ = PumpProbe.run_step_scan(fast_lockin, stage, FLY_LOCATIONS_IN_MM, writer, samples_count=20)
+    np.testing.assert_allclose(fly_x, step_x, rtol=FLY_TOLERANCE)
+
+def test_failed_fly_capture_restores_the_stage_speed(fast_lockin, stage):
+    def failing_track_move(*args, **kwargs):
+        raise RuntimeError("controller lost")
+    stage.track_move = failing_track_move
+
+    with pytest.raises(RuntimeError):
+        FlyScan.fly_scan(fast_lockin, stage, FLY_LOCATIONS_IN_MM, FLY_SPEED_IN_MM_PER_SEC)
+    assert stage.velocity == 50.0
@@ -0,0 +1,36 @@
+#===============================================================================================
+#   Name:           test_MeasurementWriter.py
+#   Description:    The summary and raw sample files a simulated step scan writes
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import os
+import numpy as np
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import PumpProbe_Galium_300K as PumpProbe
+import storage.Catalog as Catalog
+import storage.MeasurementWriter as MeasurementWriter
+
+#===============================================================================================
+#   Tests
+#===============================================================================================
+def test_step_scan_writes_every_point(experiment, run_scan):
+    (data_path, locations, measurements_x, x_std), runs = run_scan(experiment)
+
+    summary = MeasurementWriter.load_summary(data_path, mmap=False)
+    assert list(summary['index']) == list(range(len(experiment.locations_in_mm)))
+    np.testing.assert_allclose(summary['position'], experiment.locations_in_mm)
+    np.testing.assert_allclose(summary['x'], measurements_x)
+    assert (summary['n_samples'] == experiment.samples_per_loc).all()
+    assert len(MeasurementWriter.load_raw(data_path)) == summary['n_samples'].sum()
+
+    # the simulated signal peaks after time zero and the scan found it
+    assert measurements_x.max() > 10 * np.median(x_std)
+    assert [run['status'] for run in runs] == [Catalog.STATUS_FINISHED]
+    assert runs[0]['temperatures'] == []
+    assert os.path.exists(data_path + PumpProbe.CSV_SUFFIX)
@@ -0,0 +1,21 @@
+#===============================================================================================
+#   Name:           test_PhaseTimer.py
+#   Description:    Per-phase timing of a simulated step scan
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import scans.PhaseTimer as PhaseTimer
+
+#===============================================================================================
+#   Tests
+#===============================================================================================
+def test_phase_timer_covers_the_points(experiment, run_scan):
+    timer = PhaseTimer.PhaseTimer()
+    timer.start()
+    run_scan(experiment, timer=timer)
+    timer.stop()
+
+    summary = timer.summary()
+    assert summary['points'] == len(experiment.locations_in_mm)
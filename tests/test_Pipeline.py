@@ -0,0 +1,123 @@
+#===============================================================================================
+#   Name:           test_Pipeline.py
+#   Description:    Background point processing - order, back pressure, errors and shutdown
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import time
+import threading
+import pytest
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import scans.Pipeline as Pipeline
+
+#===============================================================================================
+#   Helpers
+#===============================================================================================
+class Failed(Exception):
+    pass
+
+#===============================================================================================
+#   Tests
+#===============================================================================================
+def test_points_are_processed_in_order_on_the_worker():
+    threads = []
+
+    def process(index, value):
+        threads.append(threading.current_thread())
+        return index, value * 2
+
+    with Pipeline.AcquisitionPipeline(process) as pipeline:
+        for index in range(20):
+            pipeline.submit(index, index + 0.5)
+
+    assert pipeline.results == {index: (index, 2 * index + 1.0) for index in range(20)}
+    assert set(threads) != {threading.current_thread()} and len(set(threads)) == 1
+
+def test_full_queue_blocks_submit(metrics):
+    release = threading.Event()
+    pipeline = Pipeline.AcquisitionPipeline(lambda index: release.wait(), max_pending=2)
+    pipeline.start()
+    submitted = []
+
+    def acquire():
+        for index in range(5):
+            pipeline.submit(index)
+            submitted.append(index)
+
+    acquisition = threading.Thread(target=acquire)
+    acquisition.start()
+    acquisition.join(0.3)
+    assert acquisition.is_alive() and len(submitted) <= 3     # one processing, two pending
+
+    release.set()
+    acquisition.join()
+    pipeline.close()
+    assert len(pipeline.results) == 5
+    assert metrics.histogram('pipeline.submit').count == 5
+
+def test_worker_error_is_raised_from_the_next_submit():
+    def process(index):
+        if index == 0:
+            raise Failed()
+
+    pipeline = Pipeline.AcquisitionPipeline(process)
+    pipeline.start()
+    pipeline.submit(0)
+    deadline = time.monotonic() + 5
+    while pipeline.error is None and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+    with pytest.raises(Pipeline.PipelineError) as error:
+        pipeline.submit(1)
+    assert isinstance(error.value.__cause__, Failed)
+    with pytest.raises(Pipeline.PipelineError):
+        pipeline.close()
+
+def test_points_after_a_worker_error_are_drained_not_processed():
+    def process(index):
+        if index == 1:
+            raise Failed()
+        return index
+
+    pipeline = Pipeline.AcquisitionPipeline(process, max_pending=1)
+    pipeline.start()
+    for index in range(3):
+        try:
+            pipeline.submit(index)
+        except Pipeline.PipelineError:
+            break
+    with pytest.raises(Pipeline.PipelineError):
+        pipeline.close()
+    assert pipeline.results == {0: 0}
+    assert pipeline._thread is None
+
+def test_acquisition_error_flushes_the_submitted_points():
+    with pytest.raises(Failed):
+        with Pipeline.AcquisitionPipeline(lambda index: index) as pipeline:
+            pipeline.submit(0)
+            pipeline.submit(1)
+            raise Failed()
+
+    assert pipeline.results == {0: 0, 1: 1}
+
+def test_acquisition_error_wins_over_a_worker_error():
+    def process(index):
+        raise ValueError("bad point")
+
+    with pytest.raises(Failed):
+        with Pipeline.AcquisitionPipeline(process) as pipeline:
+            pipeline.submit(0)
+            raise Failed()
+    assert isinstance(pipeline.error, ValueError)
+
+def test_close_is_idempotent():
+    pipeline = Pipeline.AcquisitionPipeline(lambda index: index)
+    pipeline.close()
+    pipeline.start()
+    pipeline.close()
+    pipeline.close()
@@ -0,0 +1,64 @@
+#===============================================================================================
+#   Name:           test_PumpProbe.py
+#   Description:    Connecting and closing the devices of PumpProbe_Galium_300K, in and out of an event loop
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import asyncio
+import pytest
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import PumpProbe_Galium_300K as PumpProbe
+import devices.AutoLabDevice as AutoLabDevice
+import devices.Simulated as Simulated
+
+#===============================================================================================
+#   Helpers
+#===============================================================================================
+class Interrupted(Exception):
+    pass
+
+class BrokenDevice(AutoLabDevice.AutoLabDevice):
+
+    def connect(self):
+        raise Interrupted()
+
+def fast_stage():
+    return Simulated.SimulatedStandaDevice(command_latency=0, connect_latency=0)
+
+#===============================================================================================
+#   Tests
+#===============================================================================================
+def test_connect_devices():
+    stage_dev = fast_stage()
+    lockin_dev = Simulated.SimulatedSR860Device(stage=stage_dev, connect_latency=0, command_latency=0)
+    assert PumpProbe.connect_devices(stage_dev, lockin_dev)
+    assert stage_dev.is_connected and lockin_dev.is_connected
+    PumpProbe.close_devices(stage_dev, lockin_dev)
+    assert not stage_dev.is_connected and not lockin_dev.is_connected
+
+def test_connect_devices_in_a_running_event_loop():
+    stage_dev = fast_stage()
+
+    async def notebook_cell():
+        connected = PumpProbe.connect_devices(stage_dev)
+        PumpProbe.close_devices(stage_dev)
+        return connected
+
+    assert asyncio.run(notebook_cell())
+    assert not stage_dev.is_connected
+
+@pytest.mark.parametrize('in_loop', [False, True])
+def test_unexpected_connect_error_closes_the_connected_devices(in_loop):
+    stage_dev = fast_stage()
+
+    async def connect_in_loop():
+        return PumpProbe.connect_devices(stage_dev, BrokenDevice())
+
+    with pytest.raises(Interrupted):
+        asyncio.run(connect_in_loop()) if in_loop else PumpProbe.connect_devices(stage_dev, BrokenDevice())
+    assert not stage_dev.is_connected
@@ -0,0 +1,135 @@
+#===============================================================================================
+#   Name:           test_RingBuffer.py
+#   Description:    SampleRingBuffer wrapping and overwrite reporting
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import sys
+import time
+import threading
+import numpy as np
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import storage.RingBuffer as RingBuffer
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+CAPACITY = 10
+
+#===============================================================================================
+#   Helpers
+#===============================================================================================
+def samples(start, stop):
+    """
+    A (t, x, y, r) block whose values are the sample index
+    """
+    index = np.arange(start, stop, dtype=float)
+    return np.vstack([index, index, -index, 2 * index])
+
+#===============================================================================================
+#   Tests
+#===============================================================================================
+def test_wrapping_range_is_split_into_two_views():
+    ring = RingBuffer.SampleRingBuffer(CAPACITY)
+    ring.append(samples(0, 8))
+    ring.append(samples(8, 14))
+    assert ring.written == 14 and ring.oldest == 4 and len(ring) == CAPACITY
+
+    views = ring.views(6, 13)
+    assert len(views) == 2
+    assert all(view.base is not None for view in views)
+    np.testing.assert_array_equal(np.concatenate(views, axis=1), samples(6, 13))
+    np.testing.assert_array_equal(ring.read(6, 13), samples(6, 13))
+    assert len(ring.views(4, 8)) == 1
+
+def test_block_larger_than_the_ring_keeps_the_newest():
+    ring = RingBuffer.SampleRingBuffer(CAPACITY)
+    ring.append(samples(0, 25))
+    assert ring.oldest == 15
+    np.testing.assert_array_equal(ring.read(15, 25), samples(15, 25))
+
+def test_overwritten_or_unwritten_range_is_none():
+    ring = RingBuffer.SampleRingBuffer(CAPACITY)
+    ring.append(samples(0, 15))
+    assert ring.views(3, 8) is None             # overwritten
+    assert ring.views(10, 16) is None           # not written yet
+    assert ring.read(8, 3) is None
+
+def test_window_by_time():
+    ring = RingBuffer.SampleRingBuffer(CAPACITY)
+    ring.append(samples(0, 8))
+    np.testing.assert_array_equal(ring.window(2.5, 5.0), samples(3, 5))
+
+    ring.append(samples(8, 16))
+    np.testing.assert_array_equal(ring.window(9.0, 12.0), samples(9, 12))
+    assert ring.window(2.5, 5.0) is None
+    assert ring.latest_time() == 15.0
+    assert ring.wait_for_time(15.0, timeout=0)
+    assert not ring.wait_for_time(16.0, timeout=0)
+
+class PausingArray(np.ndarray):
+    """
+    Ring storage whose writes stop after the first slice is copied, until resumed
+    """
+
+    def __setitem__(self, key, value):
+        super(PausingArray, self).__setitem__(key, value)
+        if getattr(self, 'paused', None) is not None and not self.paused.is_set():
+            self.paused.set()
+            self.resume.wait()
+
+def test_lookup_during_a_wrapping_append():
+    ring = RingBuffer.SampleRingBuffer(CAPACITY)
+    ring.append(samples(0, CAPACITY))
+    ring._data = ring._data.view(PausingArray)
+    ring._data.paused, ring._data.resume = threading.Event(), threading.Event()
+
+    # the producer stops with the oldest samples 0..6 overwritten by 10..16, the consumer looks up sample 7
+    producer = threading.Thread(target=ring.append, args=(samples(CAPACITY, CAPACITY + 7), ))
+    producer.start()
+    assert ring._data.paused.wait(5)
+    found = []
+    consumer = threading.Thread(target=lambda: found.append((ring.sequence_at(7.0), ring.window(7.0, 9.0))))
+    consumer.start()
+    consumer.join(0.2)
+    ring._data.resume.set()
+    producer.join()
+    consumer.join()
+
+    sequence, window = found[0]
+    assert sequence == 7
+    np.testing.assert_array_equal(window, samples(7, 9))
+
+def test_concurrent_reads_of_a_wrapping_ring():
+    ring = RingBuffer.SampleRingBuffer(CAPACITY)
+    block, duration = 7, 0.5
+    stop = threading.Event()
+
+    def produce():
+        while not stop.is_set():
+            ring.append(samples(ring.written, ring.written + block))
+
+    ring.append(samples(0, CAPACITY))
+    producer = threading.Thread(target=produce)
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    producer.start()
+    errors = []
+    try:
+        end_time = time.perf_counter() + duration
+        while time.perf_counter() < end_time:
+            t = ring.oldest + block      # the oldest sample after the next append
+            sequence = ring.sequence_at(t)
+            # timestamps are the sequence numbers - a sample still held must be found exactly
+            if sequence != t and t >= ring.oldest:
+                errors.append((t, sequence))
+    finally:
+        stop.set()
+        producer.join()
+        sys.setswitchinterval(switch_interval)
+    assert not errors
@@ -0,0 +1,73 @@
+#===============================================================================================
+#   Name:           test_SR860.py
+#   Description:    Lock-in filter tables and the capture rate plan
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import pytest
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import devices.SR860 as SR860
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+TIME_CONSTANT_IN_SEC = 0.01
+AVAILABLE_FREQUENCIES = [1250.0 / 2 ** n for n in range(12)]
+INDEPENDENT_SAMPLES = 40
+
+#===============================================================================================
+#   Helpers
+#===============================================================================================
+def capture_duration(freq, filter_slope):
+    plan = SR860.plan_capture(INDEPENDENT_SAMPLES, TIME_CONSTANT_IN_SEC, filter_slope, [freq])
+    return plan['capture_duration']
+
+#===============================================================================================
+#   Tests
+#===============================================================================================
+@pytest.mark.parametrize('filter_slope, bandwidth, settle', [(6, 25.0, 4.6), (12, 12.5, 6.6), (18, 9.375, 8.4), (24, 7.8125, 10.0)])
+def test_filter_tables(filter_slope, bandwidth, settle):
+    assert SR860.noise_bandwidth(TIME_CONSTANT_IN_SEC, filter_slope) == pytest.approx(bandwidth)
+    assert SR860.equivalent_time_constant(TIME_CONSTANT_IN_SEC, filter_slope) == pytest.approx(1 / (4 * bandwidth))
+
+    plan = SR860.plan_capture(INDEPENDENT_SAMPLES, TIME_CONSTANT_IN_SEC, filter_slope, AVAILABLE_FREQUENCIES)
+    assert plan['settle_time'] == pytest.approx(settle * TIME_CONSTANT_IN_SEC)
+    assert plan['noise_bandwidth'] == pytest.approx(bandwidth)
+
+def test_first_order_filter_is_its_own_equivalent():
+    assert SR860.equivalent_time_constant(TIME_CONSTANT_IN_SEC, 6) == pytest.approx(TIME_CONSTANT_IN_SEC)
+
+@pytest.mark.parametrize('filter_slope', [6, 12, 18, 24])
+def test_slowest_rate_within_the_efficiency_bound(filter_slope):
+    plan = SR860.plan_capture(INDEPENDENT_SAMPLES, TIME_CONSTANT_IN_SEC, filter_slope, AVAILABLE_FREQUENCIES)
+    shortest_duration = INDEPENDENT_SAMPLES / (2 * SR860.noise_bandwidth(TIME_CONSTANT_IN_SEC, filter_slope))
+
+    assert plan['target_met']
+    assert plan['capture_duration'] * SR860.CAPTURE_EFFICIENCY <= shortest_duration
+    assert plan['capture_duration'] == pytest.approx(plan['samples_count'] / plan['sample_frequency'])
+    assert plan['samples_count'] >= INDEPENDENT_SAMPLES
+    slower = [freq for freq in AVAILABLE_FREQUENCIES if freq < plan['sample_frequency']]
+    assert all(capture_duration(freq, filter_slope) * SR860.CAPTURE_EFFICIENCY > shortest_duration for freq in slower)
+
+def test_unreachable_target_takes_the_fastest_rate(caplog):
+    plan = SR860.plan_capture(INDEPENDENT_SAMPLES, TIME_CONSTANT_IN_SEC, 6, AVAILABLE_FREQUENCIES[-3:])
+    assert not plan['target_met']
+    assert plan['sample_frequency'] == max(AVAILABLE_FREQUENCIES[-3:])
+    assert 'No capture rate' in caplog.text
+
+def test_invalid_plan_inputs():
+    with pytest.raises(ValueError):
+        SR860.plan_capture(INDEPENDENT_SAMPLES, TIME_CONSTANT_IN_SEC, 6, [])
+    with pytest.raises(ValueError):
+        SR860.plan_capture(INDEPENDENT_SAMPLES, TIME_CONSTANT_IN_SEC, 9, AVAILABLE_FREQUENCIES)
+
+def test_auto_configure_applies_the_plan(lockin):
+    plan = lockin.auto_configure(INDEPENDENT_SAMPLES)
+    assert lockin.sample_frequency == plan['sample_frequency']
+    assert lockin.settle_time == plan['settle_time']
+    assert plan['time_constant'] == lockin.time_constant
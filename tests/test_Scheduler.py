@@ -0,0 +1,83 @@
+#===============================================================================================
+#   Name:           test_Scheduler.py
+#   Description:    Axis nesting, serpentine visit order and duration estimates of the scan scheduler
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import pytest
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import scans.Scheduler as Scheduler
+
+#===============================================================================================
+#   Helpers
+#===============================================================================================
+class FakeCryostat(object):
+
+    def __init__(self, readings):
+        self.readings = list(readings)
+
+    def get_temperature(self):
+        return self.readings.pop(0) if len(self.readings) > 1 else self.readings[0]
+
+def recording_axis(name, values, cost, serpentine=True, log=None):
+    log = log if log is not None else []
+    return Scheduler.Axis(name, values, lambda value: log.append((name, value)), cost, serpentine)
+
+def position_axis(log=None):
+    return recording_axis('position', [0.0, 1.0, 2.0], lambda a, b: 1.0 + abs(b - a), log=log)
+
+def temperature_axis(log=None):
+    return recording_axis('temperature', [10.0, 20.0], lambda a, b: 100.0, serpentine=False, log=log)
+
+def column(plan, name):
+    return [point[name] for point in plan]
+
+#===============================================================================================
+#   Tests
+#===============================================================================================
+def test_the_slowest_axis_is_outermost():
+    scheduler = Scheduler.ScanScheduler([position_axis(), temperature_axis()])
+    assert [axis.name for axis in scheduler.nested_axes] == ['temperature', 'position']
+    assert len(scheduler) == 6
+
+    scheduler = Scheduler.ScanScheduler([position_axis(), temperature_axis()], order=['position', 'temperature'])
+    assert [axis.name for axis in scheduler.nested_axes] == ['position', 'temperature']
+
+def test_inner_axes_sweep_back_and_forth():
+    plan = Scheduler.ScanScheduler([position_axis(), temperature_axis()]).plan()
+    assert column(plan, 'temperature') == [10.0, 10.0, 10.0, 20.0, 20.0, 20.0]
+    assert column(plan, 'position') == [0.0, 1.0, 2.0, 2.0, 1.0, 0.0]
+
+def test_serpentine_over_three_axes():
+    gain = recording_axis('gain', ['a', 'b'], lambda a, b: 0.01)
+    plan = Scheduler.ScanScheduler([gain, position_axis(), temperature_axis()]).plan()
+    assert column(plan, 'position') == [0.0, 0.0, 1.0, 1.0, 2.0, 2.0, 2.0, 2.0, 1.0, 1.0, 0.0, 0.0]
+    assert column(plan, 'gain') == ['a', 'b', 'b', 'a', 'a', 'b', 'b', 'a', 'a', 'b', 'b', 'a']
+
+def test_non_serpentine_axes_keep_their_order():
+    plan = Scheduler.ScanScheduler([position_axis(), temperature_axis()], order=['position', 'temperature']).plan()
+    assert column(plan, 'temperature') == [10.0, 20.0] * 3
+
+def test_estimate_duration():
+    scheduler = Scheduler.ScanScheduler([position_axis(), temperature_axis()])
+    # one temperature change, four 1 mm moves (1 + 1 sec each) and 6 points of 0.5 sec
+    assert scheduler.estimate_duration(0.5) == pytest.approx(100.0 + 4 * 2.0 + 6 * 0.5)
+    assert scheduler.estimate_duration(0.5, start={'position': 2.0, 'temperature': 20.0}) == pytest.approx(100.0 + 3.0 + 100.0 + 8.0 + 3.0)
+
+def test_run_sets_only_the_changed_axes():
+    log = []
+    scheduler = Scheduler.ScanScheduler([position_axis(log), temperature_axis(log)])
+    results = scheduler.run(lambda index, point: index * 10, skip={1})
+
+    assert results == [0, None, 20, 30, 40, 50]
+    assert log == [('temperature', 10.0), ('position', 0.0), ('position', 2.0), ('temperature', 20.0), ('position', 1.0),
+                   ('position', 0.0)]
+
+def test_wait_for_temperature():
+    assert Scheduler.wait_for_temperature(FakeCryostat([50.0, None, 20.05]), 20.0, tolerance=0.1, timeout=1.0, poll_interval=0)
+    assert not Scheduler.wait_for_temperature(FakeCryostat([50.0]), 20.0, timeout=0.01, poll_interval=0)
@@ -0,0 +1,49 @@
+#===============================================================================================
+#   Name:           test_Statistics.py
+#   Description:    RunningStats accumulation and merging
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import numpy as np
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import scans.Statistics as Statistics
+
+#===============================================================================================
+#   Tests
+#===============================================================================================
+def test_update_matches_numpy():
+    samples = np.random.default_rng(0).normal(1.0, 2.0, (100, 4))
+    stats = Statistics.RunningStats(4)
+    for block in np.array_split(samples, 7):
+        stats.update(block)
+
+    np.testing.assert_array_equal(stats.count, 100)
+    np.testing.assert_allclose(stats.mean, samples.mean(axis=0))
+    np.testing.assert_allclose(stats.variance, samples.var(axis=0, ddof=1))
+    np.testing.assert_allclose(stats.standard_error, samples.std(axis=0, ddof=1) / 10)
+
+def test_merge_equals_the_combined_samples():
+    rng = np.random.default_rng(1)
+    first, second = rng.normal(0.0, 1.0, (30, 3)), rng.normal(5.0, 3.0, (70, 3))
+    stats_first, stats_second, stats_all = Statistics.RunningStats(3), Statistics.RunningStats(3), Statistics.RunningStats(3)
+    stats_first.update(first)
+    stats_second.update(second)
+    stats_all.update(np.concatenate([first, second]))
+
+    total = Statistics.merged(stats_first, stats_second)
+    np.testing.assert_array_equal(total.count, stats_all.count)
+    np.testing.assert_allclose(total.mean, stats_all.mean)
+    np.testing.assert_allclose(total.m2, stats_all.m2)
+    np.testing.assert_array_equal(stats_first.count, 30)        # merged() leaves its inputs alone
+
+def test_merge_with_empty_stats():
+    stats = Statistics.RunningStats()
+    stats.update([1.0, 2.0, 3.0])
+    total = Statistics.merged(Statistics.RunningStats(), stats)
+    assert total.count == 3 and total.mean == 2.0 and total.variance == 1.0
+    assert np.isnan(Statistics.RunningStats().variance)
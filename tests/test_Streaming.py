@@ -0,0 +1,75 @@
+#===============================================================================================
+#   Name:           test_Streaming.py
+#   Description:    Stream captures handed to the pipeline and failed point captures
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import pytest
+import numpy as np
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import PumpProbe_Galium_300K as PumpProbe
+import devices.AutoLabDevice as AutoLabDevice
+import scans.Checkpoint as Checkpoint
+import storage.Catalog as Catalog
+import storage.MeasurementWriter as MeasurementWriter
+
+#===============================================================================================
+#   Helpers
+#===============================================================================================
+def fail_captures(lockin, failures):
+    """
+    Makes the lock-in's next captures come back empty, like an overwritten stream window.
+    failures is the number of failing captures, or a predicate of the capture number.
+    """
+    capture_samples = lockin.capture_samples
+    captures = []
+
+    def failing_capture(*args, **kwargs):
+        captures.append(args)
+        fails = failures(len(captures)) if callable(failures) else len(captures) <= failures
+        return (None, None, None) if fails else capture_samples(*args, **kwargs)
+
+    lockin.capture_samples = failing_capture
+    return lambda: setattr(lockin, 'capture_samples', capture_samples)
+
+#===============================================================================================
+#   Tests
+#===============================================================================================
+def test_stream_capture_is_copied_for_the_pipeline(experiment, run_scan):
+    experiment.capture_mode = 'stream'
+    (data_path, _, measurements_x, _), _ = run_scan(experiment)
+
+    summary = MeasurementWriter.load_summary(data_path, mmap=False)
+    raw = MeasurementWriter.load_raw(data_path, mmap=False)
+    for row, x in zip(summary, measurements_x):
+        np.testing.assert_allclose(MeasurementWriter.raw_samples_of_row(raw, row)['x'].mean(), x, rtol=1e-5)
+
+def test_owned_samples_detaches_views():
+    ring = np.arange(10.0)
+    samples = PumpProbe.owned_samples((ring[2:5], np.ones(3), None))
+    ring[:] = -1
+    np.testing.assert_array_equal(samples[0], [2, 3, 4])
+    assert samples[2] is None
+
+def test_failed_capture_is_retried(lockin, experiment, run_scan):
+    fail_captures(lockin, PumpProbe.CAPTURE_ATTEMPTS - 1)
+    (data_path, _, measurements_x, _), runs = run_scan(experiment)
+    assert np.isfinite(measurements_x).all()
+    assert [run['status'] for run in runs] == [Catalog.STATUS_FINISHED]
+
+def test_failed_point_stops_the_scan_and_resumes(lockin, experiment, tmp_path, run_scan):
+    restore = fail_captures(lockin, lambda capture: capture > 2)
+    with pytest.raises(AutoLabDevice.AutoLabDeviceError, match='location'):
+        run_scan(experiment)
+    restore()
+
+    data_path = str(tmp_path / 'run')
+    assert len(Checkpoint.load_checkpoint(data_path).completed) == 2
+    (_, _, measurements_x, _), _ = run_scan(experiment, resume=True)
+    assert np.isfinite(measurements_x).all()
+    assert Checkpoint.load_checkpoint(data_path).finished
@@ -0,0 +1,84 @@
+#===============================================================================================
+#   Name:           test_SweepAverager.py
+#   Description:    Sweep averaging, direction bookkeeping, outlier sweep rejection and multi-temperature averages
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import numpy as np
+import pandas as pd
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import scans.SweepAverager as SweepAverager
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+POINTS = 8
+NOISE = 0.01
+
+#===============================================================================================
+#   Helpers
+#===============================================================================================
+def sweeps(count, seed=0):
+    signal = np.sin(np.linspace(0, np.pi, POINTS))
+    return signal, signal + np.random.default_rng(seed).normal(0, NOISE, (count, POINTS))
+
+#===============================================================================================
+#   Tests
+#===============================================================================================
+def test_average_of_both_directions():
+    signal, values = sweeps(6)
+    averager = SweepAverager.SweepAverager(POINTS)
+    for index, sweep in enumerate(values):
+        assert averager.add_sweep(sweep, direction=1 if index % 2 == 0 else -1, sweep=index)
+
+    assert averager.accepted == 6
+    np.testing.assert_allclose(averager.mean, values.mean(axis=0))
+    np.testing.assert_array_equal(averager.directions[1].count, 3)
+    np.testing.assert_allclose(averager.standard_error, values.std(axis=0, ddof=1) / np.sqrt(6))
+    assert averager.converged(10 * NOISE)
+    assert not averager.converged(NOISE / 100)
+
+def test_outlier_sweep_is_dropped():
+    signal, values = sweeps(5)
+    averager = SweepAverager.SweepAverager(POINTS)
+    for index, sweep in enumerate(values[:3]):
+        averager.add_sweep(sweep, sweep=index)
+
+    assert not averager.add_sweep(signal + 1.0, sweep='glitch')
+    assert averager.rejected == ['glitch']
+    assert averager.add_sweep(values[3], sweep=3)
+    assert averager.accepted == 4
+    np.testing.assert_allclose(averager.mean, values[:4].mean(axis=0))
+
+def test_outliers_are_not_judged_too_early():
+    signal, values = sweeps(2)
+    averager = SweepAverager.SweepAverager(POINTS)
+    averager.add_sweep(values[0])
+    averager.add_sweep(values[1])
+    assert averager.add_sweep(signal + 1.0)
+
+    averager = SweepAverager.SweepAverager(POINTS, outlier_factor=None)
+    for sweep in values:
+        averager.add_sweep(sweep)
+    averager.add_sweep(values[0])
+    assert averager.add_sweep(signal + 1.0)
+    assert not averager.rejected
+
+def test_multi_sweep_average_holds_every_temperature(cryostat, experiment, tmp_path, run_scan):
+    experiment.sweeps = 2
+    experiment.temperatures = [290.0, 295.0]
+    average_path = str(tmp_path / 'average.csv')
+    (_, locations, measurements_x, _), runs = run_scan(experiment, cryostat=cryostat, average_path=average_path)
+
+    assert measurements_x.shape == (2, len(locations))
+    average = pd.read_csv(average_path)
+    assert sorted(set(average['T'])) == [290.0, 295.0]
+    assert len(average) == 2 * len(locations)
+    np.testing.assert_allclose(average['DR'], np.concatenate(measurements_x), rtol=1e-6)
+    assert (average['sweeps'] == 2).all()
+    assert runs[0]['temperatures'] == [290.0, 295.0]
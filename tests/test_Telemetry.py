@@ -0,0 +1,109 @@
+#===============================================================================================
+#   Name:           test_Telemetry.py
+#   Description:    Histogram bucketing and quantiles, metrics counters, gauges and timers
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import pytest
+import numpy as np
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import devices.Telemetry as Telemetry
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+BOUNDS = [1.0, 2.0, 4.0, 8.0]
+
+#===============================================================================================
+#   Tests
+#===============================================================================================
+@pytest.mark.parametrize('value, bucket', [(0.5, 0), (1.0, 0), (1.5, 1), (2.0, 1), (8.0, 3), (9.0, 4)])
+def test_value_lands_in_the_bucket_of_its_upper_bound(value, bucket):
+    histogram = Telemetry.Histogram(BOUNDS)
+    histogram.observe(value)
+    assert histogram.buckets.index(1) == bucket and sum(histogram.buckets) == 1
+
+def test_default_bounds_are_four_per_decade():
+    bounds = Telemetry.BUCKET_BOUNDS_IN_SEC
+    assert bounds[0] == pytest.approx(1e-6) and bounds[-1] == pytest.approx(1e3)
+    assert np.allclose(np.diff(np.log10(bounds)), 0.25)
+
+def test_empty_histogram():
+    histogram = Telemetry.Histogram(BOUNDS)
+    assert histogram.quantile(0.5) is None
+    summary = histogram.snapshot()
+    assert summary['count'] == 0 and summary['mean'] is None and summary['min'] is None and summary['max'] is None
+    assert summary['buckets'] == {} and summary['p50'] is None
+
+def test_quantiles_of_a_known_distribution():
+    histogram = Telemetry.Histogram(BOUNDS)
+    for value in [0.5] * 50 + [1.5] * 40 + [3.0] * 9 + [20.0]:
+        histogram.observe(value)
+    assert histogram.quantile(0.5) == 1.0
+    assert histogram.quantile(0.9) == 2.0
+    assert histogram.quantile(0.99) == 4.0
+    assert histogram.quantile(1.0) == 20.0         # the open last bucket reports the max
+
+def test_quantile_is_capped_by_the_max():
+    histogram = Telemetry.Histogram(BOUNDS)
+    for value in [2.5, 3.0]:
+        histogram.observe(value)
+    assert histogram.quantile(0.5) == 3.0
+
+def test_quantiles_of_log_uniform_durations_are_within_a_bucket():
+    values = np.logspace(-4, 0, 10001)
+    histogram = Telemetry.Histogram()
+    for value in values:
+        histogram.observe(value)
+    ratio = 10 ** 0.25
+    for q in Telemetry.QUANTILES:
+        exact = np.quantile(values, q)
+        assert exact <= histogram.quantile(q) <= exact * ratio
+
+def test_histogram_snapshot():
+    histogram = Telemetry.Histogram(BOUNDS)
+    for value in [0.5, 1.5, 1.5, 9.0]:
+        histogram.observe(value)
+    summary = histogram.snapshot()
+    assert summary['count'] == 4 and summary['sum'] == pytest.approx(12.5) and summary['mean'] == pytest.approx(3.125)
+    assert summary['min'] == 0.5 and summary['max'] == 9.0 and summary['last'] == 9.0
+    assert summary['buckets'] == {'1': 1, '2': 2, 'inf': 1}
+    assert set(summary) >= {'p50', 'p90', 'p99'}
+
+def test_counters_gauges_and_histograms_are_created_on_first_use():
+    metrics = Telemetry.Metrics()
+    metrics.increment('captures')
+    metrics.increment('captures', 2)
+    metrics.set_gauge('temperature', 290.0)
+    metrics.set_gauge('temperature', 280.0)
+    metrics.observe('move', 0.25)
+    assert metrics.histogram('move') is metrics.histogram('move')
+
+    snapshot = metrics.snapshot()
+    assert snapshot['counters'] == {'captures': 3}
+    assert snapshot['gauges'] == {'temperature': 280.0}
+    assert snapshot['histograms']['move']['count'] == 1 and snapshot['uptime'] >= 0
+
+def test_timed_records_the_duration_and_counts_errors():
+    metrics = Telemetry.Metrics()
+    with metrics.timed('capture'):
+        pass
+    with pytest.raises(RuntimeError):
+        with metrics.timed('capture'):
+            raise RuntimeError("lost lock")
+    assert metrics.histogram('capture').count == 2
+    assert metrics.counters == {'capture.errors': 1}
+
+def test_reset_clears_everything():
+    metrics = Telemetry.Metrics()
+    metrics.increment('captures')
+    metrics.set_gauge('temperature', 290.0)
+    metrics.observe('move', 0.25)
+    metrics.reset()
+    snapshot = metrics.snapshot()
+    assert snapshot['counters'] == {} and snapshot['gauges'] == {} and snapshot['histograms'] == {}
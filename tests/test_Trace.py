@@ -0,0 +1,86 @@
+#===============================================================================================
+#   Name:           test_Trace.py
+#   Description:    Record a simulated lock-in session, then replay it without the instrument
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import pytest
+import numpy as np
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import devices.SR860 as SR860
+import devices.Simulated as Simulated
+import devices.Trace as Trace
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+CAPTURE_RATE_IN_HZ = 100
+SAMPLES_COUNT = 20
+
+#===============================================================================================
+#   Helpers
+#===============================================================================================
+class TracedSR860Device(SR860.SR860Device):
+    """
+    The real SR860Device connect path (Trace.open_channel) over a simulated instrument
+    """
+
+    def __init__(self):
+        super(TracedSR860Device, self).__init__()
+        self.opened = 0
+
+    def _open_lockin(self):
+        self.opened += 1
+        return Simulated._SimulatedSR860(command_latency=0)
+
+def session():
+    lockin = TracedSR860Device()
+    lockin.connect()
+    lockin.calc_capture_freq(CAPTURE_RATE_IN_HZ)
+    samples = lockin.capture_samples(SAMPLES_COUNT)
+    return lockin, samples
+
+#===============================================================================================
+#   Fixtures
+#===============================================================================================
+@pytest.fixture
+def trace_path(tmp_path):
+    yield str(tmp_path / 'session.trace.gz')
+    Trace.stop()
+
+#===============================================================================================
+#   Tests
+#===============================================================================================
+def test_replay_returns_the_recorded_responses(trace_path):
+    recorder = Trace.start_recording(trace_path)
+    recorded_lockin, recorded = session()
+    Trace.stop()
+    assert recorded_lockin.opened == 1
+    assert recorder.calls > 0
+
+    replayer = Trace.start_replay(trace_path, time_scale=0)
+    assert Trace.is_replaying()
+    replayed_lockin, replayed = session()
+
+    assert replayed_lockin.opened == 0
+    assert replayed_lockin.sample_frequency == recorded_lockin.sample_frequency
+    for recorded_channel, replayed_channel in zip(recorded, replayed):
+        np.testing.assert_array_equal(replayed_channel, recorded_channel)
+    assert replayer.calls == recorder.calls
+    assert replayer.mismatched == 0
+
+def test_unrecorded_call_fails_on_replay(trace_path):
+    Trace.start_recording(trace_path)
+    TracedSR860Device().connect()
+    Trace.stop()
+
+    Trace.start_replay(trace_path, time_scale=0)
+    lockin = TracedSR860Device()
+    lockin.connect()
+    with pytest.raises(Trace.TraceError):
+        lockin.calc_capture_freq(CAPTURE_RATE_IN_HZ)
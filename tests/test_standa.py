@@ -0,0 +1,75 @@
+#===============================================================================================
+#   Name:           test_standa.py
+#   Description:    Status driven settle detection of the stage (wait_for_position)
+#   Author:         Noam Kovartovsky
+#===============================================================================================
+#===============================================================================================
+#   Python Imports
+#===============================================================================================
+import pytest
+
+#===============================================================================================
+#   Solution Imports
+#===============================================================================================
+import devices.AutoLabDevice as AutoLabDevice
+import devices.standa as standa
+
+#===============================================================================================
+#   Constants
+#===============================================================================================
+TARGET_IN_MM = 1.0
+TOLERANCE_IN_MM = 0.001
+
+#===============================================================================================
+#   Helpers
+#===============================================================================================
+def scripted(*statuses):
+    """
+    get_move_status returning the given (position, moving, alarm) statuses, then the last one again
+    """
+    polls = []
+
+    def get_move_status():
+        polls.append(len(polls))
+        return statuses[min(len(polls), len(statuses)) - 1]
+
+    get_move_status.polls = polls
+    return get_move_status
+
+def wait(get_move_status, timeout=1.0):
+    return standa.wait_for_position(get_move_status, TARGET_IN_MM, tolerance=TOLERANCE_IN_MM, stable_polls=3, timeout=timeout, poll_interval=0)
+
+#===============================================================================================
+#   Tests
+#===============================================================================================
+def test_settles_after_stable_stopped_polls():
+    status = scripted((0.5, True, False), (0.9995, True, False), (1.0002, True, False), (1.0001, False, False), (1.0, False, False),
+                      (1.0, False, False))
+    arrival_time, settled_time, position = wait(status)
+    assert position == 1.0
+    assert arrival_time < settled_time
+    assert len(status.polls) == 6
+
+def test_leaving_the_window_restarts_the_settle():
+    status = scripted((1.0, False, False), (1.0, False, False), (1.01, True, False), (1.0, False, False), (1.0, False, False),
+                      (1.0, False, False))
+    wait(status)
+    assert len(status.polls) == 6
+
+def test_alarm_fails_the_move():
+    with pytest.raises(AutoLabDevice.StageMoveError, match='alarm'):
+        wait(scripted((0.5, True, False), (0.6, True, True)))
+
+def test_failed_status_read_fails_the_move():
+    with pytest.raises(AutoLabDevice.StageMoveError, match='status'):
+        wait(scripted((0.5, True, False), None))
+
+def test_stopping_outside_the_window_fails_the_move():
+    status = scripted((0.5, True, False), (0.98, False, False))
+    with pytest.raises(AutoLabDevice.StageMoveError, match='outside'):
+        wait(status)
+    assert len(status.polls) == 4
+
+def test_timeout_fails_the_move():
+    with pytest.raises(AutoLabDevice.StageMoveError, match='within'):
+        wait(scripted((0.5, True, False)), timeout=0.01)